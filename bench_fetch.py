@@ -0,0 +1,76 @@
+"""Compare the serial fetch loop with the async fetch engine against a local stub server.
+
+    python bench_fetch.py --pages 200 --latency 0.05 --per-host 8 --rate 200
+    python bench_fetch.py --page product --latency 0 --per-host 16 --parse-workers 8
+"""
+import argparse
+import os
+import time
+import requests
+import fetcher
+import http_client
+from parsers import parse_products
+from product_details_scraper import parse_details
+from stub_server import StubServer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PAGES = {
+    'listing': ('item_list.html', parse_products),
+    'product': ('product.html', parse_details),
+}
+
+def bench_serial(urls, parse):
+    """Fetch and parse every URL one after the other, as the scrapers used to"""
+    start = time.perf_counter()
+    for url in urls:
+        response = requests.get(url, headers=http_client.HEADERS, timeout=20)
+        response.raise_for_status()
+        parse(response.text, url)
+    return len(urls) / (time.perf_counter() - start)
+
+def bench_async(urls, parse, rate, per_host, parse_workers=0):
+    """Fetch and parse every URL through fetcher.crawl"""
+    done = []
+    start = time.perf_counter()
+    fetcher.crawl(urls, lambda url: url, parse, lambda url, result: done.append(result),
+                  rate=rate, per_host=per_host, burst=per_host, parse_workers=parse_workers)
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for result in done if result is None)
+    if failed:
+        print(f"Warning: {failed} pages failed")
+    return len(done) / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--page', choices=sorted(PAGES), default='listing',
+                        help='Fixture page served by the stub and the parser run on it')
+    parser.add_argument('--latency', type=float, default=0.05, help='Simulated server latency in seconds')
+    parser.add_argument('--rate', type=float, default=200.0)
+    parser.add_argument('--per-host', type=int, default=8)
+    parser.add_argument('--parse-workers', type=int, default=0,
+                        help='Also run the async path with this many parser processes')
+    args = parser.parse_args()
+
+    fixture, parse = PAGES[args.page]
+    with open(os.path.join(FIXTURES, fixture), 'rb') as f:
+        page = f.read()
+
+    with StubServer(default_page=page, latency=args.latency) as server:
+        urls = [f"{server.url}/PBSCCatalog.asp?PBCATID={i}" for i in range(args.pages)]
+        serial = bench_serial(urls, parse)
+        concurrent = bench_async(urls, parse, args.rate, args.per_host)
+        pooled = None
+        if args.parse_workers:
+            pooled = bench_async(urls, parse, args.rate, args.per_host, args.parse_workers)
+
+    print(f"Pages: {args.pages} x {fixture}, simulated latency: {args.latency * 1000:.0f} ms")
+    print(f"Serial:  {serial:8.1f} pages/sec")
+    print(f"Async:   {concurrent:8.1f} pages/sec (per-host {args.per_host}, rate {args.rate}/s)")
+    if pooled:
+        print(f"Pool:    {pooled:8.1f} pages/sec ({args.parse_workers} parser processes)")
+    print(f"Speedup: {max(concurrent, pooled or 0) / serial:8.1f}x")
+    print(http_client.format_stats())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Time reading and writing products.json the old way and through the fast path of sinks.py.
+
+    python bench_json.py --products 100000
+"""
+import argparse
+import json
+import numbers
+import os
+import random
+import tempfile
+import time
+from decimal import Decimal
+import ijson
+import sinks
+
+
+class DecimalEncoder(json.JSONEncoder):
+    # What process_products used to encode every product with
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return float(obj)
+        if isinstance(obj, numbers.Number):
+            return float(obj)
+        return super().default(obj)
+
+
+def synthetic_product(i, rng):
+    """An enriched product shaped like the records of products_enhanced.json"""
+    base = "https://www.pieces-quad-dole.fr"
+    return {
+        'id': str(100000 + i),
+        'sku': f"{rng.randint(100, 999)}-{rng.randint(1000, 9999)}",
+        'name': f"Rétroviseur gauche homologué M8 réf {i}",
+        'url': f"{base}/PBSCProduct.asp?ItmID={100000 + i}",
+        'image_url': f"{base}/Files/134707/Img/{i % 100:02d}/{i}-small.jpg",
+        'price': round(rng.uniform(1, 500), 2),
+        'stock_status': rng.choice(['En stock', 'Sur commande', 'Rupture']),
+        'stock_quantity': rng.randint(0, 50),
+        'category_id': str(4260000 + i % 400),
+        'category_name': "Rétroviseurs",
+        'model_id': str(4200000 + i % 90),
+        'model_name': "ADLY 50",
+        'brand_id': str(4100000 + i % 12),
+        'brand_name': "ADLY",
+        'extra_images': [f"{base}/Files/134707/Img/{k:02d}/{i}-big.jpg" for k in range(rng.randint(1, 4))],
+        'product_code': f"{i}-A",
+        'description': "Rétroviseur gauche homologué, filetage M8 pas à droite. Compatible ADLY 50 / 100 / 150.",
+        'specifications': {'Côté': 'gauche', 'Filetage': 'M8 x 1,25', 'Couleur': 'noir'},
+    }
+
+
+def write_input(path, count):
+    rng = random.Random(1)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[\n')
+        for i in range(count):
+            if i:
+                f.write(',\n')
+            json.dump(synthetic_product(i, rng), f, ensure_ascii=False, indent=2)
+        f.write('\n]')
+
+
+def old_path(input_file, output_file):
+    """ijson Decimals re-encoded with indent=2 through DecimalEncoder"""
+    with open(input_file, 'rb') as f, open(output_file, 'w', encoding='utf-8') as out:
+        out.write('[\n')
+        for i, product in enumerate(ijson.items(f, 'item')):
+            if i:
+                out.write(',\n')
+            json.dump(product, out, ensure_ascii=False, indent=2, cls=DecimalEncoder)
+        out.write('\n]')
+    return i + 1
+
+
+def sink_path(input_file, output_file, pretty=False):
+    """ijson floats written by sinks.RecordSink"""
+    with sinks.RecordSink(output_file, fsync_every=0, pretty=pretty) as sink:
+        for product in sinks.iter_records(input_file, use_float=True):
+            sink.write(product)
+    return sink.count
+
+
+def decode_only(input_file, use_float):
+    count = 0
+    for _ in sinks.iter_records(input_file, use_float=use_float):
+        count += 1
+    return count
+
+
+def encode_only(records, encode):
+    for record in records:
+        encode(record)
+    return len(records)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    count = function(*args)
+    return count, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=100000, help='Synthetic products (default: %(default)s)')
+    parser.add_argument('--input', help='Benchmark this products.json instead of a synthetic one')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        input_file = args.input
+        if not input_file:
+            input_file = os.path.join(directory, 'products.json')
+            write_input(input_file, args.products)
+        output_file = os.path.join(directory, 'out.json')
+        size = os.path.getsize(input_file) / 1024 ** 2
+        print(f"Input: {input_file}, {size:.1f} MB, ijson backend {ijson.backend}, "
+              f"orjson {'installed' if sinks.orjson else 'not installed'}")
+
+        decimals = list(sinks.iter_records(input_file))
+        floats = list(sinks.iter_records(input_file, use_float=True))
+        orjson = sinks.orjson
+        cases = [
+            ('decode ijson Decimal', decode_only, input_file, False),
+            ('decode ijson float', decode_only, input_file, True),
+            ('encode indent=2 DecimalEncoder', encode_only, decimals,
+             lambda r: json.dumps(r, ensure_ascii=False, indent=2, cls=DecimalEncoder)),
+            ('encode json compact', encode_only, floats,
+             lambda r: json.dumps(r, ensure_ascii=False, separators=(',', ':'))),
+        ]
+        if orjson:
+            cases += [('encode orjson compact', encode_only, floats, lambda r: orjson.dumps(r).decode('utf-8')),
+                      ('encode orjson pretty', encode_only, floats,
+                       lambda r: orjson.dumps(r, option=orjson.OPT_INDENT_2).decode('utf-8'))]
+        cases += [
+            ('round trip, previous code', old_path, input_file, output_file),
+            ('round trip, compact', sink_path, input_file, output_file),
+            ('round trip, --pretty', sink_path, input_file, output_file, True),
+        ]
+
+        print(f"{'':<34} {'records/s':>11} {'seconds':>8}")
+        for name, function, *call_args in cases:
+            count, elapsed = timed(function, *call_args)
+            print(f"{name:<34} {count / elapsed:>11.0f} {elapsed:>8.2f}")
+        if orjson:
+            sinks.orjson = None
+            try:
+                count, elapsed = timed(sink_path, input_file, output_file)
+                print(f"{'round trip, compact, no orjson':<34} {count / elapsed:>11.0f} {elapsed:>8.2f}")
+            finally:
+                sinks.orjson = orjson
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Memory of a catalogue held as product dicts and as a records.Catalog.
+
+    python bench_memory.py --products 1000000
+
+Each representation is built in its own process from the same synthetic
+products, decoded from JSON text like the scrapers' output files, and the
+growth of the resident set is reported. The catalog is then checked to give
+back every product unchanged.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from records import Catalog
+
+BASE = "https://www.pieces-quad-dole.fr"
+BRANDS = ['ADLY', 'AEON', 'ARCTIC CAT', 'BOMBARDIER', 'CAN-AM', 'CF MOTO', 'DINLI', 'E-TON', 'GOES', 'HONDA',
+          'KAWASAKI', 'KYMCO', 'LINHAI', 'MASAI', 'POLARIS', 'SMC', 'SUZUKI', 'TGB', 'TRIUMPH', 'YAMAHA']
+MODELS_PER_BRAND = 60
+CATEGORIES_PER_MODEL = 5
+CATEGORY_NAMES = ['Rétroviseurs', 'Freinage', 'Transmission', 'Moteur - Haut moteur', 'Éclairage et signalisation']
+
+
+def product_lines(count):
+    """JSON text of `count` listing products spread over the synthetic hierarchy"""
+    rng = random.Random(1)
+    categories = len(BRANDS) * MODELS_PER_BRAND * CATEGORIES_PER_MODEL
+    for i in range(count):
+        category = i % categories
+        model = category // CATEGORIES_PER_MODEL
+        brand = model // MODELS_PER_BRAND
+        item = str(41000000 + i)
+        sku = f"{rng.randint(100, 999)}-{rng.randint(1000, 9999)}"
+        yield json.dumps({
+            'id': item,
+            'sku': sku,
+            'name': f"Rétroviseur gauche homologué M8 réf {i % 50000}",
+            'url': f"{BASE}/PBSCProduct.asp?ItmID={item}&AccID=134707",
+            'image_url': f"{BASE}/Files/134707/Img/{i % 100:02d}/{sku}-small.jpg",
+            'price': round(rng.uniform(1, 500), 2),
+            'stock_status': rng.choice(['En stock', 'Sur commande', 'Rupture de stock']),
+            'stock_quantity': rng.randint(0, 50),
+            'category_id': str(4300000 + category),
+            'category_name': CATEGORY_NAMES[category % CATEGORIES_PER_MODEL],
+            'model_id': str(4270000 + model),
+            'model_name': f"{BRANDS[brand]} {50 * (model % MODELS_PER_BRAND + 1)} cc",
+            'brand_id': str(4260000 + brand),
+            'brand_name': BRANDS[brand],
+        }, ensure_ascii=False)
+
+
+def resident():
+    """Resident set size of this process in bytes"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(mode, count):
+    """Build `count` products as `mode` and print 'bytes seconds' of what they added"""
+    gc.collect()
+    before = resident()
+    start = time.perf_counter()
+    if mode == 'dicts':
+        held = [json.loads(line) for line in product_lines(count)]
+    else:
+        held = Catalog()
+        for line in product_lines(count):
+            held.add('products', json.loads(line))
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    print(resident() - before, elapsed)
+
+    if mode == 'catalog':
+        start = time.perf_counter()
+        for line, product in zip(product_lines(count), held.records('products')):
+            if list(json.loads(line).items()) != list(product.items()):
+                raise SystemExit(f"Catalog changed product {product['id']}")
+        print(time.perf_counter() - start, json.dumps(held.counts()))
+
+
+def run(mode, count):
+    output = subprocess.run([sys.executable, __file__, '--measure', mode, '--products', str(count)],
+                            check=True, capture_output=True, text=True).stdout.split('\n')
+    size, elapsed = output[0].split()
+    return int(size), float(elapsed), output[1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=1000000, help='Synthetic products (default: %(default)s)')
+    parser.add_argument('--measure', choices=['dicts', 'catalog'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(args.measure, args.products)
+        return
+
+    count = args.products
+    print(f"{count} products")
+    print(f"{'':<10} {'MB':>9} {'bytes/product':>14} {'build s':>8}")
+    results = {}
+    for mode in ('dicts', 'catalog'):
+        size, elapsed, _ = results[mode] = run(mode, count)
+        print(f"{mode:<10} {size / 1024 ** 2:>9.1f} {size / count:>14.0f} {elapsed:>8.1f}")
+    check_time, counts = results['catalog'][2][0].split(' ', 1)
+    print(f"Catalog is {results['dicts'][0] / results['catalog'][0]:.1f}x smaller; "
+          f"records() gave back every product unchanged in {float(check_time):.1f} s ({counts})")
+
+
+if __name__ == "__main__":
+    main()
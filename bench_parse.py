@@ -0,0 +1,186 @@
+"""Time the lxml parsers against the previous html.parser code on the saved fixture pages,
+and the fast stock extractor against both full listing parses.
+
+    python bench_parse.py --repeat 50
+"""
+import argparse
+import contextlib
+import io
+import os
+import re
+import time
+from urllib.parse import urljoin, urlparse, parse_qs
+from bs4 import BeautifulSoup
+import parsers
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+BASE_URL = "https://www.pieces-quad-dole.fr/PBSCCatalog.asp?CatID=4260325"
+
+
+# Reference implementations: the BeautifulSoup/html.parser code the scrapers used
+# before parsers.py, kept here as the "before" side of the comparison.
+
+def soup_parse_brands(html, url):
+    soup = BeautifulSoup(html, "html.parser")
+    categories = []
+    processed_ids = set()
+    for row in soup.find_all('tr', class_='viewCatList__row'):
+        for cell in row.find_all('td'):
+            link_tag = cell.find('a', class_='PBLink', href=lambda x: x and 'PBCATID=' in x)
+            if not link_tag or not link_tag.get('href'):
+                continue
+            full_url = urljoin(url, link_tag['href'])
+            params = parse_qs(urlparse(full_url).query)
+            cat_id = params.get('PBCATID', [''])[0] or 'N/A'
+            if cat_id in processed_ids:
+                continue
+            processed_ids.add(cat_id)
+            name_tag = cell.find('h3', class_='PBCatSubTitle')
+            cat_name = name_tag.get_text(strip=True) if name_tag else ''
+            if not cat_name:
+                cat_name = params.get('PBCATName', [''])[0].strip()
+            img_tag = cell.find('img', class_='imgcat')
+            img_url = urljoin(url, img_tag['src']) if img_tag and 'src' in img_tag.attrs else None
+            if cat_id != 'N/A' or cat_name:
+                categories.append({"id": cat_id, "name": cat_name or f"Unnamed Category {len(categories) + 1}",
+                                   "url": full_url, "image_url": img_url})
+    return categories
+
+def soup_parse_models(html, brand_url):
+    soup = BeautifulSoup(html, 'html.parser')
+    models = []
+    processed_ids = set()
+    for row in soup.find_all('tr', class_='viewCatList__row'):
+        for cell in row.find_all('td', class_=lambda x: x and 'oxcell' in x):
+            link = cell.find('a', class_='PBLink')
+            if not link or not link.get('href'):
+                continue
+            model_url = urljoin(brand_url, link['href'])
+            model_id = None
+            if 'PBCATID=' in model_url:
+                model_id = model_url.split('PBCATID=')[1].split('&')[0]
+            if model_id in processed_ids:
+                continue
+            processed_ids.add(model_id)
+            name_tag = cell.find('h3', class_='PBCatSubTitle')
+            img_tag = cell.find('img', class_='imgcat')
+            models.append({
+                "id": model_id,
+                "name": name_tag.get_text(strip=True) if name_tag else 'Unnamed Model',
+                "url": model_url,
+                "image_url": urljoin(brand_url, img_tag['src']) if img_tag and 'src' in img_tag.attrs else None
+            })
+    return models
+
+def soup_parse_categories(html, model_url):
+    soup = BeautifulSoup(html, 'html.parser')
+    categories = []
+    processed_ids = set()
+    for row in soup.find_all('tr', class_='viewCatList__row'):
+        for cell in row.find_all('td', class_=lambda x: x and 'oxcell' in x):
+            link = cell.find('a', class_='PBLink')
+            if not link or not link.get('href'):
+                continue
+            category_url = urljoin(model_url, link['href'])
+            category_id = None
+            if 'PBCATID=' in category_url:
+                category_id = category_url.split('PBCATID=')[1].split('&')[0]
+            if not category_id or category_id in processed_ids:
+                continue
+            processed_ids.add(category_id)
+            name_tag = cell.find('h3', class_='PBCatSubTitle')
+            categories.append({
+                "id": category_id,
+                "name": name_tag.get_text(strip=True) if name_tag else 'Unnamed Category',
+                "url": category_url
+            })
+    return categories
+
+def soup_parse_products(html, category_url):
+    soup = BeautifulSoup(html, 'html.parser')
+    products = []
+    for row in soup.find_all('tr', class_='viewItemList__row'):
+        for cell in row.find_all('td', class_=lambda x: x and 'oxcell' in x and 'oxfirstcol' not in x):
+            if not cell.get('data-pdt-id'):
+                continue
+            name_tag = cell.find('h3', class_='PBMainTxt')
+            link_tag = cell.find('a', class_='PBLink')
+            img_tag = cell.find('img', class_='imgthumbnail')
+            price_tag = cell.find('span', class_='PBSalesPrice')
+            price = None
+            if price_tag and price_tag.get_text(strip=True):
+                price = float(re.sub(r'[^\d,.]', '', price_tag.get_text(strip=True)).replace(',', '.'))
+            stock_status = 'Out of Stock'
+            stock_qty = 0
+            stock_tag = cell.find('span', class_='PBMsgInStock')
+            if stock_tag:
+                stock_status = stock_tag.get_text(strip=True)
+                qty_match = re.search(r'\((\d+)', cell.text)
+                if qty_match:
+                    stock_qty = int(qty_match.group(1))
+            products.append({
+                'id': cell.get('data-pdt-id'),
+                'sku': cell.get('data-pdt-sku', '').strip(),
+                'name': name_tag.get_text(strip=True) if name_tag else 'Unnamed Product',
+                'url': urljoin(category_url, link_tag['href']) if link_tag and 'href' in link_tag.attrs else None,
+                'image_url': urljoin(category_url, img_tag['src']) if img_tag and 'src' in img_tag.attrs else None,
+                'price': price,
+                'stock_status': stock_status,
+                'stock_quantity': stock_qty
+            })
+    return products
+
+
+CASES = [
+    ('brands', 'catalog_brands.html', soup_parse_brands, parsers.parse_brands),
+    ('models', 'catalog_models.html', soup_parse_models, parsers.parse_models),
+    ('categories', 'catalog_categories.html', soup_parse_categories, parsers.parse_categories),
+    ('products', 'item_list.html', soup_parse_products, parsers.parse_products),
+]
+
+# Fields parse_listing_stock() returns for stock polling
+STOCK_FIELDS = ('id', 'sku', 'price', 'stock_status', 'stock_quantity')
+
+def time_per_page(parse, html, repeat):
+    """Average milliseconds per call, with the parsers' progress prints silenced"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            parse(html, BASE_URL)
+        return (time.perf_counter() - start) * 1000 / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'page':<12}{'records':>8}{'html.parser ms':>16}{'lxml ms':>10}{'speedup':>9}")
+    for name, fixture, before, after in CASES:
+        with open(os.path.join(FIXTURES, fixture), encoding='utf-8') as f:
+            html = f.read()
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected, got = before(html, BASE_URL), after(html, BASE_URL)
+        if expected != got:
+            raise SystemExit(f"{name}: lxml parser output differs from the html.parser reference")
+        before_ms = time_per_page(before, html, args.repeat)
+        after_ms = time_per_page(after, html, args.repeat)
+        print(f"{name:<12}{len(got):>8}{before_ms:>16.2f}{after_ms:>10.2f}{before_ms / after_ms:>8.1f}x")
+
+    # Stock polling: the same fields out of a listing page without building a tree
+    with open(os.path.join(FIXTURES, 'item_list.html'), encoding='utf-8') as f:
+        html = f.read()
+    with contextlib.redirect_stdout(io.StringIO()):
+        full, pages = parsers.parse_listing(html, BASE_URL)
+        fast, fast_pages = parsers.parse_listing_stock(html, BASE_URL)
+    if [{field: product[field] for field in STOCK_FIELDS} for product in full] != fast or pages != fast_pages:
+        raise SystemExit("listing stock: parse_listing_stock output differs from parse_listing")
+    timings = [(name, time_per_page(parse, html, args.repeat))
+               for name, parse in (('html.parser', soup_parse_products), ('lxml parse_listing', parsers.parse_listing),
+                                   ('parse_listing_stock', parsers.parse_listing_stock))]
+    fast_ms = timings[-1][1]
+    print(f"\n{'stock poll':<22}{'ms/page':>8}{'fast speedup':>14}")
+    for name, page_ms in timings:
+        print(f"{name:<22}{page_ms:>8.2f}{page_ms / fast_ms:>13.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Benchmark every scraper stage offline against a recorded page corpus.
+
+    python bench_suite.py record                          # snapshot one real page of each type
+    python bench_suite.py run --output bench.json         # replay it through the stub server
+    python bench_suite.py run --compare bench.json        # flag regressions against a baseline
+
+Without a recorded corpus the synthetic pages in fixtures/ are used.
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import fetcher
+import http_client
+from brand_scraper import brand_scraper
+from category_scraper import scrape_categories
+from model_scraper import scrape_models
+from parsers import parse_brands, parse_categories, parse_listing, parse_models
+from product_details_scraper import extract_additional_details, parse_details
+from product_scraper import scrape_products
+from stub_server import StubServer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+RECORDED = os.path.join(FIXTURES, 'recorded')
+ROOT_URL = "https://www.pieces-quad-dole.fr/PBSCCatalog.asp?CatID=4260325"
+FORMAT_VERSION = 1
+DEFAULT_THRESHOLD = 0.10   # slowdown reported as a regression by --compare
+DEFAULT_ROUNDS = 5
+MIN_ROUND_TIME = 0.2       # seconds; calls per round are scaled up to at least this
+
+# page type: (synthetic fixture, parser, end-to-end scraper function)
+PAGE_TYPES = {
+    'brands': ('catalog_brands.html', parse_brands, brand_scraper),
+    'models': ('catalog_models.html', parse_models, scrape_models),
+    'categories': ('catalog_categories.html', parse_categories, scrape_categories),
+    'listing': ('item_list.html', parse_listing, scrape_products),
+    'product': ('product.html', parse_details, extract_additional_details),
+}
+
+
+def record(directory, root_url, pick):
+    """Download one page of each type, following the first links of the catalogue, into directory"""
+    os.makedirs(directory, exist_ok=True)
+    manifest = {}
+    url = root_url
+    for page_type, (_, parse, _) in PAGE_TYPES.items():
+        print(f"Recording {page_type} page {url}")
+        response = http_client.get(url, timeout=fetcher.DEFAULT_TIMEOUT)
+        body = response.content
+        file_name = f"{page_type}.html"
+        with open(os.path.join(directory, file_name), 'wb') as f:
+            f.write(body)
+        manifest[page_type] = {'file': file_name, 'url': url, 'sha256': hashlib.sha256(body).hexdigest(),
+                               'bytes': len(body), 'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+        if page_type == 'product':
+            break
+        records = parse(response.text, url)
+        if page_type == 'listing':
+            records = records[0]
+        links = [record['url'] for record in records if record.get('url')]
+        if not links:
+            raise SystemExit(f"No links to follow on the {page_type} page {url}")
+        url = links[min(pick, len(links) - 1)]
+        time.sleep(1.0 / fetcher.DEFAULT_RATE)
+
+    with open(os.path.join(directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Corpus saved to {directory}")
+
+
+def load_corpus(directory):
+    """{page type: bytes} from a recorded corpus, or from the synthetic fixtures when there is none"""
+    manifest_path = os.path.join(directory, 'manifest.json')
+    if directory and os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        files = {page_type: os.path.join(directory, manifest[page_type]['file']) for page_type in PAGE_TYPES}
+        name = directory
+    else:
+        files = {page_type: os.path.join(FIXTURES, fixture) for page_type, (fixture, _, _) in PAGE_TYPES.items()}
+        name = 'synthetic'
+    pages = {}
+    for page_type, path in files.items():
+        with open(path, 'rb') as f:
+            pages[page_type] = f.read()
+    return name, pages
+
+
+def autorange(function):
+    """Calls needed for a round to last MIN_ROUND_TIME, as timeit's autorange"""
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        if time.perf_counter() - start >= MIN_ROUND_TIME:
+            return calls
+        calls *= 2
+
+
+def measure(function, repeat=None, rounds=DEFAULT_ROUNDS, size=0):
+    """Call function `repeat` times per round and return its throughput
+
+    Like timeit, the best round is reported: slower rounds measure other
+    load on the machine rather than the code. Without `repeat` the calls
+    per round are picked by autorange().
+    """
+    repeat = repeat or autorange(function)
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = function()
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    median = sorted(times)[len(times) // 2]
+    if isinstance(result, tuple):
+        result = result[0]
+    return {
+        'calls': repeat,
+        'rounds': rounds,
+        'per_sec': round(repeat / best, 3),
+        'median_per_sec': round(repeat / median, 3),
+        'ms_per_call': round(best / repeat * 1000, 4),
+        'mb_per_sec': round(size * repeat / best / 1024 ** 2, 3) if size else None,
+        'records': len(result) if isinstance(result, list) else None,
+    }
+
+
+def run(pages, repeat, latency, rounds=DEFAULT_ROUNDS):
+    results = {}
+    # Parsers alone, on the page text the scrapers hand them
+    for page_type, (_, parse, _) in PAGE_TYPES.items():
+        html = pages[page_type].decode('utf-8', errors='replace')
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[f"parse.{parse.__name__}"] = measure(lambda: parse(html, f"https://bench/{page_type}"),
+                                                         repeat, rounds, len(pages[page_type]))
+
+    # Scraper functions end to end: keep-alive fetch from the stub, decoding and parsing.
+    # Every other path gets the listing, so its later pages resolve too.
+    with StubServer(pages={f"/{page_type}": body for page_type, body in pages.items()},
+                    default_page=pages['listing'], latency=latency) as server:
+        for page_type, (_, _, scrape) in PAGE_TYPES.items():
+            url = f"{server.url}/{page_type}"
+            with contextlib.redirect_stdout(io.StringIO()):
+                scrape(url)   # warm up the connection
+                if page_type == 'listing':
+                    function = lambda: scrape(url, rate=1000, burst=100, per_host=4)
+                else:
+                    function = lambda: scrape(url)
+                results[f"e2e.{scrape.__name__}"] = measure(function, repeat, rounds, len(pages[page_type]))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change against a baseline run; returns the names that slowed down beyond threshold"""
+    regressions = []
+    print(f"\n{'benchmark':<38} {'baseline/s':>11} {'now/s':>11} {'change':>8}")
+    for name, now in results.items():
+        before = baseline.get(name)
+        if not before:
+            print(f"{name:<38} {'-':>11} {now['per_sec']:>11.1f}")
+            continue
+        change = now['per_sec'] / before['per_sec'] - 1
+        flag = ''
+        if change < -threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:<38} {before['per_sec']:>11.1f} {now['per_sec']:>11.1f} {change:>+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    record_parser = commands.add_parser('record', help='Snapshot real pages into a corpus')
+    record_parser.add_argument('--corpus', default=RECORDED, help='Corpus directory (default: %(default)s)')
+    record_parser.add_argument('--root', default=ROOT_URL, help='Catalogue page listing the brands')
+    record_parser.add_argument('--pick', type=int, default=0, help='Index of the link followed on each page')
+    run_parser = commands.add_parser('run', help='Replay the corpus and time every stage')
+    run_parser.add_argument('--corpus', default=RECORDED,
+                            help='Corpus directory; falls back to the synthetic fixtures (default: %(default)s)')
+    run_parser.add_argument('--repeat', type=int,
+                            help=f'Calls per round of each benchmark (default: enough for {MIN_ROUND_TIME}s)')
+    run_parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS,
+                            help='Rounds per benchmark, the best one is reported (default: %(default)s)')
+    run_parser.add_argument('--latency', type=float, default=0.0,
+                            help='Simulated server latency in seconds (default: %(default)s)')
+    run_parser.add_argument('--output', help='Write the results as JSON')
+    run_parser.add_argument('--compare', metavar='BASELINE', help='Results JSON of an earlier run')
+    run_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='Throughput drop reported as a regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record(args.corpus, args.root, args.pick)
+        return
+
+    corpus, pages = load_corpus(args.corpus)
+    report = {
+        'version': FORMAT_VERSION,
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'corpus': corpus,
+            'pages': {page_type: hashlib.sha256(body).hexdigest()[:16] for page_type, body in pages.items()},
+            'repeat': args.repeat,
+            'rounds': args.rounds,
+            'latency': args.latency,
+        },
+        'results': run(pages, args.repeat, args.latency, args.rounds),
+    }
+
+    print(f"Corpus: {corpus}, best of {args.rounds} rounds, simulated latency {args.latency * 1000:.0f} ms")
+    print(f"{'benchmark':<38} {'calls/s':>9} {'ms/call':>9} {'records':>8}")
+    for name, result in report['results'].items():
+        print(f"{name:<38} {result['per_sec']:>9.1f} {result['ms_per_call']:>9.2f} {result['records'] or '':>8}")
+    print(http_client.format_stats())
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['meta']['pages'] != report['meta']['pages']:
+            print("Warning: the baseline was measured on a different corpus")
+        regressions = compare(report['results'], baseline['results'], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmarks slowed down by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
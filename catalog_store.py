@@ -0,0 +1,286 @@
+"""Normalized SQLite store of the catalogue: brands, models, categories and products.
+
+    python catalog_store.py catalog.sqlite                 # row counts
+    python catalog_store.py catalog.sqlite --model 123     # parts listed for a model
+    python catalog_store.py catalog.sqlite --export .      # brands.json ... products_enhanced.json
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+import sinks
+from fingerprints import product_key
+
+LISTING_FIELDS = ('id', 'sku', 'name', 'url', 'image_url', 'price', 'stock_status', 'stock_quantity')
+DETAIL_FIELDS = ('extra_images', 'product_code', 'description', 'specifications')
+# Detail fields stored as JSON text
+JSON_FIELDS = ('extra_images', 'specifications')
+
+# JSON files written by the individual scrapers, in hierarchy order
+EXPORT_FILES = {
+    'brands': 'brands.json',
+    'models': 'brand_models.json',
+    'categories': 'model_categories.json',
+    'products': 'products.json',
+    'enhanced': 'products_enhanced.json',
+}
+
+SCHEMA = '''
+    PRAGMA journal_mode = WAL;
+    CREATE TABLE IF NOT EXISTS brands (
+        id TEXT PRIMARY KEY,
+        name TEXT,
+        url TEXT,
+        image_url TEXT,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS models (
+        id TEXT PRIMARY KEY,
+        brand_id TEXT,
+        name TEXT,
+        url TEXT,
+        image_url TEXT,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS models_brand ON models (brand_id);
+    CREATE TABLE IF NOT EXISTS categories (
+        id TEXT PRIMARY KEY,
+        model_id TEXT,
+        name TEXT,
+        url TEXT,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS categories_model ON categories (model_id);
+    CREATE TABLE IF NOT EXISTS products (
+        key TEXT PRIMARY KEY,
+        id TEXT,
+        sku TEXT,
+        name TEXT,
+        url TEXT,
+        image_url TEXT,
+        price REAL,
+        stock_status TEXT,
+        stock_quantity INTEGER,
+        extra_images TEXT,
+        product_code TEXT,
+        description TEXT,
+        specifications TEXT,
+        enriched_at REAL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS products_sku ON products (sku);
+    CREATE TABLE IF NOT EXISTS product_categories (
+        product_key TEXT NOT NULL,
+        category_id TEXT NOT NULL,
+        PRIMARY KEY (product_key, category_id)
+    );
+    CREATE INDEX IF NOT EXISTS product_categories_category ON product_categories (category_id);
+'''
+
+
+def add_store_argument(parser):
+    """Add --store to a scraper's argument parser"""
+    parser.add_argument('--store', metavar='DB',
+                        help='Also upsert the results into this SQLite catalogue store')
+    return parser
+
+
+def open_store(args):
+    """CatalogStore for --store, or None when it was not given"""
+    return CatalogStore(args.store) if args.store else None
+
+
+def _number(value):
+    # ijson hands back prices as Decimal, which sqlite3 cannot bind
+    return float(value) if value is not None else None
+
+
+class CatalogStore:
+    """Catalogue records normalized into indexed SQLite tables
+
+    Every stage upserts what it scraped, so re-running a stage updates rows in
+    place and keeps their original order. Products are stored once and linked
+    to each category listing them; a listing update leaves the enriched
+    details alone. WAL mode lets readers query the store while a scraper is
+    writing to it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Crawl workers share the store; wait for each other's commits
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.executescript(SCHEMA)
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def upsert(self, kind, records):
+        """Upsert records of a kind: 'brands', 'models', 'categories' or 'products'"""
+        getattr(self, f"upsert_{kind}")(records)
+
+    def upsert_brands(self, brands):
+        now = time.time()
+        self.db.executemany(
+            'INSERT INTO brands (id, name, url, image_url, updated_at) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (id) DO UPDATE SET name = excluded.name, url = excluded.url, '
+            'image_url = excluded.image_url, updated_at = excluded.updated_at',
+            [(b['id'], b.get('name'), b.get('url'), b.get('image_url'), now) for b in brands])
+
+    def upsert_models(self, models):
+        now = time.time()
+        self.db.executemany(
+            'INSERT INTO models (id, brand_id, name, url, image_url, updated_at) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (id) DO UPDATE SET brand_id = excluded.brand_id, name = excluded.name, '
+            'url = excluded.url, image_url = excluded.image_url, updated_at = excluded.updated_at',
+            [(m['id'], m.get('brand_id'), m.get('name'), m.get('url'), m.get('image_url'), now)
+             for m in models])
+
+    def upsert_categories(self, categories):
+        now = time.time()
+        self.db.executemany(
+            'INSERT INTO categories (id, model_id, name, url, updated_at) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (id) DO UPDATE SET model_id = excluded.model_id, name = excluded.name, '
+            'url = excluded.url, updated_at = excluded.updated_at',
+            [(c['id'], c.get('model_id'), c.get('name'), c.get('url'), now) for c in categories])
+
+    def upsert_products(self, products):
+        """Upsert listing fields, details when the records carry them, and category links"""
+        now = time.time()
+        rows = []
+        links = []
+        for p in products:
+            key = product_key(p)
+            enriched = 'extra_images' in p
+            details = [json.dumps(p.get(field), ensure_ascii=False) if field in JSON_FIELDS else p.get(field)
+                       for field in DETAIL_FIELDS] if enriched else [None] * len(DETAIL_FIELDS)
+            rows.append((key, p.get('id'), p.get('sku'), p.get('name'), p.get('url'), p.get('image_url'),
+                         _number(p.get('price')), p.get('stock_status'), p.get('stock_quantity'),
+                         *details, now if enriched else None, now))
+            if p.get('category_id') is not None:
+                links.append((key, p['category_id']))
+        self.db.executemany(
+            f'''INSERT INTO products (key, id, sku, name, url, image_url, price, stock_status, stock_quantity,
+                    {', '.join(DETAIL_FIELDS)}, enriched_at, updated_at)
+                VALUES ({', '.join('?' * (11 + len(DETAIL_FIELDS)))})
+                ON CONFLICT (key) DO UPDATE SET
+                    id = excluded.id, sku = excluded.sku, name = excluded.name, url = excluded.url,
+                    image_url = excluded.image_url, price = excluded.price,
+                    stock_status = excluded.stock_status, stock_quantity = excluded.stock_quantity,
+                    {', '.join(f"{field} = CASE WHEN excluded.enriched_at IS NULL THEN {field} "
+                               f"ELSE excluded.{field} END" for field in DETAIL_FIELDS)},
+                    enriched_at = COALESCE(excluded.enriched_at, enriched_at),
+                    updated_at = excluded.updated_at''',
+            rows)
+        self.db.executemany('INSERT OR IGNORE INTO product_categories VALUES (?, ?)', links)
+
+    def update_stock(self, products):
+        """Update price and stock of products already stored; returns how many were found
+
+        For the price and stock records of parse_listing_stock, which lack the
+        other listing fields an upsert would overwrite.
+        """
+        now = time.time()
+        cursor = self.db.executemany(
+            'UPDATE products SET price = ?, stock_status = ?, stock_quantity = ?, updated_at = ? WHERE key = ?',
+            [(_number(p.get('price')), p.get('stock_status'), p.get('stock_quantity'), now, product_key(p))
+             for p in products])
+        return cursor.rowcount
+
+    def counts(self):
+        return {table: self.db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in ('brands', 'models', 'categories', 'products', 'product_categories')}
+
+    def _product(self, row, placement=None, enriched=False):
+        """Rebuild a scraper record from a products row and an optional category placement"""
+        product = dict(zip(LISTING_FIELDS, row[:len(LISTING_FIELDS)]))
+        if placement:
+            product.update(placement)
+        if enriched and row[-1] is not None:
+            for field, value in zip(DETAIL_FIELDS, row[len(LISTING_FIELDS):-1]):
+                product[field] = json.loads(value) if field in JSON_FIELDS and value else value
+        return product
+
+    def brands(self):
+        for row in self.db.execute('SELECT id, name, url, image_url FROM brands ORDER BY rowid'):
+            yield dict(zip(('id', 'name', 'url', 'image_url'), row))
+
+    def models(self):
+        for row in self.db.execute(
+                '''SELECT m.id, m.name, m.url, m.image_url, m.brand_id, b.name
+                   FROM models m LEFT JOIN brands b ON b.id = m.brand_id ORDER BY m.rowid'''):
+            yield dict(zip(('id', 'name', 'url', 'image_url', 'brand_id', 'brand_name'), row))
+
+    def categories(self):
+        for row in self.db.execute(
+                '''SELECT c.id, c.name, c.url, c.model_id, m.name, m.brand_id, b.name
+                   FROM categories c LEFT JOIN models m ON m.id = c.model_id
+                   LEFT JOIN brands b ON b.id = m.brand_id ORDER BY c.rowid'''):
+            yield dict(zip(('id', 'name', 'url', 'model_id', 'model_name', 'brand_id', 'brand_name'), row))
+
+    def products(self, enriched=False, model_id=None):
+        """One record per (product, category) listing, like products.json
+
+        With `enriched`, products that went through process_products carry
+        their details as in products_enhanced.json.
+        """
+        query = f'''SELECT {', '.join('p.' + field for field in LISTING_FIELDS + DETAIL_FIELDS)}, p.enriched_at,
+                           pc.category_id, c.name, m.id, m.name, b.id, b.name
+                    FROM product_categories pc
+                    JOIN products p ON p.key = pc.product_key
+                    LEFT JOIN categories c ON c.id = pc.category_id
+                    LEFT JOIN models m ON m.id = c.model_id
+                    LEFT JOIN brands b ON b.id = m.brand_id'''
+        params = ()
+        if model_id is not None:
+            query += ' WHERE c.model_id = ?'
+            params = (model_id,)
+        query += ' ORDER BY pc.rowid'
+        size = len(LISTING_FIELDS) + len(DETAIL_FIELDS) + 1
+        for row in self.db.execute(query, params):
+            placement = dict(zip(('category_id', 'category_name', 'model_id', 'model_name',
+                                  'brand_id', 'brand_name'), row[size:]))
+            yield self._product(row[:size], placement, enriched)
+
+    def export(self, directory='.'):
+        """Write the JSON files the scrapers produce from the stored catalogue"""
+        for kind, output_file in EXPORT_FILES.items():
+            path = os.path.join(directory, output_file)
+            if kind in ('products', 'enhanced'):
+                with sinks.RecordSink(path) as sink:
+                    for product in self.products(enriched=kind == 'enhanced'):
+                        sink.write(product)
+                count = sink.count
+            else:
+                records = list(getattr(self, kind)())
+                with open(path, 'w', encoding='utf-8') as f:
+                    json.dump(records, f, ensure_ascii=False, indent=2)
+                count = len(records)
+            print(f"Saved {count} {kind} to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('db', help='Catalogue store written with --store')
+    parser.add_argument('--model', metavar='ID', help='List the parts sold for a model')
+    parser.add_argument('--export', metavar='DIR', help='Write the JSON files into DIR')
+    args = parser.parse_args()
+
+    store = CatalogStore(args.db)
+    try:
+        if args.model:
+            for product in store.products(model_id=args.model):
+                print(f"{product['id']}\t{product['sku']}\t{product['category_name']}\t{product['name']}")
+        elif args.export:
+            store.export(args.export)
+        else:
+            print(json.dumps(store.counts()))
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Crawl the whole catalogue, brand -> model -> category -> products, through a resumable frontier.
+
+    python crawl.py                 # start, or resume where the last run stopped
+    python crawl.py --retry-failed  # give failed pages another round
+    python crawl.py --export        # write brands.json ... products.json from the frontier
+
+Several processes can share one frontier: `--workers 4` starts four local
+workers, or start `crawl.py --worker` yourself, once per process. Each
+claims pages under a lease, and pages of a worker that died are handed to
+another once the lease runs out. --rate and --burst are the budget of the
+whole site: `--workers` splits them between its workers, and workers you
+start yourself each need their share, such as `--rate 0.25` for four. Nodes without a shared disk crawl their
+own frontier with `--shard K/N`, splitting the brands between them, and
+`crawl.py --merge node-*.sqlite` gathers their results afterwards.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+import fetcher
+from catalog_store import add_store_argument, open_store
+from frontier import DEFAULT_LEASE, Frontier
+from hierarchy import with_brand, with_category, with_model
+from parsers import PAGE_NUMBER, page_url, parse_brands, parse_categories, parse_listing, parse_models
+
+ROOT_URL = "https://www.pieces-quad-dole.fr/PBSCCatalog.asp?CatID=4260325"
+DEFAULT_DB = 'crawl.sqlite'
+BATCH_SIZE = 100
+POLL_INTERVAL = 0.5
+
+# stage: (parser, kind of record it yields, stage of the records' URLs, parent references, output file)
+STAGES = {
+    'root': (parse_brands, 'brands', 'brand', lambda parent, brands: brands, 'brands.json'),
+    'brand': (parse_models, 'models', 'model', with_brand, 'brand_models.json'),
+    'model': (parse_categories, 'categories', 'category', with_model, 'model_categories.json'),
+    'category': (parse_listing, 'products', None, with_category, 'products.json'),
+}
+# Deepest stage first, so products start flowing as soon as the first categories are known
+STAGE_ORDER = ['category', 'model', 'brand', 'root']
+
+def run(frontier, crawl_options, batch_size=BATCH_SIZE, store=None, shard=None):
+    """Crawl pending pages, a batch of one stage at a time, until the frontier is drained
+
+    With a CatalogStore, every page's records are also upserted into it.
+    A worker sharing the frontier keeps polling while other workers hold
+    pages, as those may still queue more, and renews its own leases as its
+    pages come in. `shard` (k, n) only crawls the pages of that shard.
+    """
+    renewed = time.monotonic()
+    while True:
+        for stage in STAGE_ORDER:
+            items = frontier.claim(stage, batch_size, shard)
+            if items:
+                break
+        else:
+            if frontier.lease is None or not frontier.in_flight():
+                return
+            time.sleep(POLL_INTERVAL)
+            continue
+        parse, kind, child_stage, attach, _ = STAGES[stage]
+
+        def handle(item, records):
+            nonlocal renewed
+            if frontier.lease is not None and time.monotonic() - renewed > frontier.lease / 3:
+                frontier.renew()
+                renewed = time.monotonic()
+            if records is None:
+                frontier.fail(item['url'], 'fetch or parse error')
+                return
+            scope = None
+            if stage == 'category':
+                # Listing pages: queue the rest of a paginated category from its first page
+                records, pages = records
+                scope = item['parent']['url']
+                if not PAGE_NUMBER.search(item['url']):
+                    for page in range(2, pages + 1):
+                        frontier.add('category', page_url(item['url'], page), item['parent'])
+            records = attach(item['parent'], records)
+            frontier.complete(item['url'], kind, records, child_stage, scope=scope)
+            if store:
+                store.upsert(kind, records)
+                store.commit()
+            print(f"[{stage}] {len(records)} {kind} from {item['url']}")
+
+        fetcher.crawl(items, lambda item: item['url'], parse, handle, **crawl_options)
+        print(f"Progress: {json.dumps(frontier.counts())}")
+
+def export(frontier):
+    """Write the flat JSON files the individual scripts produce"""
+    for stage in STAGE_ORDER[::-1]:
+        _, kind, _, _, output_file = STAGES[stage]
+        records = list(frontier.records(kind))
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(records, f, ensure_ascii=False, indent=2)
+        print(f"Saved {len(records)} {kind} to {output_file}")
+
+def parse_shard(value):
+    """'K/N' -> (k, n)"""
+    try:
+        k, n = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected K/N, got {value!r}")
+    if not 0 <= k < n:
+        raise argparse.ArgumentTypeError(f"shard {k} is not in 0..{n - 1}")
+    return k, n
+
+def start_workers(count, argv):
+    """Run `count` copies of this crawl as --worker processes and wait for them"""
+    args = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == '--workers':
+            skip = True
+        # The parent already requeued the failed pages
+        elif not arg.startswith('--workers=') and arg != '--retry-failed':
+            args.append(arg)
+    workers = [subprocess.Popen([sys.executable, __file__, *args, '--worker']) for _ in range(count)]
+    failed = sum(1 for worker in workers if worker.wait() != 0)
+    if failed:
+        print(f"{failed} of {count} workers failed; their pages go to the next run once their leases expire")
+
+def main():
+    parser = fetcher.add_crawl_arguments(argparse.ArgumentParser(description=__doc__.splitlines()[0]))
+    add_store_argument(parser)
+    parser.add_argument('--db', default=DEFAULT_DB, help='Frontier database (default: %(default)s)')
+    parser.add_argument('--root', default=ROOT_URL, help='Catalogue page listing the brands')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='Pages claimed per round (default: %(default)s)')
+    parser.add_argument('--max-attempts', type=int, default=3,
+                        help='Attempts before a page is marked failed (default: %(default)s)')
+    parser.add_argument('--retry-failed', action='store_true', help='Requeue pages that failed before')
+    parser.add_argument('--export', action='store_true', help='Only write the JSON files and exit')
+    parser.add_argument('--workers', type=int,
+                        help='Start this many local worker processes on the frontier, sharing --rate '
+                             'and --burst, then export')
+    parser.add_argument('--worker', action='store_true',
+                        help='Crawl as one of several processes sharing the frontier, without exporting; '
+                             'give each its share of the site\'s --rate')
+    parser.add_argument('--lease', type=float, default=DEFAULT_LEASE,
+                        help='Seconds a worker holds its claimed pages before they go to another '
+                             '(default: %(default)s)')
+    parser.add_argument('--shard', type=parse_shard, metavar='K/N',
+                        help='Only crawl shard K of N, the brands hashed to it')
+    parser.add_argument('--merge', nargs='+', metavar='DB',
+                        help='Merge the frontiers of other nodes into --db, then export')
+    args = parser.parse_args()
+
+    shared = args.worker or args.workers
+    frontier = Frontier(args.db, max_attempts=args.max_attempts, lease=args.lease if shared else None)
+    store = open_store(args)
+    try:
+        if args.merge:
+            for path in args.merge:
+                print(f"Merged {frontier.merge(path)} records from {path}")
+            print(f"Merged frontier: {json.dumps(frontier.counts())}")
+        if args.export or args.merge:
+            export(frontier)
+            return
+
+        crawl_options = fetcher.configure(args)
+        if args.retry_failed:
+            print(f"Requeued {frontier.retry_failed()} failed pages")
+        frontier.add('root', args.root)
+        frontier.db.commit()
+
+        if args.workers:
+            start_workers(args.workers, fetcher.worker_arguments(sys.argv[1:], args, args.workers))
+        else:
+            run(frontier, crawl_options, args.batch_size, store, args.shard)
+        if args.worker:
+            print(f"\nWorker {frontier.worker} done: {json.dumps(frontier.counts())}")
+        else:
+            print(f"\nCrawl complete: {json.dumps(frontier.counts())}")
+            export(frontier)
+        if not args.workers:
+            print(fetcher.format_stats())
+    finally:
+        frontier.close()
+        if store:
+            store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+import asyncio
+import contextlib
+import copy
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlparse
+import http_cache
+import http_client
+import metrics
+import throttle
+from urls import canonical
+
+# Throttle set up by configure() for --adaptive, shared by every crawl of the run
+adaptive = None
+
+# Default crawl budget for pieces-quad-dole.fr
+DEFAULT_RATE = 1.0       # requests per second, across all workers
+DEFAULT_BURST = 1        # requests allowed back to back after an idle period
+DEFAULT_PER_HOST = 2     # simultaneous connections to a single host
+DEFAULT_TIMEOUT = 20
+
+
+def get_page(url, timeout=DEFAULT_TIMEOUT):
+    """Fetch a page over the shared keep-alive session and return its HTML
+
+    Goes through the response cache when one has been configured.
+    """
+    if http_cache.cache is not None:
+        return http_cache.cache.fetch(url, timeout=timeout)
+    return http_client.get(url, timeout=timeout).text
+
+
+def fetch(url, timeout=DEFAULT_TIMEOUT, stage='fetch'):
+    """get_page() outside a crawl, recorded in metrics.recorder under `stage` like crawl()'s pages"""
+    started = time.monotonic()
+    try:
+        page, timings = _timed_fetch(get_page, url, timeout)
+    except Exception as e:
+        if metrics.recorder is not None:
+            metrics.recorder.record(stage, url, started, getattr(e, 'timings', {}), str(e))
+        raise
+    if metrics.recorder is not None:
+        metrics.recorder.record(stage, url, started, timings)
+    return page
+
+
+def _timed_fetch(fetch_page, url, timeout):
+    """Run fetch_page in a worker thread and return the page with the timings of its request"""
+    http_client.reset_last_request()
+    try:
+        page = fetch_page(url, timeout)
+    except Exception as e:
+        # Keep the retries and backoff of a failed request for the metrics
+        e.timings = dict(http_client.last_request() or {})
+        raise
+    # Empty when the page came from the cache without a request
+    return page, dict(http_client.last_request() or {})
+
+
+class TokenBucket:
+    """Token bucket allowing `rate` requests per second with bursts of `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = max(1, capacity or 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        """Change the refill rate, keeping the tokens already earned"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.rate = rate
+
+    def _take(self):
+        """Take a token if one is available, otherwise return the wait until the next one"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        """Wait until a request may be sent"""
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class AsyncFetcher:
+    """Fetch pages concurrently under a per-host connection cap and a global request rate
+
+    With an AdaptiveThrottle the cap and the rate follow the throttle, which
+    sees the outcome of every request.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, per_host=DEFAULT_PER_HOST, burst=DEFAULT_BURST,
+                 timeout=DEFAULT_TIMEOUT, fetch_page=get_page, throttle=None):
+        self.bucket = TokenBucket(rate, burst)
+        # Blocking fetch(url, timeout) run in the thread pool; returns what parse() receives
+        self.fetch_page = fetch_page
+        self.per_host = per_host
+        self.timeout = timeout
+        self.throttle = throttle
+        if throttle is not None:
+            throttle.attach(self.bucket)
+        self.in_flight = {}
+        self.slot_freed = {}
+        self.robots_checked = {}
+        self.executor = None
+
+    def _limit(self):
+        return self.throttle.concurrency if self.throttle is not None else self.per_host
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, url):
+        """Hold one of the host's connection slots; the limit can change while waiting"""
+        host = urlparse(url).netloc
+        if host not in self.slot_freed:
+            self.slot_freed[host] = asyncio.Condition()
+            self.in_flight[host] = 0
+        freed = self.slot_freed[host]
+        async with freed:
+            await freed.wait_for(lambda: self.in_flight[host] < self._limit())
+            self.in_flight[host] += 1
+        try:
+            yield
+        finally:
+            async with freed:
+                self.in_flight[host] -= 1
+                freed.notify_all()
+
+    async def _observe(self, timings, error=None):
+        """Report a request to the throttle, waking the tasks waiting for a slot when it allows more"""
+        before = self.throttle.concurrency
+        self.throttle.observe(timings, error=error)
+        if self.throttle.concurrency > before:
+            for freed in self.slot_freed.values():
+                async with freed:
+                    freed.notify_all()
+
+    async def _check_robots(self, url):
+        """Let the throttle read the host's robots.txt before its first page"""
+        host = urlparse(url).netloc
+        if host not in self.robots_checked:
+            loop = asyncio.get_running_loop()
+            self.robots_checked[host] = loop.run_in_executor(self.executor, self.throttle.check_robots, url)
+        await self.robots_checked[host]
+
+    async def fetch(self, url):
+        """Fetch a page once a connection slot and a rate token are available"""
+        page, _ = await self._fetch_timed(url)
+        return page
+
+    async def _fetch_timed(self, url):
+        """fetch() returning (page, timings), with the wait for a slot and a token as timings['wait']"""
+        started = time.monotonic()
+        if self.throttle is not None:
+            await self._check_robots(url)
+        async with self._slot(url):
+            await self.bucket.acquire()
+            wait = time.monotonic() - started
+            loop = asyncio.get_running_loop()
+            try:
+                page, timings = await loop.run_in_executor(self.executor, _timed_fetch, self.fetch_page, url,
+                                                           self.timeout)
+            except Exception as e:
+                if self.throttle is not None:
+                    await self._observe(getattr(e, 'timings', {}), error=e)
+                raise
+        if self.throttle is not None:
+            await self._observe(timings)
+        timings['wait'] = wait
+        return page, timings
+
+    def _record(self, stage, url, started, timings, error=None):
+        if metrics.recorder is not None:
+            metrics.recorder.record(stage, url, started, timings, error)
+
+    async def _worker(self, items, url_of, parse, handle, stage):
+        for item in items:
+            url = url_of(item)
+            started = time.monotonic()
+            timings = {}
+            error = None
+            try:
+                page, timings = await self._fetch_timed(url)
+                parse_started = time.perf_counter()
+                result = parse(page, url)
+                timings['parse'] = time.perf_counter() - parse_started
+            except Exception as e:
+                print(f"Error scraping {url}: {str(e)}")
+                result = None
+                error = str(e)
+                timings = getattr(e, 'timings', timings)
+            handle(item, result)
+            self._record(stage, url, started, timings, error)
+
+    async def _fetch_worker(self, items, url_of, pages, handle, stage):
+        """Fetch pages onto the parse queue, blocking while it is full"""
+        for item in items:
+            url = url_of(item)
+            started = time.monotonic()
+            try:
+                html, timings = await self._fetch_timed(url)
+            except Exception as e:
+                print(f"Error scraping {url}: {str(e)}")
+                handle(item, None)
+                self._record(stage, url, started, getattr(e, 'timings', {}), str(e))
+                continue
+            await pages.put((item, url, html, started, timings))
+
+    async def _parse_worker(self, pages, pool, parse, handle, stage):
+        """Hand queued pages to the process pool, one at a time per worker"""
+        loop = asyncio.get_running_loop()
+        while True:
+            page = await pages.get()
+            if page is None:
+                return
+            item, url, html, started, timings = page
+            error = None
+            # Includes the hand-off to the worker process
+            parse_started = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(pool, parse, html, url)
+                timings['parse'] = time.perf_counter() - parse_started
+            except Exception as e:
+                print(f"Error parsing {url}: {str(e)}")
+                result = None
+                error = str(e)
+            handle(item, result)
+            self._record(stage, url, started, timings, error)
+
+    async def crawl(self, items, url_of, parse, handle, concurrency=None, parse_workers=0,
+                    queue_size=None, stage=None):
+        """Fetch and parse every item, calling handle(item, result) as each one finishes
+
+        `items` is consumed lazily so it can be a generator over a large file.
+        `result` is None when the page could not be fetched or parsed.
+
+        With `parse_workers` set, fetched pages go through a bounded queue to a
+        pool of parser processes so parsing runs on other cores than the fetch
+        loop. `parse` must then be a module-level function. Fetching pauses
+        while `queue_size` pages are waiting, which caps memory use.
+
+        Every page is recorded in metrics.recorder under `stage`, by default
+        the name of the parse function.
+        """
+        stage = stage or parse.__name__.replace('parse_', '')
+        if not concurrency:
+            concurrency = self.throttle.max_concurrency if self.throttle is not None else self.per_host
+        items = iter(items)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            if not parse_workers:
+                await asyncio.gather(*(self._worker(items, url_of, parse, handle, stage)
+                                       for _ in range(concurrency)))
+                return
+
+            pages = asyncio.Queue(maxsize=queue_size or 2 * parse_workers)
+            with ProcessPoolExecutor(max_workers=parse_workers) as pool:
+                parsing = [asyncio.ensure_future(self._parse_worker(pages, pool, parse, handle, stage))
+                           for _ in range(parse_workers)]
+                try:
+                    await asyncio.gather(*(self._fetch_worker(items, url_of, pages, handle, stage)
+                                           for _ in range(concurrency)))
+                    for _ in parsing:
+                        await pages.put(None)
+                    await asyncio.gather(*parsing)
+                finally:
+                    for task in parsing:
+                        task.cancel()
+        finally:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+def crawl(items, url_of, parse, handle, rate=DEFAULT_RATE, per_host=DEFAULT_PER_HOST,
+          burst=DEFAULT_BURST, concurrency=None, parse_workers=0, queue_size=None, fetch_page=get_page,
+          stage=None, throttle=None):
+    """Run an AsyncFetcher crawl to completion from synchronous code
+
+    A `throttle` keeps what it learned about the server across calls.
+    """
+    fetcher = AsyncFetcher(rate=rate, per_host=per_host, burst=burst, fetch_page=fetch_page, throttle=throttle)
+    try:
+        asyncio.run(fetcher.crawl(items, url_of, parse, handle, concurrency=concurrency,
+                                  parse_workers=parse_workers, queue_size=queue_size, stage=stage))
+    finally:
+        if metrics.recorder is not None:
+            metrics.recorder.flush()
+
+
+def crawl_once(items, url_of, parse, handle, **crawl_options):
+    """crawl() fetching each distinct page once; items whose URLs are equivalent get copies of its result
+
+    Returns the number of items that shared a page instead of fetching it.
+    """
+    groups = {}
+    for item in items:
+        groups.setdefault(canonical(url_of(item)), []).append(item)
+
+    def handle_group(group, result):
+        # Copied before the first handle() can change the result
+        copies = [copy.deepcopy(result) for _ in group[1:]]
+        handle(group[0], result)
+        for item, result_copy in zip(group[1:], copies):
+            handle(item, result_copy)
+
+    crawl(list(groups.values()), lambda group: url_of(group[0]), parse, handle_group, **crawl_options)
+    return sum(len(group) - 1 for group in groups.values())
+
+
+def add_crawl_arguments(parser):
+    """Add the shared rate-limit, parsing and cache options to a script's argument parser"""
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                        help='Maximum requests per second (default: %(default)s)')
+    parser.add_argument('--burst', type=int, default=DEFAULT_BURST,
+                        help='Requests allowed back to back (default: %(default)s)')
+    parser.add_argument('--per-host', type=int, default=DEFAULT_PER_HOST,
+                        help='Simultaneous connections per host (default: %(default)s)')
+    parser.add_argument('--parse-workers', type=int, default=0,
+                        help='Parse pages in this many worker processes instead of the fetch loop (default: %(default)s)')
+    parser.add_argument('--parse-queue', type=int,
+                        help='Fetched pages allowed to wait for a parser before fetching pauses '
+                             '(default: twice --parse-workers)')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='Keep an on-disk HTTP cache in DIR and revalidate pages with conditional GETs')
+    parser.add_argument('--cache-ttl', type=float, default=http_cache.DEFAULT_TTL,
+                        help='Seconds a cached page is reused without revalidation (default: %(default)s)')
+    parser.add_argument('--cache-size', type=int, default=http_cache.DEFAULT_MAX_BYTES // 1024 ** 2,
+                        help='Cache size in MB before least recently used pages are evicted (default: %(default)s)')
+    parser.add_argument('--replay', action='store_true',
+                        help='Serve pages only from --cache, never touching the network')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Adjust --rate and --per-host to the server: back off on 429/5xx, errors and slow '
+                             'responses, speed up while it is healthy, and honour robots.txt Crawl-delay')
+    parser.add_argument('--max-rate', type=float,
+                        help=f'Highest rate --adaptive may reach (default: {throttle.DEFAULT_MAX_RATE_FACTOR}x --rate)')
+    parser.add_argument('--max-per-host', type=int,
+                        help='Most requests in flight per host --adaptive may reach (default: --per-host)')
+    parser.add_argument('--latency-target', type=float, default=throttle.DEFAULT_LATENCY_TARGET,
+                        help='Seconds to first byte above which --adaptive backs off (default: %(default)s)')
+    parser.add_argument('--metrics-log', metavar='FILE',
+                        help='Append one JSON line of timings, bytes, status and retries per page to FILE')
+    parser.add_argument('--prometheus', metavar='FILE',
+                        help='Keep FILE updated with crawl metrics in the Prometheus text format')
+    return parser
+
+
+def worker_arguments(argv, args, count):
+    """argv for one of `count` processes crawling the same site, with its share of the rate budget
+
+    --rate, --burst and --max-rate hold the budget for the whole site, so each
+    process gets 1/count of them instead of all of it.
+    """
+    options = ('--rate', '--burst', '--max-rate')
+    kept = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in options:
+            skip = True
+        elif not arg.startswith(tuple(f"{option}=" for option in options)):
+            kept.append(arg)
+    kept += ['--rate', str(args.rate / count), '--burst', str(max(1, args.burst // count))]
+    if args.max_rate:
+        kept += ['--max-rate', str(args.max_rate / count)]
+    return kept
+
+
+def configure(args):
+    """Apply the options added by add_crawl_arguments and return the keyword arguments for crawl()"""
+    if args.replay and not args.cache:
+        raise SystemExit("--replay needs --cache")
+    http_cache.configure(args.cache, ttl=args.cache_ttl, max_bytes=args.cache_size * 1024 ** 2,
+                         replay=args.replay)
+    metrics.configure(args.metrics_log, args.prometheus)
+    global adaptive
+    adaptive = None
+    if args.adaptive:
+        adaptive = throttle.AdaptiveThrottle(args.rate, args.per_host, max_rate=args.max_rate,
+                                             max_concurrency=args.max_per_host,
+                                             latency_target=args.latency_target)
+    return {'rate': args.rate, 'per_host': args.per_host, 'burst': args.burst,
+            'parse_workers': args.parse_workers, 'queue_size': args.parse_queue, 'throttle': adaptive}
+
+
+def format_stats():
+    """Summary of the HTTP client and cache counters, and of the per-page metrics"""
+    lines = [http_client.format_stats()]
+    if http_cache.cache is not None:
+        lines.append(http_cache.cache.format_stats())
+    if adaptive is not None:
+        lines.append(adaptive.format_stats())
+    if metrics.recorder is not None and metrics.recorder.stages:
+        lines.append(metrics.recorder.format_summary())
+    return '\n'.join(lines)
@@ -0,0 +1,60 @@
+"""Price and stock fields of the catalogue listings, parsed with precompiled patterns.
+
+Both listing parsers hand these functions only the text of the relevant
+spans: PBSalesPrice for the price, PBMsgInStock and PBStockQty for the stock.
+"""
+import re
+from collections import namedtuple
+
+# The number of a price, digit groups included: "1 234,56", "1.234,56", "1,234.56", "12"
+PRICE_NUMBER = re.compile(r"\d(?:[\d.,'\s]*\d)?")
+# Thousands separators besides '.' and ',': apostrophes and spaces, no-break ones included
+GROUPING = re.compile(r"[\s']")
+# First number of the quantity span, "(5 disponibles)"
+QUANTITY = re.compile(r'\d+')
+# A quantity given in the stock message itself, "En stock (5)"
+MESSAGE_QUANTITY = re.compile(r'\((\d+)')
+
+OUT_OF_STOCK = 'Out of Stock'
+
+StockInfo = namedtuple('StockInfo', 'in_stock status quantity')
+
+
+def parse_price(text):
+    """Price as a float from text like "1 234,56 €", "1.234,56", "1,234.56" or "12 €"; None without digits
+
+    The last ',' or '.' is the decimal separator unless it is repeated or
+    followed by exactly three digits, in which case it groups thousands.
+    """
+    if not text:
+        return None
+    match = PRICE_NUMBER.search(text)
+    if match is None:
+        return None
+    number = GROUPING.sub('', match.group(0))
+    decimal = max(number.rfind(','), number.rfind('.'))
+    if decimal < 0:
+        return float(number)
+    separator = number[decimal]
+    other = '.' if separator == ',' else ','
+    if other not in number and (number.count(separator) > 1 or len(number) - decimal - 1 == 3):
+        return float(number.replace(separator, ''))
+    return float(number[:decimal].replace(other, '').replace(separator, '') + '.' + number[decimal + 1:])
+
+
+def stock_info(message, quantity_text=None):
+    """StockInfo from the text of a product's in-stock message and quantity spans
+
+    `message` is None when the product shows no in-stock message, which the
+    scrapers report as out of stock. The quantity is the first number of the
+    quantity span, or one in parentheses in the message; 0 when neither
+    gives one.
+    """
+    if message is None:
+        return StockInfo(False, OUT_OF_STOCK, 0)
+    if quantity_text:
+        match = QUANTITY.search(quantity_text)
+        if match:
+            return StockInfo(True, message, int(match.group(0)))
+    match = MESSAGE_QUANTITY.search(message)
+    return StockInfo(True, message, int(match.group(1)) if match else 0)
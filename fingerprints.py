@@ -0,0 +1,108 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+# Fields from scrape_products that describe a product; hierarchy fields are left
+# out because the same product is listed under many categories
+LISTING_FIELDS = ('sku', 'name', 'url', 'image_url', 'price', 'stock_status', 'stock_quantity')
+DEFAULT_MAX_AGE = 7 * 24 * 3600   # seconds before enriched details are fetched again
+
+NEW = 'new'
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+
+
+def product_key(product):
+    """Stable identity of a product: its id, or its SKU when the id is missing"""
+    return str(product.get('id') or product.get('sku') or '')
+
+
+def fingerprint(product):
+    """Hash of the listing fields of a product"""
+    listing = {field: product.get(field) for field in LISTING_FIELDS}
+    # Prices may come back from ijson as Decimal
+    if listing['price'] is not None:
+        listing['price'] = float(listing['price'])
+    encoded = json.dumps(listing, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+
+class FingerprintIndex:
+    """Listing fingerprints and enrichment results of every product seen so far
+
+    Lets process_products skip the detail page of a product whose listing has
+    not changed since it was last enriched, and reports which products were
+    added, changed or removed since the previous run.
+    """
+
+    def __init__(self, path, max_age=DEFAULT_MAX_AGE):
+        self.max_age = max_age
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS products (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                details TEXT,
+                enriched_at REAL,
+                run INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS products_run ON products (run);
+        ''')
+        self.run = int(self.db.execute('SELECT COALESCE(MAX(run), 0) + 1 FROM products').fetchone()[0])
+        self.added = []
+        self.changed = []
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def check(self, product):
+        """Classify a product against the index and mark it seen in this run
+
+        Returns (status, details) where details are the stored enrichment
+        results when they can be reused as they are, otherwise None.
+        """
+        key = product_key(product)
+        current = fingerprint(product)
+        row = self.db.execute('SELECT fingerprint, details, enriched_at, run FROM products WHERE key = ?',
+                              (key,)).fetchone()
+        if row is None:
+            status = NEW
+            self.db.execute('INSERT INTO products (key, fingerprint, run) VALUES (?, ?, ?)',
+                            (key, current, self.run))
+            self.added.append(key)
+            return status, None
+
+        stored, details, enriched_at, run = row
+        status = UNCHANGED if stored == current else CHANGED
+        if status == CHANGED:
+            # Details describe the old listing; drop them so an interrupted run cannot reuse them
+            self.db.execute('UPDATE products SET fingerprint = ?, details = NULL, enriched_at = NULL, run = ? '
+                            'WHERE key = ?', (current, self.run, key))
+            if run != self.run:
+                self.changed.append(key)
+        else:
+            self.db.execute('UPDATE products SET run = ? WHERE key = ?', (self.run, key))
+        if status == UNCHANGED and details and enriched_at and time.time() - enriched_at < self.max_age:
+            return status, json.loads(details)
+        return status, None
+
+    def record(self, product, details):
+        """Store the details fetched for a product"""
+        self.db.execute('UPDATE products SET details = ?, enriched_at = ? WHERE key = ?',
+                        (json.dumps(details, ensure_ascii=False), time.time(), product_key(product)))
+
+    def finish(self, delta_file=None):
+        """Drop products missing from this run and write the keys added, changed and removed"""
+        removed = [key for (key,) in self.db.execute('SELECT key FROM products WHERE run < ?', (self.run,))]
+        self.db.execute('DELETE FROM products WHERE run < ?', (self.run,))
+        self.db.commit()
+        if delta_file:
+            with open(delta_file, 'w', encoding='utf-8') as f:
+                json.dump({'added': self.added, 'changed': self.changed, 'removed': removed},
+                          f, ensure_ascii=False, indent=2)
+        return len(self.added), len(self.changed), len(removed)
@@ -0,0 +1,266 @@
+import json
+import os
+import socket
+import sqlite3
+import time
+import zlib
+from urls import canonical
+
+PENDING = 'pending'
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+FAILED = 'failed'
+
+DEFAULT_LEASE = 300.0   # seconds a worker holds the pages it claimed before they are handed out again
+SHARD_BUCKETS = 64      # brands are hashed into this many buckets; --shard K/N takes buckets b with b % N == K
+
+
+def shard_of(record):
+    """Shard bucket of the pages found from a record: its brand, so a brand's pages stay together"""
+    if not record:
+        return 0
+    key = record.get('brand_id') or record.get('id') or ''
+    return zlib.crc32(str(key).encode('utf-8')) % SHARD_BUCKETS
+
+
+def default_worker():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Frontier:
+    """SQLite-backed crawl frontier with per-URL state and the records found so far
+
+    Every URL to crawl is stored once with its stage, state and attempt count,
+    along with the record it was discovered from (a brand, model or category).
+    Records parsed from a page are committed in the same transaction that marks
+    the page done and queues its children, so a crash at any point loses at
+    most the pages that were in flight. Those are put back to pending when the
+    frontier is reopened.
+
+    With a `lease`, several worker processes share the frontier: claimed
+    pages are leased to `worker` for that many seconds, claims are atomic,
+    and a page whose lease ran out, because its worker died, is handed to
+    the next claim and counts as a failed attempt. Opening the frontier then
+    leaves other workers' pages alone.
+    """
+
+    def __init__(self, path, max_attempts=3, lease=None, worker=None):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.worker = worker or default_worker()
+        # Workers wait for each other's write transactions rather than failing
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                stage TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                parent TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS urls_stage_state ON urls (stage, state);
+            CREATE TABLE IF NOT EXISTS records (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                source_url TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (kind, key)
+            );
+        ''')
+        columns = {row[1] for row in self.db.execute('PRAGMA table_info(urls)')}
+        for column, kind in (('shard', 'INTEGER NOT NULL DEFAULT 0'), ('lease_owner', 'TEXT'),
+                             ('lease_expires', 'REAL'), ('key', 'TEXT')):
+            if column not in columns:
+                self.db.execute(f'ALTER TABLE urls ADD COLUMN {column} {kind}')
+        self._fill_keys()
+        self.db.execute('CREATE UNIQUE INDEX IF NOT EXISTS urls_key ON urls (key)')
+        if lease is None:
+            # Pages that were in flight when the previous run stopped start over
+            self.db.execute('UPDATE urls SET state = ?, lease_owner = NULL WHERE state = ?', (PENDING, IN_FLIGHT))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def _fill_keys(self):
+        """Give the pages of a frontier from before canonical keys theirs
+
+        Of several pages with the same key, the first keeps it and the others
+        are keyed by their own URL, so they stay as they were.
+        """
+        rows = self.db.execute('SELECT url FROM urls WHERE key IS NULL ORDER BY rowid').fetchall()
+        if not rows:
+            return
+        taken = {key for (key,) in self.db.execute('SELECT key FROM urls WHERE key IS NOT NULL')}
+        updates = []
+        for (url,) in rows:
+            key = canonical(url)
+            if key in taken:
+                key = url
+            taken.add(key)
+            updates.append((key, url))
+        self.db.executemany('UPDATE urls SET key = ? WHERE url = ?', updates)
+
+    def add(self, stage, url, parent=None):
+        """Queue a URL unless it or an equivalent one is already known; returns True when it was new
+
+        URLs are equivalent when they have the same canonical form, so links
+        that differ only in ActionID or PBCATName are crawled once.
+        """
+        cursor = self.db.execute(
+            'INSERT OR IGNORE INTO urls (url, key, stage, state, parent, updated_at, shard) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (url, canonical(url), stage, PENDING,
+             json.dumps(parent, ensure_ascii=False) if parent is not None else None, time.time(),
+             shard_of(parent)))
+        return cursor.rowcount == 1
+
+    def claim(self, stage, limit, shard=None):
+        """Mark up to `limit` pending URLs of a stage in flight and return them as dicts
+
+        `shard` (k, n) only claims pages whose shard bucket is k modulo n.
+        With leases, pages whose lease expired are claimed again too.
+        """
+        now = time.time()
+        query = 'SELECT url, parent, attempts, state FROM urls WHERE stage = ? AND (state = ?'
+        params = [stage, PENDING]
+        if self.lease is not None:
+            query += ' OR (state = ? AND lease_expires < ?)'
+            params += [IN_FLIGHT, now]
+        query += ')'
+        if shard is not None:
+            # The root page has no brand; every shard needs it to find its brands
+            query += ' AND (parent IS NULL OR shard % ? = ?)'
+            params += [shard[1], shard[0]]
+        query += ' ORDER BY rowid LIMIT ?'
+        params.append(limit)
+
+        # BEGIN IMMEDIATE takes the write lock first, so two workers never claim the same page
+        if self.db.in_transaction:
+            self.db.commit()
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            rows = self.db.execute(query, params).fetchall()
+            claimed = []
+            expired = []
+            for url, parent, attempts, state in rows:
+                if state == IN_FLIGHT:
+                    # Its worker died or stalled: that was an attempt
+                    attempts += 1
+                    if attempts >= self.max_attempts:
+                        expired.append(url)
+                        continue
+                claimed.append((url, parent, attempts))
+            self.db.executemany(
+                'UPDATE urls SET attempts = attempts + 1, state = ?, error = ?, lease_owner = NULL, updated_at = ? '
+                'WHERE url = ?', [(FAILED, 'lease expired', now, url) for url in expired])
+            expires = now + self.lease if self.lease is not None else None
+            self.db.executemany(
+                'UPDATE urls SET state = ?, attempts = ?, lease_owner = ?, lease_expires = ?, updated_at = ? '
+                'WHERE url = ?', [(IN_FLIGHT, attempts, self.worker, expires, now, url)
+                                  for url, _, attempts in claimed])
+            self.db.commit()
+        except BaseException:
+            self.db.rollback()
+            raise
+        return [{'url': url, 'stage': stage, 'attempts': attempts,
+                 'parent': json.loads(parent) if parent else None}
+                for url, parent, attempts in claimed]
+
+    def renew(self):
+        """Extend the leases of the pages this worker holds"""
+        if self.lease is None:
+            return
+        with self.db:
+            self.db.execute('UPDATE urls SET lease_expires = ? WHERE state = ? AND lease_owner = ?',
+                            (time.time() + self.lease, IN_FLIGHT, self.worker))
+
+    def complete(self, url, kind, records, child_stage=None, key=lambda record: record.get('id'), scope=None):
+        """Store a page's records, queue their URLs for `child_stage` and mark the page done
+
+        Records are stored once per `scope` and key; the scope defaults to the
+        page URL, pages of one listing share the URL of its first page.
+        """
+        scope = scope or url
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO records (kind, key, source_url, data) VALUES (?, ?, ?, ?)',
+                [(kind, f"{scope}#{key(record)}", url, json.dumps(record, ensure_ascii=False))
+                 for record in records])
+            if child_stage:
+                for record in records:
+                    if record.get('url'):
+                        self.add(child_stage, record['url'], record)
+            self.db.execute('UPDATE urls SET state = ?, error = NULL, lease_owner = NULL, updated_at = ? '
+                            'WHERE url = ?', (DONE, time.time(), url))
+
+    def fail(self, url, error=None):
+        """Count a failed attempt; the URL is retried until max_attempts is reached
+
+        A page whose lease expired and went to another worker is left to that worker.
+        """
+        with self.db:
+            self.db.execute(
+                '''UPDATE urls SET attempts = attempts + 1, error = ?, updated_at = ?, lease_owner = NULL,
+                       state = CASE WHEN attempts + 1 >= ? THEN ? ELSE ? END
+                   WHERE url = ? AND (lease_owner IS NULL OR lease_owner = ?)''',
+                (error, time.time(), self.max_attempts, FAILED, PENDING, url, self.worker))
+
+    def retry_failed(self, stage=None):
+        """Put failed URLs back to pending with a fresh attempt count"""
+        with self.db:
+            query = 'UPDATE urls SET state = ?, attempts = 0 WHERE state = ?'
+            params = [PENDING, FAILED]
+            if stage:
+                query += ' AND stage = ?'
+                params.append(stage)
+            return self.db.execute(query, params).rowcount
+
+    def pending(self, stage):
+        return self.db.execute('SELECT COUNT(*) FROM urls WHERE stage = ? AND state = ?',
+                               (stage, PENDING)).fetchone()[0]
+
+    def in_flight(self):
+        """Pages claimed by any worker and not finished yet"""
+        return self.db.execute('SELECT COUNT(*) FROM urls WHERE state = ?', (IN_FLIGHT,)).fetchone()[0]
+
+    def counts(self):
+        """{stage: {state: count}} for progress reports"""
+        counts = {}
+        for stage, state, n in self.db.execute('SELECT stage, state, COUNT(*) FROM urls GROUP BY stage, state'):
+            counts.setdefault(stage, {})[state] = n
+        return counts
+
+    def merge(self, path):
+        """Add the pages and records of another frontier, crawled by another node
+
+        Records are keyed as in complete(), so the ones both frontiers hold
+        are stored once; a page done in either frontier is done here.
+        Returns the number of records merged in.
+        """
+        with self.db:
+            self.db.execute('ATTACH DATABASE ? AS other', (path,))
+        try:
+            with self.db:
+                self.db.execute('''
+                    INSERT INTO urls (url, key, stage, state, attempts, parent, error, updated_at, shard)
+                    SELECT url, key, stage, CASE state WHEN ? THEN ? ELSE state END, attempts, parent, error,
+                           updated_at, shard
+                    FROM other.urls WHERE true  -- WHERE keeps SQLite from reading ON as a join
+                    ON CONFLICT (key) DO UPDATE SET state = excluded.state, attempts = excluded.attempts,
+                        error = excluded.error, updated_at = excluded.updated_at
+                    WHERE urls.state != ? AND excluded.state = ?''', (IN_FLIGHT, PENDING, DONE, DONE))
+                return self.db.execute(
+                    'INSERT OR IGNORE INTO records (kind, key, source_url, data) '
+                    'SELECT kind, key, source_url, data FROM other.records ORDER BY rowid').rowcount
+        finally:
+            self.db.execute('DETACH DATABASE other')
+
+    def records(self, kind):
+        """Stored records of a kind, in the order they were found"""
+        for (data,) in self.db.execute('SELECT data FROM records WHERE kind = ? ORDER BY rowid', (kind,)):
+            yield json.loads(data)
@@ -0,0 +1,38 @@
+"""Parent references copied into the records of each catalogue level.
+
+Models carry their brand, categories their model and brand, and products
+their category, model and brand. The scrapers and crawl.py stamp records
+through these functions so every stage writes the same shapes.
+"""
+
+
+def with_brand(brand, models):
+    """Add brand references to each model"""
+    for model in models:
+        model['brand_id'] = brand['id']
+        model['brand_name'] = brand['name']
+    return models
+
+
+def with_model(model, categories):
+    """Add model and brand references to each category"""
+    for category in categories:
+        category['model_id'] = model['id']
+        category['model_name'] = model['name']
+        category['brand_id'] = model['brand_id']
+        category['brand_name'] = model['brand_name']
+    return categories
+
+
+def with_category(category, products):
+    """Add category, model, and brand references to each product"""
+    for product in products:
+        product.update({
+            'category_id': category['id'],
+            'category_name': category['name'],
+            'model_id': category['model_id'],
+            'model_name': category['model_name'],
+            'brand_id': category['brand_id'],
+            'brand_name': category['brand_name']
+        })
+    return products
@@ -0,0 +1,191 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+import http_client
+from urls import canonical
+
+DEFAULT_TTL = 0                          # seconds a page is served without revalidation
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3        # total size of stored bodies before LRU eviction
+
+# Process-wide cache used by fetcher.get_page, set up by configure()
+cache = None
+
+
+class CacheMiss(Exception):
+    """Raised in replay mode when a URL has never been downloaded"""
+
+
+class HTTPCache:
+    """On-disk response cache revalidated with conditional GETs
+
+    Bodies are stored once per SHA-256 under `directory/bodies`, so identical
+    pages reached through different URLs share a file. An SQLite index maps each
+    URL to its body, ETag and Last-Modified. Entries younger than `ttl` are served
+    without touching the network; older ones are revalidated and a 304 is served
+    from disk. Once the bodies exceed `max_bytes` the least recently used entries
+    are evicted. In `replay` mode the network is never used and unknown URLs
+    raise CacheMiss.
+    """
+
+    def __init__(self, directory, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, replay=False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.replay = replay
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'bodies'), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                body_hash TEXT NOT NULL,
+                encoding TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at);
+            CREATE INDEX IF NOT EXISTS entries_body ON entries (body_hash);
+            CREATE TABLE IF NOT EXISTS bodies (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL
+            );
+        ''')
+        self.total_bytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM bodies').fetchone()[0]
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _body_path(self, body_hash):
+        return os.path.join(self.directory, 'bodies', body_hash[:2], body_hash)
+
+    def _read(self, entry):
+        with open(self._body_path(entry['body_hash']), 'rb') as f:
+            return f.read().decode(entry['encoding'] or 'utf-8', errors='replace')
+
+    def _lookup(self, url):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT body_hash, encoding, etag, last_modified, fetched_at FROM entries WHERE url = ?',
+                (url,)).fetchone()
+        if not row:
+            return None
+        return dict(zip(('body_hash', 'encoding', 'etag', 'last_modified', 'fetched_at'), row))
+
+    def _touch(self, url, fetched=False):
+        now = time.time()
+        with self.lock:
+            if fetched:
+                self.db.execute('UPDATE entries SET accessed_at = ?, fetched_at = ? WHERE url = ?',
+                                (now, now, url))
+            else:
+                self.db.execute('UPDATE entries SET accessed_at = ? WHERE url = ?', (now, url))
+            self.db.commit()
+
+    def _store(self, url, response):
+        body = response.content
+        body_hash = hashlib.sha256(body).hexdigest()
+        path = self._body_path(body_hash)
+        now = time.time()
+        with self.lock:
+            if not self.db.execute('SELECT 1 FROM bodies WHERE hash = ?', (body_hash,)).fetchone():
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f"{path}.tmp{threading.get_ident()}"
+                with open(temp_path, 'wb') as f:
+                    f.write(body)
+                os.replace(temp_path, path)
+                self.db.execute('INSERT INTO bodies (hash, size) VALUES (?, ?)', (body_hash, len(body)))
+                self.total_bytes += len(body)
+            old = self.db.execute('SELECT body_hash FROM entries WHERE url = ?', (url,)).fetchone()
+            self.db.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, body_hash, response.encoding, response.headers.get('ETag'),
+                 response.headers.get('Last-Modified'), now, now))
+            if old and old[0] != body_hash:
+                self._drop_body_if_unused(old[0])
+            self._evict()
+            self.db.commit()
+        return response.text
+
+    def _drop_body_if_unused(self, body_hash):
+        if self.db.execute('SELECT 1 FROM entries WHERE body_hash = ? LIMIT 1', (body_hash,)).fetchone():
+            return
+        size = self.db.execute('SELECT size FROM bodies WHERE hash = ?', (body_hash,)).fetchone()
+        self.db.execute('DELETE FROM bodies WHERE hash = ?', (body_hash,))
+        if size:
+            self.total_bytes -= size[0]
+        try:
+            os.remove(self._body_path(body_hash))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        """Drop least recently used entries until the bodies fit in max_bytes"""
+        while self.total_bytes > self.max_bytes:
+            rows = self.db.execute(
+                'SELECT url, body_hash FROM entries ORDER BY accessed_at LIMIT 100').fetchall()
+            if not rows:
+                break
+            for url, body_hash in rows:
+                self.db.execute('DELETE FROM entries WHERE url = ?', (url,))
+                self._drop_body_if_unused(body_hash)
+                self.stats['evicted'] += 1
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def fetch(self, url, timeout=20):
+        """Return the page at url, from disk when it is fresh or unchanged
+
+        Entries are keyed by the canonical URL, so links to the same page
+        that differ only in ActionID, PBCATName or encoding share one.
+        """
+        key = canonical(url)
+        entry = self._lookup(key)
+
+        if self.replay:
+            if not entry:
+                self._count('misses')
+                raise CacheMiss(f"{url} is not in the cache")
+            self._count('hits')
+            self._touch(key)
+            return self._read(entry)
+
+        if entry and time.time() - entry['fetched_at'] < self.ttl:
+            self._count('hits')
+            self._touch(key)
+            return self._read(entry)
+
+        headers = {}
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = http_client.get(url, timeout=timeout, headers=headers)
+        if response.status_code == 304 and entry:
+            self._count('not_modified')
+            self._touch(key, fetched=True)
+            return self._read(entry)
+
+        self._count('misses')
+        return self._store(key, response)
+
+    def format_stats(self):
+        """One-line summary of the cache counters"""
+        return (f"Cache: {self.stats['hits']} fresh hits, {self.stats['not_modified']} revalidated (304), "
+                f"{self.stats['misses']} downloaded, {self.stats['evicted']} evicted, "
+                f"{self.total_bytes / 1024 ** 2:.1f} MB stored")
+
+
+def configure(directory, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, replay=False):
+    """Route every fetcher.get_page call through a cache in directory, or disable it with None"""
+    global cache
+    cache = HTTPCache(directory, ttl=ttl, max_bytes=max_bytes, replay=replay) if directory else None
+    return cache
@@ -0,0 +1,205 @@
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)",
+    "Accept-Language": "en-US,en;q=0.9"
+}
+
+POOL_SIZE = 16            # keep-alive connections kept per host
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0        # seconds, doubled on every attempt
+BACKOFF_MAX = 60.0
+MAX_RETRY_AFTER = 300.0   # never wait longer than this for a Retry-After header
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Counters shared by every scraper in the process:
+#   requests     - HTTP requests sent, retries included
+#   connections  - new TCP (+TLS) connections opened; every other request reused one
+#   retries      - requests repeated after a timeout, connection error or retryable status
+#   failures     - URLs given up on after the last retry
+stats = Counter()
+_stats_lock = threading.Lock()
+
+_session = None
+_session_lock = threading.Lock()
+
+# Timings of the last request() made on each thread, see last_request()
+_local = threading.local()
+
+
+def count(key, n=1):
+    """Increment a shared counter from any thread"""
+    with _stats_lock:
+        stats[key] += n
+
+
+def _add_connect_time(seconds):
+    _local.connect = getattr(_local, 'connect', 0.0) + seconds
+
+
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _add_connect_time(time.perf_counter() - start)
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _add_connect_time(time.perf_counter() - start)
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+    def _new_conn(self):
+        count('connections')
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+    def _new_conn(self):
+        count('connections')
+        return super()._new_conn()
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools count and time the connections they open"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+def get_session():
+    """Return the process-wide keep-alive session, creating it on first use"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            adapter = PooledAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter for the given retry attempt (0-based)"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def retry_after_delay(response):
+    """Seconds requested by a Retry-After header, or None when absent or unparseable"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(MAX_RETRY_AFTER, max(0.0, delay))
+
+
+def request(method, url, timeout=20, retries=MAX_RETRIES, **kwargs):
+    """Send a request on the shared session, retrying timeouts, connection errors and 5xx/429
+
+    Raises the last error once the retries are exhausted. Timings of the
+    final attempt are left for last_request().
+    """
+    session = get_session()
+    _local.last = timings = {'status': None, 'bytes': 0, 'retries': 0, 'retry_statuses': [], 'backoff': 0.0,
+                             'connect': 0.0, 'ttfb': None, 'download': None}
+    for attempt in range(retries + 1):
+        count('requests')
+        timings['retries'] = attempt
+        _local.connect = 0.0
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            timings['connect'] = _local.connect
+            if attempt == retries:
+                count('failures')
+                raise
+            delay = backoff_delay(attempt)
+            reason = cause = type(e).__name__
+        else:
+            # elapsed runs from sending the request to parsing the headers; the body is read after
+            total = time.perf_counter() - start
+            elapsed = response.elapsed.total_seconds()
+            timings.update(status=response.status_code, bytes=len(response.content), connect=_local.connect,
+                           ttfb=max(0.0, elapsed - _local.connect), download=max(0.0, total - elapsed))
+            if response.status_code not in RETRY_STATUSES:
+                response.raise_for_status()
+                return response
+            if attempt == retries:
+                count('failures')
+                response.raise_for_status()
+            delay = retry_after_delay(response)
+            if delay is None:
+                delay = backoff_delay(attempt)
+            reason = f"HTTP {response.status_code}"
+            cause = response.status_code
+
+        count('retries')
+        print(f"{reason} for {url}, retrying in {delay:.1f}s ({attempt + 1}/{retries})")
+        timings['retry_statuses'].append(cause)
+        timings['backoff'] += delay
+        time.sleep(delay)
+
+
+def last_request():
+    """Timings of the last request() on this thread, or None
+
+    A dict of the final status, body bytes, retries, the status (or error
+    name) that caused each retry, seconds slept in backoff and the connect /
+    time-to-first-byte / download seconds of the final attempt; connect is 0
+    when a pooled connection was reused.
+    """
+    return getattr(_local, 'last', None)
+
+
+def reset_last_request():
+    _local.last = None
+
+
+def get(url, timeout=20, retries=MAX_RETRIES, **kwargs):
+    """GET a URL with retries, see request()"""
+    return request('GET', url, timeout=timeout, retries=retries, **kwargs)
+
+
+def head(url, timeout=20, retries=MAX_RETRIES, **kwargs):
+    """HEAD a URL with retries, see request()"""
+    return request('HEAD', url, timeout=timeout, retries=retries, **kwargs)
+
+
+def format_stats():
+    """One-line summary of the shared client counters"""
+    reused = max(0, stats['requests'] - stats['connections'])
+    return (f"HTTP: {stats['requests']} requests, {stats['connections']} connections opened, "
+            f"{reused} reused, {stats['retries']} retries, {stats['failures']} failures")
@@ -0,0 +1,231 @@
+"""Mirror product images, storing each distinct image once by content.
+
+    python image_mirror.py --input products_enhanced.json --output images
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+import requests
+import fetcher
+import http_client
+import sinks
+
+DEFAULT_DIR = 'images'
+# product_details_scraper guesses large images by renaming the thumbnail
+GUESSED = '-big.'
+FALLBACK = '-small.'
+MISSING_STATUSES = {404, 410}
+
+
+def image_urls(product):
+    """image_url and extra_images of a product, without repeats"""
+    urls = []
+    for url in [product.get('image_url'), *(product.get('extra_images') or [])]:
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def probe(url, timeout=fetcher.DEFAULT_TIMEOUT):
+    """HEAD an image and return its status, ETag and size"""
+    try:
+        response = http_client.head(url, timeout=timeout, allow_redirects=True)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code in MISSING_STATUSES:
+            return {'status': e.response.status_code, 'etag': None, 'size': None}
+        raise
+    size = response.headers.get('Content-Length')
+    return {'status': response.status_code, 'etag': response.headers.get('ETag'),
+            'size': int(size) if size and size.isdigit() else None}
+
+
+def unchanged(known, head):
+    """True when a HEAD response matches a mirrored image, by ETag or else by size"""
+    if head['etag'] and known['etag']:
+        return head['etag'] == known['etag']
+    return head['size'] is not None and head['size'] == known['size']
+
+
+class ImageStore:
+    """Image files stored once per SHA-256, with an SQLite index of the URLs they came from
+
+    Files live under `directory/files/ab/<hash>`. Each image URL maps to its
+    file along with the ETag and size it had, so later runs can tell from a
+    HEAD request whether it needs downloading again. `source_url` differs from
+    the URL when a guessed '-big.' variant did not exist and the thumbnail was
+    mirrored instead.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'files'), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, 'images.sqlite'))
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS images (
+                url TEXT PRIMARY KEY,
+                source_url TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                content_type TEXT,
+                mirrored_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS images_hash ON images (hash);
+        ''')
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def path(self, image_hash):
+        return os.path.join(self.directory, 'files', image_hash[:2], image_hash)
+
+    def lookup(self, url):
+        row = self.db.execute('SELECT source_url, hash, size, etag FROM images WHERE url = ?',
+                              (url,)).fetchone()
+        if not row:
+            return None
+        return dict(zip(('source_url', 'hash', 'size', 'etag'), row))
+
+    def download(self, url, timeout=fetcher.DEFAULT_TIMEOUT):
+        """Download an image and write its file unless the same content is already stored
+
+        Runs in the fetcher's threads, so it leaves the index to record().
+        """
+        response = http_client.get(url, timeout=timeout)
+        body = response.content
+        image_hash = hashlib.sha256(body).hexdigest()
+        path = self.path(image_hash)
+        with self.lock:
+            self.stats['bytes'] += len(body)
+            if os.path.exists(path):
+                self.stats['shared'] += 1
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f"{path}.tmp{threading.get_ident()}"
+                with open(temp_path, 'wb') as f:
+                    f.write(body)
+                os.replace(temp_path, path)
+                self.stats['files'] += 1
+        return {'hash': image_hash, 'size': len(body), 'etag': response.headers.get('ETag'),
+                'content_type': response.headers.get('Content-Type')}
+
+    def record(self, url, source_url, image):
+        self.db.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (url, source_url, image['hash'], image['size'], image['etag'],
+                         image['content_type'], time.time()))
+
+    def format_stats(self):
+        stored = self.db.execute('SELECT COUNT(*), COUNT(DISTINCT hash) FROM images').fetchone()
+        return (f"Images: {stored[0]} URLs mirrored as {stored[1]} distinct files, "
+                f"{self.stats['files']} new files, {self.stats['shared']} downloads matched a stored file, "
+                f"{self.stats['bytes'] / 1024 ** 2:.1f} MB downloaded")
+
+
+def mirror(products, store, batch_size=100, **crawl_options):
+    """Bring the store up to date with the images of `products`
+
+    Guessed '-big.' URLs and images mirrored before are checked with a HEAD
+    request first: a missing variant falls back to the thumbnail and an image
+    whose ETag or size has not changed is skipped. Everything else is
+    downloaded concurrently over the shared connection pool.
+    """
+    stats = Counter()
+    urls = {}
+    for product in products:
+        for url in image_urls(product):
+            urls.setdefault(url, None)
+    print(f"Found {len(urls)} distinct image URLs")
+
+    # image URL -> URL to download it from
+    downloads = {}
+    probes = []
+    for url in urls:
+        known = store.lookup(url)
+        if known:
+            probes.append((url, known['source_url'], known))
+        elif GUESSED in url:
+            probes.append((url, url, None))
+        else:
+            downloads[url] = url
+
+    def handle_probe(item, head):
+        url, probe_url, known = item
+        if head is None:
+            downloads[url] = probe_url
+        elif head['status'] in MISSING_STATUSES:
+            if GUESSED in probe_url:
+                stats['missing'] += 1
+                downloads[url] = probe_url.replace(GUESSED, FALLBACK)
+            else:
+                print(f"Image gone: {probe_url}")
+                stats['gone'] += 1
+        elif known and unchanged(known, head):
+            stats['unchanged'] += 1
+        else:
+            downloads[url] = probe_url
+
+    if probes:
+        print(f"Checking {len(probes)} guessed or already mirrored images")
+        fetcher.crawl(probes, lambda item: item[1], lambda head, url: head, handle_probe,
+                      fetch_page=probe, stage='image_probe', **crawl_options)
+
+    # Several image URLs can resolve to the same download
+    sources = {}
+    for url, source_url in downloads.items():
+        sources.setdefault(source_url, []).append(url)
+
+    def handle_download(item, image):
+        source_url, targets = item
+        if image is None:
+            stats['failed'] += 1
+            return
+        for url in targets:
+            store.record(url, source_url, image)
+        stats['downloaded'] += 1
+        if stats['downloaded'] % batch_size == 0:
+            store.db.commit()
+            print(f"Downloaded {stats['downloaded']}/{len(sources)} images...")
+
+    print(f"Downloading {len(sources)} images")
+    fetcher.crawl(sources.items(), lambda item: item[0], lambda image, url: image, handle_download,
+                  fetch_page=store.download, stage='image_download', **crawl_options)
+    store.db.commit()
+    return stats
+
+
+def main():
+    parser = fetcher.add_crawl_arguments(argparse.ArgumentParser(description=__doc__.splitlines()[0]))
+    parser.add_argument('--input', default='products_enhanced.json',
+                        help='Products with image_url / extra_images, as a JSON array or NDJSON '
+                             '(default: %(default)s)')
+    parser.add_argument('--output', default=DEFAULT_DIR,
+                        help='Directory holding the image files and their index (default: %(default)s)')
+    args = parser.parse_args()
+    crawl_options = fetcher.configure(args)
+    # Images bypass the page cache and there is nothing to parse
+    crawl_options.pop('parse_workers')
+    crawl_options.pop('queue_size')
+
+    if not os.path.exists(args.input):
+        print(f"Error: {args.input} not found.")
+        return
+
+    store = ImageStore(args.output)
+    try:
+        stats = mirror(sinks.iter_records(args.input), store, **crawl_options)
+        print(f"\nMirroring complete! {stats['downloaded']} downloaded, {stats['unchanged']} unchanged, "
+              f"{stats['missing']} guessed variants missing, {stats['failed']} failed")
+        print(store.format_stats())
+    finally:
+        store.close()
+    print(fetcher.format_stats())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+
+# Per-page timings recorded by fetcher, in seconds
+PHASES = ('wait', 'connect', 'ttfb', 'download', 'parse', 'total')
+QUANTILES = (0.5, 0.95, 0.99)
+PROMETHEUS_INTERVAL = 10.0   # seconds between rewrites of the Prometheus file during a run
+# Ratio between the bounds of a histogram bucket: quantiles are within 1% of the recorded value
+BUCKET_GROWTH = 1.02
+# Timings below this, such as the connect time of a reused connection, count as zero
+RESOLUTION = 1e-6
+
+# Process-wide recorder used by fetcher, replaced by configure()
+recorder = None
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list: the ceil(q * n)-th value
+
+    >>> values = list(range(1, 101))
+    >>> percentile(values, 0.5), percentile(values, 0.95), percentile(values, 0.99)
+    (50, 95, 99)
+    >>> percentile(list(range(1, 21)), 0.95), percentile([7, 9, 11], 0.5)
+    (19, 9)
+    """
+    if not sorted_values:
+        return None
+    return sorted_values[nearest_rank(q, len(sorted_values))]
+
+
+def nearest_rank(q, count):
+    """Index of the q-quantile among `count` sorted values"""
+    # Rounded first so float error in q * n, as in 0.07 * 100, does not push it to the next rank
+    return max(0, min(count - 1, math.ceil(round(q * count, 9)) - 1))
+
+
+class Histogram:
+    """Counts of values in log-spaced buckets, so a phase's timings take constant memory
+
+    Each bucket spans a factor of BUCKET_GROWTH; a quantile is the midpoint
+    of the bucket holding the nearest-rank value, kept within the smallest
+    and largest value seen. The count and sum are exact.
+
+    >>> histogram = Histogram()
+    >>> for value in range(1, 101):
+    ...     histogram.add(value / 1000)
+    >>> [round(histogram.quantile(q) * 1000, 1) for q in (0.5, 0.95, 0.99)]
+    [49.8, 95.7, 99.6]
+    >>> histogram.count, round(histogram.sum, 3), len(histogram.buckets) < 100
+    (100, 5.05, True)
+    """
+
+    def __init__(self):
+        self.buckets = defaultdict(int)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.buckets[math.floor(math.log(value, BUCKET_GROWTH)) if value >= RESOLUTION else None] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def copy(self):
+        histogram = Histogram()
+        histogram.buckets = defaultdict(int, self.buckets)
+        histogram.count, histogram.sum, histogram.min, histogram.max = self.count, self.sum, self.min, self.max
+        return histogram
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = nearest_rank(q, self.count)
+        seen = self.buckets.get(None, 0)
+        if rank < seen:
+            return 0.0
+        for bucket in sorted(key for key in self.buckets if key is not None):
+            seen += self.buckets[bucket]
+            if rank < seen:
+                return min(self.max, max(self.min, BUCKET_GROWTH ** (bucket + 0.5)))
+
+
+class StageStats:
+    def __init__(self):
+        self.pages = 0
+        self.errors = 0
+        self.bytes = 0
+        self.retries = 0
+        self.statuses = defaultdict(int)
+        self.timings = {phase: Histogram() for phase in PHASES}
+        self.first = None
+        self.last = None
+
+    def rate(self):
+        """Pages per second between the first request starting and the last page finishing"""
+        if not self.pages or self.last is None or self.last <= self.first:
+            return 0.0
+        return self.pages / (self.last - self.first)
+
+
+class Metrics:
+    """Per-page fetch and parse measurements, aggregated per stage
+
+    Each page gets one record: how long it waited for a connection slot and
+    a rate token, the connect / time-to-first-byte / download times of the
+    request that returned it, the parse time, body bytes, final status and
+    retries. Records are appended to `log_path` as NDJSON when it is set,
+    and `prometheus_path` is rewritten in the text exposition format every
+    PROMETHEUS_INTERVAL seconds and on flush().
+    """
+
+    def __init__(self, log_path=None, prometheus_path=None):
+        self.stages = defaultdict(StageStats)
+        self.lock = threading.Lock()
+        self.log = open(log_path, 'a', encoding='utf-8') if log_path else None
+        self.prometheus_path = prometheus_path
+        self.prometheus_written = time.monotonic()
+
+    def record(self, stage, url, started, timings, error=None):
+        """Record a finished page; `started` is its time.monotonic() when it was queued"""
+        now = time.monotonic()
+        timings = dict(timings, total=now - started)
+        with self.lock:
+            stats = self.stages[stage]
+            stats.first = started if stats.first is None else min(stats.first, started)
+            stats.last = now
+            stats.pages += 1
+            stats.bytes += timings.get('bytes') or 0
+            stats.retries += timings.get('retries') or 0
+            stats.statuses[str(timings.get('status') or ('error' if error else 'cached'))] += 1
+            if error:
+                stats.errors += 1
+            for phase in PHASES:
+                if timings.get(phase) is not None:
+                    stats.timings[phase].add(timings[phase])
+            if self.log:
+                entry = {'ts': round(time.time(), 3), 'stage': stage, 'url': url}
+                entry.update((key, round(value, 6) if isinstance(value, float) else value)
+                             for key, value in timings.items())
+                if error:
+                    entry['error'] = error
+                self.log.write(json.dumps(entry))
+                self.log.write('\n')
+            write_prometheus = self.prometheus_path and now - self.prometheus_written >= PROMETHEUS_INTERVAL
+        if write_prometheus:
+            self.write_prometheus()
+
+    def flush(self):
+        """Push the log to disk and rewrite the Prometheus file"""
+        if self.log:
+            with self.lock:
+                self.log.flush()
+        if self.prometheus_path:
+            self.write_prometheus()
+
+    def close(self):
+        self.flush()
+        if self.log:
+            self.log.close()
+            self.log = None
+
+    def _snapshot(self):
+        with self.lock:
+            return {stage: (stats.pages, stats.errors, stats.bytes, stats.retries, dict(stats.statuses),
+                            stats.rate(), {phase: values.copy() for phase, values in stats.timings.items()})
+                    for stage, stats in self.stages.items()}
+
+    def format_summary(self):
+        """Pages/sec and p50/p95/p99 per stage and phase, in milliseconds"""
+        lines = []
+        for stage, (pages, errors, size, retries, statuses, rate, timings) in sorted(self._snapshot().items()):
+            lines.append(f"{stage}: {pages} pages ({errors} errors, {retries} retries), {rate:.2f} pages/s, "
+                         f"{size / 1024 ** 2:.1f} MB, status {json.dumps(statuses, sort_keys=True)}")
+            for phase in PHASES:
+                values = timings[phase]
+                if values.count:
+                    p50, p95, p99 = (values.quantile(q) * 1000 for q in QUANTILES)
+                    lines.append(f"  {phase:<9} p50 {p50:8.1f} ms  p95 {p95:8.1f} ms  p99 {p99:8.1f} ms")
+        return '\n'.join(lines)
+
+    def write_prometheus(self):
+        """Rewrite prometheus_path atomically, for node_exporter's textfile collector"""
+        snapshot = sorted(self._snapshot().items())
+        families = [
+            ('scraper_pages_total', 'counter', 'Pages fetched and parsed, by stage.', 0),
+            ('scraper_errors_total', 'counter', 'Pages that could not be fetched or parsed, by stage.', 1),
+            ('scraper_bytes_total', 'counter', 'Response body bytes downloaded, by stage.', 2),
+            ('scraper_retries_total', 'counter', 'Requests repeated after an error, by stage.', 3),
+            ('scraper_pages_per_second', 'gauge', 'Pages finished per second over the run, by stage.', 5),
+        ]
+        lines = []
+        for name, kind, description, field in families:
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{{stage="{stage}"}} {values[field]}' for stage, values in snapshot]
+
+        lines += ['# HELP scraper_phase_seconds Time spent per page in each phase, by stage.',
+                  '# TYPE scraper_phase_seconds summary']
+        for stage, (*_, timings) in snapshot:
+            for phase in PHASES:
+                values = timings[phase]
+                if not values.count:
+                    continue
+                labels = f'stage="{stage}",phase="{phase}"'
+                for q in QUANTILES:
+                    lines.append(f'scraper_phase_seconds{{{labels},quantile="{q}"}} {values.quantile(q):.6f}')
+                lines.append(f'scraper_phase_seconds_sum{{{labels}}} {values.sum:.6f}')
+                lines.append(f'scraper_phase_seconds_count{{{labels}}} {values.count}')
+
+        temp_path = f"{self.prometheus_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, self.prometheus_path)
+        self.prometheus_written = time.monotonic()
+
+def configure(log_path=None, prometheus_path=None):
+    """Start recording pages, optionally logging them and exporting Prometheus metrics"""
+    global recorder
+    if recorder is not None:
+        recorder.close()
+    recorder = Metrics(log_path, prometheus_path)
+    return recorder
@@ -0,0 +1,223 @@
+"""Byte offsets of the records of a JSON array or NDJSON file, kept in a sidecar index.
+
+    python offset_index.py products.json                 # build or refresh products.json.offsets
+    python offset_index.py products.json --get 41000123  # products with this id or SKU
+    python offset_index.py products.json --ranges 4      # the file split in 4 balanced ranges
+
+One streaming pass finds where each record starts and ends. Afterwards any
+record is read straight from its bytes through mmap, and the file splits
+into ranges of about equal size that separate processes can work through.
+"""
+import argparse
+import json
+import mmap
+import os
+import re
+import sqlite3
+import sinks
+
+SUFFIX = '.offsets'
+# Strings, skipped whole so the brackets inside them are not counted, and brackets
+TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|[\[\]{}]', re.S)
+OPENING = frozenset(b'[{')
+# Rows inserted at a time while building
+CHUNK = 10000
+
+
+def scan_array(data):
+    """Yield the (offset, length) of each element of the JSON array in `data`"""
+    depth = 0
+    start = None
+    for match in TOKEN.finditer(data):
+        char = data[match.start()]
+        if char == 0x22:   # a string
+            continue
+        if char in OPENING:
+            depth += 1
+            if depth == 2:
+                start = match.start()
+        else:
+            depth -= 1
+            if depth == 1:
+                yield start, match.end() - start
+
+
+def scan_lines(data):
+    """Yield the (offset, length) of each non-blank line of NDJSON `data`"""
+    size = len(data)
+    offset = 0
+    while offset < size:
+        end = data.find(b'\n', offset)
+        if end < 0:
+            end = size
+        if data[offset:end].strip():
+            yield offset, end - offset
+        offset = end + 1
+
+
+class OffsetIndex:
+    """Position, byte offset, length, id and SKU of every record of a file
+
+    The index lives next to the file, in `path` + '.offsets', and is built
+    again whenever the file's size or modification time changed. Positions
+    are the record's index in the file, as sinks.iter_records() counts them.
+    Compressed files cannot be indexed: their records have no byte offsets.
+    """
+
+    def __init__(self, path, index_path=None):
+        if path.endswith(('.gz', '.zst')):
+            raise ValueError(f"{path}: compressed files cannot be indexed; decompress it first")
+        self.path = path
+        self.index_path = index_path or f"{path}{SUFFIX}"
+        self.file = None
+        self.data = None
+        self.db = sqlite3.connect(self.index_path)
+        self.db.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS records (
+                position INTEGER PRIMARY KEY,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                id TEXT,
+                sku TEXT
+            );
+            CREATE INDEX IF NOT EXISTS records_offset ON records (offset);
+            CREATE INDEX IF NOT EXISTS records_id ON records (id);
+            CREATE INDEX IF NOT EXISTS records_sku ON records (sku);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        ''')
+        self.built = False
+        if self.stale():
+            self.build()
+
+    def identity(self):
+        stat = os.stat(self.path)
+        return json.dumps({'size': stat.st_size, 'mtime': stat.st_mtime})
+
+    def stale(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+        return row is None or row[0] != self.identity()
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.file.close()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        """Map the file into memory; an empty file maps to b''"""
+        if self.data is None:
+            self.file = open(self.path, 'rb')
+            size = os.fstat(self.file.fileno()).st_size
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        return self.data
+
+    def build(self):
+        """Index every record of the file in one pass; returns how many"""
+        if self.data is not None:
+            self.data.close()
+            self.file.close()
+            self.data = None
+        identity = self.identity()
+        data = self.open()
+        scan = scan_lines if sinks.is_ndjson(self.path) else scan_array
+        count = 0
+        rows = []
+        with self.db:
+            self.db.execute('DELETE FROM records')
+            for offset, length in scan(data):
+                record = sinks.loads(data[offset:offset + length])
+                values = [record.get(field) if isinstance(record, dict) else None for field in ('id', 'sku')]
+                rows.append((count, offset, length, *(None if value is None else str(value) for value in values)))
+                count += 1
+                if len(rows) >= CHUNK:
+                    self.db.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?)', rows)
+                    rows = []
+            self.db.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?)', rows)
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('source', ?)", (identity,))
+        self.built = True
+        return count
+
+    def count(self):
+        return self.db.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def record(self, position):
+        """Record at `position`, decoded from its bytes; KeyError when there is none"""
+        row = self.db.execute('SELECT offset, length FROM records WHERE position = ?', (position,)).fetchone()
+        if row is None:
+            raise KeyError(position)
+        offset, length = row
+        return sinks.loads(self.open()[offset:offset + length])
+
+    def positions(self, key):
+        """Positions of the records whose id or SKU is `key`"""
+        return [position for (position,) in self.db.execute(
+            'SELECT position FROM records WHERE id = ? UNION SELECT position FROM records WHERE sku = ? '
+            'ORDER BY position', (str(key), str(key)))]
+
+    def find(self, key):
+        """Records whose id or SKU is `key`, in file order"""
+        return [self.record(position) for position in self.positions(key)]
+
+    def ranges(self, count):
+        """`count` (start, stop) position ranges covering the file, of about equal bytes each
+
+        A range is empty when there are fewer records than ranges.
+        """
+        first, last = self.db.execute('SELECT MIN(offset), MAX(offset + length) FROM records').fetchone()
+        total = self.count()
+        if not total:
+            return [(0, 0)] * count
+        bounds = [0]
+        for k in range(1, count):
+            target = first + (last - first) * k / count
+            row = self.db.execute('SELECT MIN(position) FROM records WHERE offset >= ?', (target,)).fetchone()
+            bounds.append(max(bounds[-1], total if row[0] is None else row[0]))
+        bounds.append(total)
+        return list(zip(bounds, bounds[1:]))
+
+    def iter_range(self, start, stop):
+        """Yield the (position, record) pairs of positions start <= position < stop"""
+        data = self.open()
+        rows = self.db.execute('SELECT position, offset, length FROM records '
+                               'WHERE position >= ? AND position < ? ORDER BY position', (start, stop))
+        for position, offset, length in rows:
+            yield position, sinks.loads(data[offset:offset + length])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('file', help='JSON array or NDJSON file, such as products.json')
+    parser.add_argument('--get', metavar='KEY', help='Print the records whose id or SKU is KEY')
+    parser.add_argument('--ranges', type=int, metavar='N', help='Print the file split in N balanced ranges')
+    args = parser.parse_args()
+    if args.file.endswith(('.gz', '.zst')):
+        parser.error(f"{args.file} is compressed; only an uncompressed file can be indexed")
+
+    with OffsetIndex(args.file) as index:
+        print(f"{'Indexed' if index.built else 'Index up to date:'} {index.count()} records of {args.file} "
+              f"in {index.index_path}")
+        if args.get:
+            for record in index.find(args.get):
+                print(sinks.dumps(record))
+        if args.ranges:
+            for k, (start, stop) in enumerate(index.ranges(args.ranges)):
+                size = 0
+                if stop > start:
+                    first, end = index.db.execute(
+                        'SELECT MIN(offset), MAX(offset + length) FROM records WHERE position >= ? AND position < ?',
+                        (start, stop)).fetchone()
+                    size = end - first
+                print(f"{k}/{args.ranges}: products {start}..{stop - 1}, {size / 1024 ** 2:.1f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+import html as html_entities
+import re
+from urllib.parse import urljoin
+import lxml.html
+from lxml import etree
+from fields import parse_price, stock_info
+from urls import PAGE_PARAM, query_param
+
+# Precompiled XPath for the catalogue markup. `has_class` matches one token of a
+# multi-valued class attribute, like BeautifulSoup's class_='...'.
+def has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+CAT_ROWS = etree.XPath(f"//tr[{has_class('viewCatList__row')}]")
+ITEM_ROWS = etree.XPath(f"//tr[{has_class('viewItemList__row')}]")
+ALL_CELLS = etree.XPath(".//td")
+OX_CELLS = etree.XPath(".//td[contains(@class, 'oxcell')]")
+PRODUCT_CELLS = etree.XPath(".//td[contains(@class, 'oxcell')][@data-pdt-id != '']")
+LINK = etree.XPath(f".//a[{has_class('PBLink')}]")
+CAT_LINK = etree.XPath(f".//a[{has_class('PBLink')}][contains(@href, 'PBCATID=')]")
+CAT_TITLE = etree.XPath(f".//h3[{has_class('PBCatSubTitle')}]")
+CAT_IMAGE = etree.XPath(f".//img[{has_class('imgcat')}]")
+PRODUCT_TITLE = etree.XPath(f".//h3[{has_class('PBMainTxt')}]")
+PRODUCT_IMAGE = etree.XPath(f".//img[{has_class('imgthumbnail')}]")
+# Classes of the price and stock spans of a product cell, read in one pass by _field_spans()
+PRICE_CLASS = 'PBSalesPrice'
+IN_STOCK_CLASS = 'PBMsgInStock'
+STOCK_QTY_CLASS = 'PBStockQty'
+FIELD_CLASSES = frozenset((PRICE_CLASS, IN_STOCK_CLASS, STOCK_QTY_CLASS))
+# Text nodes as BeautifulSoup's get_text() sees them: script and style contents excluded
+TEXT = etree.XPath(".//text()[not(parent::script) and not(parent::style)]")
+
+# Listing pagination: page links carry the page number in the PAGE_PARAM query parameter
+PAGE_LINKS = etree.XPath(f"//a[contains(@href, '{PAGE_PARAM}=')]/@href")
+PAGE_NUMBER = re.compile(rf'[?&]{PAGE_PARAM}=(\d+)')
+
+# Patterns for parse_listing_stock(), which reads the raw page without building a tree
+def class_token(name):
+    """Pattern of a class attribute holding `name` as one of its tokens"""
+    return rf"""\bclass\s*=\s*["'](?:[^"']*\s)?{name}(?:\s[^"']*)?["']"""
+
+CELL_START = re.compile(r'<td\b[^>]*>', re.I)
+CELL_END = re.compile(r'</td\s*>', re.I)
+CELL_CLASS = re.compile(r"""\bclass\s*=\s*["'][^"']*oxcell""", re.I)
+CELL_ID = re.compile(r"""\bdata-pdt-id\s*=\s*(["'])(.*?)\1""", re.I | re.S)
+CELL_SKU = re.compile(r"""\bdata-pdt-sku\s*=\s*(["'])(.*?)\1""", re.I | re.S)
+PRICE_SPAN = re.compile(rf"<span\b[^>]*{class_token(PRICE_CLASS)}[^>]*>(.*?)</span\s*>", re.I | re.S)
+IN_STOCK_SPAN = re.compile(rf"<span\b[^>]*{class_token(IN_STOCK_CLASS)}[^>]*>(.*?)</span\s*>", re.I | re.S)
+STOCK_QTY_SPAN = re.compile(rf"<span\b[^>]*{class_token(STOCK_QTY_CLASS)}[^>]*>(.*?)</span\s*>", re.I | re.S)
+TAG = re.compile(r'<[^>]*>')
+PAGE_LINK_NUMBER = re.compile(rf'{PAGE_PARAM}=(\d+)')
+# Start of an <a> tag up to the inside of its href value
+OPEN_HREF = re.compile(r"""<a\s[^>]*\bhref\s*=\s*["'][^"'>]*$""", re.I)
+
+
+def parse_html(html):
+    """Build an lxml tree from page text or bytes, or return None for an empty page"""
+    if not html or not html.strip():
+        return None
+    try:
+        return lxml.html.fromstring(html)
+    except ValueError:
+        # Unicode strings with an XML encoding declaration must be given as bytes
+        return lxml.html.fromstring(html.encode('utf-8'))
+
+
+def first(xpath, node):
+    """First match of a compiled XPath under node, or None"""
+    found = xpath(node)
+    return found[0] if found else None
+
+
+def text_of(node):
+    """Equivalent of BeautifulSoup's get_text(strip=True)"""
+    return ''.join(s.strip() for s in TEXT(node))
+
+
+def span_text(span):
+    """text_of() a span, without the XPath when it holds no child element"""
+    if len(span):
+        return text_of(span)
+    return (span.text or '').strip()
+
+
+def _field_spans(cell):
+    """{class: first span of that class} for the price and stock spans of a product cell"""
+    spans = {}
+    for span in cell.iter('span'):
+        classes = span.get('class')
+        if classes:
+            for name in classes.split():
+                if name in FIELD_CLASSES and name not in spans:
+                    spans[name] = span
+    return spans
+
+
+def catalog_id(url):
+    """PBCATID of a catalogue URL, or None"""
+    return query_param(url, 'PBCATID')
+
+
+def parse_brands(html, url):
+    """Parse the brand categories listed on the catalogue root page"""
+    root = parse_html(html)
+    rows = CAT_ROWS(root) if root is not None else []
+    print(f"Found {len(rows)} category rows")
+    if not rows:
+        print("No category rows found")
+        return []
+
+    categories = []
+    processed_ids = set()  # To track processed category IDs
+    for row in rows:
+        for cell in ALL_CELLS(row):
+            try:
+                # Find the first link with class PBLink that has an href with PBCATID
+                link_tag = first(CAT_LINK, cell)
+                if link_tag is None or not link_tag.get('href'):
+                    continue
+
+                full_url = urljoin(url, link_tag.get('href'))
+
+                # Extract category ID and name from URL parameters
+                cat_id = catalog_id(full_url) or 'N/A'
+
+                # Skip if we've already processed this category
+                if cat_id in processed_ids:
+                    continue
+                processed_ids.add(cat_id)
+
+                # Get category name from the h3 with class PBCatSubTitle
+                name_tag = first(CAT_TITLE, cell)
+                cat_name = text_of(name_tag) if name_tag is not None else ''
+
+                # If no name in h3, try to get it from URL params
+                if not cat_name:
+                    cat_name = (query_param(full_url, 'PBCATName') or '').strip()
+
+                img_tag = first(CAT_IMAGE, cell)
+                img_src = img_tag.get('src') if img_tag is not None else None
+                img_url = urljoin(url, img_src) if img_src is not None else None
+
+                # Only add if we have at least an ID or a name
+                if cat_id != 'N/A' or cat_name:
+                    categories.append({
+                        "id": cat_id,
+                        "name": cat_name or f"Unnamed Category {len(categories) + 1}",
+                        "url": full_url,
+                        "image_url": img_url
+                    })
+
+            except Exception as e:
+                print(f"Error processing category: {str(e)}")
+                continue
+
+    return categories
+
+
+def _parse_catalog_cells(html, page_url):
+    """Yield (cell, url, id) for each distinct catalogue link on a brand or model page"""
+    root = parse_html(html)
+    if root is None:
+        return
+    processed_ids = set()
+    for row in CAT_ROWS(root):
+        for cell in OX_CELLS(row):
+            link = first(LINK, cell)
+            if link is None or not link.get('href'):
+                continue
+            url = urljoin(page_url, link.get('href'))
+            item_id = catalog_id(url)
+            if item_id in processed_ids:
+                continue
+            processed_ids.add(item_id)
+            yield cell, url, item_id
+
+
+def parse_models(html, brand_url):
+    """Parse the models listed on a brand page"""
+    models = []
+    for cell, model_url, model_id in _parse_catalog_cells(html, brand_url):
+        try:
+            name_tag = first(CAT_TITLE, cell)
+            img_tag = first(CAT_IMAGE, cell)
+            img_src = img_tag.get('src') if img_tag is not None else None
+            models.append({
+                "id": model_id,
+                "name": text_of(name_tag) if name_tag is not None else 'Unnamed Model',
+                "url": model_url,
+                "image_url": urljoin(brand_url, img_src) if img_src is not None else None
+            })
+        except Exception as e:
+            print(f"Error processing model: {str(e)}")
+
+    if not models:
+        print(f"No model rows found in {brand_url}")
+    return models
+
+
+def parse_categories(html, model_url):
+    """Parse the categories listed on a model page"""
+    categories = []
+    for cell, category_url, category_id in _parse_catalog_cells(html, model_url):
+        if not category_id:
+            continue
+        try:
+            name_tag = first(CAT_TITLE, cell)
+            categories.append({
+                "id": category_id,
+                "name": text_of(name_tag) if name_tag is not None else 'Unnamed Category',
+                "url": category_url
+            })
+        except Exception as e:
+            print(f"Error processing category: {str(e)}")
+
+    if not categories:
+        print(f"No category rows found in {model_url}")
+    return categories
+
+
+def page_count(root):
+    """Highest page number linked from a listing page, 1 when it is not paginated"""
+    pages = [int(match.group(1)) for href in PAGE_LINKS(root) for match in PAGE_NUMBER.finditer(href)]
+    return max(pages, default=1)
+
+
+def page_url(url, page):
+    """URL of page `page` of a listing, keeping the rest of the query as it is"""
+    if PAGE_NUMBER.search(url):
+        return PAGE_NUMBER.sub(lambda m: f"{m.group(0)[0]}{PAGE_PARAM}={page}", url)
+    return f"{url}{'&' if '?' in url else '?'}{PAGE_PARAM}={page}"
+
+
+def merge_pages(pages):
+    """Concatenate the products of a listing's pages in page order, dropping repeated data-pdt-id"""
+    products = {}
+    for page_products in pages:
+        for product in page_products:
+            products.setdefault(product['id'], product)
+    return list(products.values())
+
+
+def parse_listing(html, category_url):
+    """Parse a category page into (products, number of pages in the listing)"""
+    root = parse_html(html)
+    products = _parse_product_rows(root, category_url)
+    return products, page_count(root) if root is not None else 1
+
+
+def parse_products(html, category_url):
+    """Parse the products listed on a category page"""
+    return _parse_product_rows(parse_html(html), category_url)
+
+
+def _parse_product_rows(root, category_url):
+    rows = ITEM_ROWS(root) if root is not None else []
+    if not rows:
+        print(f"No product rows found in {category_url}")
+        return []
+
+    products = []
+    for row in rows:
+        try:
+            for cell in PRODUCT_CELLS(row):
+                name_tag = first(PRODUCT_TITLE, cell)
+                link_tag = first(LINK, cell)
+                href = link_tag.get('href') if link_tag is not None else None
+                img_tag = first(PRODUCT_IMAGE, cell)
+                img_src = img_tag.get('src') if img_tag is not None else None
+                spans = _field_spans(cell)
+                price_tag = spans.get(PRICE_CLASS)
+
+                # Get stock status, and the quantity shown next to it
+                stock = stock_info(None)
+                stock_tag = spans.get(IN_STOCK_CLASS)
+                if stock_tag is not None:
+                    qty_tag = spans.get(STOCK_QTY_CLASS)
+                    stock = stock_info(span_text(stock_tag), span_text(qty_tag) if qty_tag is not None else None)
+
+                products.append({
+                    'id': cell.get('data-pdt-id'),
+                    'sku': cell.get('data-pdt-sku', '').strip(),
+                    'name': text_of(name_tag) if name_tag is not None else 'Unnamed Product',
+                    'url': urljoin(category_url, href) if href is not None else None,
+                    'image_url': urljoin(category_url, img_src) if img_src is not None else None,
+                    'price': parse_price(span_text(price_tag)) if price_tag is not None else None,
+                    'stock_status': stock.status,
+                    'stock_quantity': stock.quantity
+                })
+
+        except Exception as e:
+            print(f"Error processing product: {str(e)}")
+            continue
+
+    return products
+
+
+def _raw_text(fragment):
+    """text_of() for a fragment of raw markup: its text nodes stripped and joined"""
+    return ''.join(html_entities.unescape(piece).strip() for piece in TAG.split(fragment))
+
+
+def parse_listing_stock(html, category_url):
+    """Price and stock of the products on a category page, and the page count, without building a tree
+
+    A fast path of parse_listing() for stock polling: compiled patterns pick
+    the product cells and their price and stock spans straight out of the
+    page text. Records hold only id, sku, price, stock_status and
+    stock_quantity, read from the same spans as parse_listing() does.
+    """
+    if isinstance(html, bytes):
+        html = html.decode('utf-8', errors='replace')
+    start = html.find('viewItemList__row') if html else -1
+    if start < 0:
+        print(f"No product rows found in {category_url}")
+        return [], 1
+
+    products = []
+    for cell in CELL_START.finditer(html, start):
+        tag = cell.group(0)
+        cell_id = CELL_ID.search(tag)
+        if cell_id is None or not cell_id.group(2) or not CELL_CLASS.search(tag):
+            continue
+        end = CELL_END.search(html, cell.end())
+        body = html[cell.end():end.start() if end else len(html)]
+        sku = CELL_SKU.search(tag)
+        price = PRICE_SPAN.search(body)
+
+        stock = stock_info(None)
+        in_stock = IN_STOCK_SPAN.search(body)
+        if in_stock is not None:
+            qty = STOCK_QTY_SPAN.search(body)
+            stock = stock_info(_raw_text(in_stock.group(1)), _raw_text(qty.group(1)) if qty else None)
+
+        products.append({
+            'id': html_entities.unescape(cell_id.group(2)),
+            'sku': html_entities.unescape(sku.group(2)).strip() if sku else '',
+            'price': parse_price(_raw_text(price.group(1))) if price is not None else None,
+            'stock_status': stock.status,
+            'stock_quantity': stock.quantity,
+        })
+
+    # Page links, as page_count() finds them, looked up from the page parameter backwards
+    pages = []
+    for match in PAGE_LINK_NUMBER.finditer(html):
+        before = html[html.rfind('<', 0, match.start()):match.start()]
+        if before.endswith(('?', '&', '&amp;')) and OPEN_HREF.match(before):
+            pages.append(int(match.group(1)))
+    return products, max(pages, default=1)
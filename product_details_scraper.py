@@ -1,18 +1,22 @@
-import json
-import time
-import requests
+import argparse
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin
-import ijson
 import os
-from tempfile import NamedTemporaryFile
-from decimal import Decimal
-import numbers
+import subprocess
+import sys
+import time
+import fetcher
+import fingerprints
+from catalog_store import add_store_argument, open_store
+from crawl import parse_shard
+from offset_index import OffsetIndex
+from product_index import DetailsMap
+from search_index import SearchIndex
+import sinks
+from urls import canonical
 
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7",
-    "Accept-Language": "en-US,en;q=0.9"
-}
+# Seconds between looks at the pages another part is still fetching
+POLL_INTERVAL = 0.5
 
 def clean_text(text):
     """Clean and normalize text"""
@@ -23,154 +27,418 @@ def clean_text(text):
 def extract_additional_details(product_url):
     """Extract additional details from product page"""
     try:
-        response = requests.get(product_url, headers=HEADERS, timeout=20)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        details = {
-            'extra_images': [],
-            'product_code': None,
-            'description': None,
-            'specifications': {}
-        }
-        
-        # Extract product code
-        code_span = soup.find('div', class_='PBItemSku')
-        if code_span:
-            code_text = code_span.get_text(strip=True)
-            code = code_text.replace('(Code:', '').replace(')', '').strip()
-            details['product_code'] = code
-        
-        # Extract description if available
-        desc_div = soup.find('div', class_='PBItemDescription')
-        if desc_div:
-            details['description'] = clean_text(desc_div.get_text())
-        
-        # Extract all images
-        main_img_div = soup.find('div', class_='c-ox-imgzoom__main')
-        if main_img_div:
-            main_img = main_img_div.find('img')
-            if main_img and 'src' in main_img.attrs:
-                main_img_url = urljoin(product_url, main_img['src'])
-                if main_img_url not in details['extra_images']:
-                    details['extra_images'].append(main_img_url)
-        
-        # Extract additional images from the carousel
-        thumbnails = soup.find_all('div', class_='mcs-item')
-        for thumb in thumbnails:
-            img_tag = thumb.find('img')
-            if img_tag and 'src' in img_tag.attrs:
-                img_url = urljoin(product_url, img_tag['src'])
-                img_url = img_url.replace('-small.', '-big.')  # Try to get larger version
-                if img_url not in details['extra_images']:
-                    details['extra_images'].append(img_url)
-        
-        # Extract images from data-image attributes
-        for img in soup.find_all(attrs={"data-image": True}):
-            img_filename = img['data-image']
-            if img_filename:
-                full_img_url = f"https://www.pieces-quad-dole.fr/{img_filename}"
-                if full_img_url not in details['extra_images']:
-                    details['extra_images'].append(full_img_url)
-        
-        # Extract specifications if available
-        spec_tables = soup.find_all('table', class_='PBSpecTbl')
-        for table in spec_tables:
-            rows = table.find_all('tr')
-            for row in rows:
-                cells = row.find_all('td')
-                if len(cells) == 2:
-                    key = clean_text(cells[0].get_text())
-                    value = clean_text(cells[1].get_text())
-                    if key and value:
-                        details['specifications'][key] = value
-        
-        return details
-        
+        return parse_details(fetcher.fetch(product_url, stage='details'), product_url)
     except Exception as e:
         print(f"Error extracting details from {product_url}: {str(e)}")
         return None
 
-def process_products(input_file, output_file, batch_size=10):
-    """Process products in batches to handle large files efficiently"""
+def parse_details(html, product_url):
+    """Parse the additional details shown on a product page"""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    details = {
+        'extra_images': [],
+        'product_code': None,
+        'description': None,
+        'specifications': {}
+    }
+
+    # Extract product code
+    code_span = soup.find('div', class_='PBItemSku')
+    if code_span:
+        code_text = code_span.get_text(strip=True)
+        code = code_text.replace('(Code:', '').replace(')', '').strip()
+        details['product_code'] = code
+
+    # Extract description if available
+    desc_div = soup.find('div', class_='PBItemDescription')
+    if desc_div:
+        details['description'] = clean_text(desc_div.get_text())
+
+    # Extract all images
+    main_img_div = soup.find('div', class_='c-ox-imgzoom__main')
+    if main_img_div:
+        main_img = main_img_div.find('img')
+        if main_img and 'src' in main_img.attrs:
+            main_img_url = urljoin(product_url, main_img['src'])
+            if main_img_url not in details['extra_images']:
+                details['extra_images'].append(main_img_url)
+
+    # Extract additional images from the carousel
+    thumbnails = soup.find_all('div', class_='mcs-item')
+    for thumb in thumbnails:
+        img_tag = thumb.find('img')
+        if img_tag and 'src' in img_tag.attrs:
+            img_url = urljoin(product_url, img_tag['src'])
+            img_url = img_url.replace('-small.', '-big.')  # Try to get larger version
+            if img_url not in details['extra_images']:
+                details['extra_images'].append(img_url)
+
+    # Extract images from data-image attributes
+    for img in soup.find_all(attrs={"data-image": True}):
+        img_filename = img['data-image']
+        if img_filename:
+            full_img_url = f"https://www.pieces-quad-dole.fr/{img_filename}"
+            if full_img_url not in details['extra_images']:
+                details['extra_images'].append(full_img_url)
+
+    # Extract specifications if available
+    spec_tables = soup.find_all('table', class_='PBSpecTbl')
+    for table in spec_tables:
+        rows = table.find_all('tr')
+        for row in rows:
+            cells = row.find_all('td')
+            if len(cells) == 2:
+                key = clean_text(cells[0].get_text())
+                value = clean_text(cells[1].get_text())
+                if key and value:
+                    details['specifications'][key] = value
+
+    return details
+
+def process_products(input_file, output_file, batch_size=10, index=None, delta_file=None, store=None,
+                     segments=None, segment_size=sinks.DEFAULT_SEGMENT_SIZE, pretty=False, search=None,
+                     part=None, details_file=None, **crawl_options):
+    """Process products in batches to handle large files efficiently
+
+    With a FingerprintIndex, only products that are new, whose listing changed
+    or whose details are older than the index's max age get their detail page
+    fetched; the others reuse the details stored in the index.
+
+    Each distinct detail page is fetched once per run: copies of a product
+    listed under several categories, or linked by equivalent URLs, share the
+    details of the first fetch. Those details are kept on disk in a
+    DetailsMap, `details_file` (by default output_file + '.details'), which
+    a failed run with `segments` keeps for its rerun.
+
+    With `segments`, a directory, products are written to segment files of
+    `segment_size` products committed atomically in the background instead
+    of one temporary file. A failed run keeps its committed segments and a
+    rerun with the same directory only processes the products they lack;
+    output_file is merged from the segments once every product is in.
+
+    Prices are read as floats and the output has one compact product per
+    line, in input order; `pretty` indents it as earlier versions did.
+
+    With a SearchIndex, every product written is also indexed for search.
+
+    `part` (k, n) only enriches range k of the input split into n ranges of
+    about equal bytes by its offset index (see offset_index.py), reading the
+    products straight from their bytes. The range is left in `segments`,
+    for sinks.merge_segments() to assemble with the other ranges. The parts
+    share one `details_file`, so a page is fetched by one part only; the
+    process starting the parts releases the claims of an earlier run and
+    removes the file once the parts are merged.
+    """
     processed_count = 0
-    batch = []
+    reused_count = 0
+    shared_count = 0
+    # Copies waiting on a fetch still in flight here, and those waiting on another part's, by canonical URL
+    waiting = {}
+    elsewhere = {}
+    # Input positions already written by an earlier run into `segments`
+    done = set()
     temp_file = f"{output_file}.tmp"
-    
-    try:
-        with open(input_file, 'r', encoding='utf-8') as f, \
-             open(temp_file, 'w', encoding='utf-8') as out_f:
-            
-            out_f.write('[\n')
-            first_item = True
-            
-            # Custom JSON encoder to handle Decimal objects
-            class DecimalEncoder(json.JSONEncoder):
-                def default(self, obj):
-                    if isinstance(obj, Decimal):
-                        return float(obj)
-                    if isinstance(obj, numbers.Number):
-                        return float(obj)
-                    return super().default(obj)
-
-            # Use ijson to parse the file efficiently
-            for product in ijson.items(f, 'item'):
-                if 'extra_images' in product:
-                    # Write existing product as is
-                    if not first_item:
-                        out_f.write(',\n')
-                    json.dump(product, out_f, ensure_ascii=False, indent=2, cls=DecimalEncoder)
-                    first_item = False
-                    continue
-                
-                # Process product that needs extra_images
-                print(f"\nProcessing product: {product.get('name')}")
-                print(f"URL: {product.get('url')}")
-                
-                details = extract_additional_details(product.get('url'))
-                if details:
-                    product.update(details)
-                    print(f"  - Found {len(details.get('extra_images', []))} additional images")
-                    if details.get('product_code'):
-                        print(f"  - Product code: {details['product_code']}")
-                
-                # Add to batch
+    out_f = None
+    segment_sink = None
+    offsets = None
+    details_file = details_file or f"{output_file}.details"
+    if not segments and os.path.exists(details_file):
+        DetailsMap(details_file).remove()   # left by a failed run; nothing resumes from it
+    fetched = DetailsMap(details_file)
+    if part is None:
+        fetched.release()
+
+    if part is not None:
+        if not segments:
+            raise ValueError("a part of the input is only written to segments")
+        offsets = OffsetIndex(input_file)
+        start, stop = offsets.ranges(part[1])[part[0]]
+        print(f"Part {part[0]}/{part[1]}: products {start}..{stop - 1} of {input_file}")
+    if segments:
+        segment_sink = sinks.SegmentSink(segments, segment_size, source=sinks.file_identity(input_file))
+        for position, _ in segment_sink.committed():
+            done.add(position)
+        if done:
+            print(f"Resuming: {len(done)} products already in {segment_sink.resumed} segments of {segments}")
+    else:
+        out_f = open(temp_file, 'w', encoding='utf-8')
+        out_f.write('[\n')
+    first_item = True
+    # Products finished ahead of an earlier one still being fetched, by position
+    ahead = {}
+    next_position = 0
+
+    def write(position, product):
+        nonlocal first_item, next_position
+        if segment_sink is not None:
+            segment_sink.write(product, position)
+        else:
+            # Fetches finish out of order; the file keeps the input order
+            ahead[position] = product
+            while next_position in ahead:
                 if not first_item:
                     out_f.write(',\n')
-                json.dump(product, out_f, ensure_ascii=False, indent=2, cls=DecimalEncoder)
+                out_f.write(sinks.dumps(ahead.pop(next_position), pretty))
                 first_item = False
-                
-                processed_count += 1
-                if processed_count % batch_size == 0:
-                    print(f"\nProcessed {processed_count} products...")
-                    out_f.flush()
-                    os.fsync(out_f.fileno())
-                
-                # Be nice to the server
-                time.sleep(1)
-            
+                next_position += 1
+        if store is not None:
+            store.upsert_products([product])
+        if search is not None:
+            search.add(product)
+
+    def pending_products():
+        nonlocal reused_count
+        # Stream the products one at a time from the JSON array or NDJSON file, or read those of the part
+        if offsets is not None:
+            records = offsets.iter_range(start, stop)
+        else:
+            records = enumerate(sinks.iter_records(input_file, use_float=True))
+        for position, product in records:
+            if position in done:
+                if index is not None:
+                    index.check(product)   # still listed, so not removed
+                continue
+            details = None
+            if index is not None:
+                _, details = index.check(product)
+            if 'extra_images' in product:
+                # Write existing product as is
+                write(position, product)
+                continue
+            if details:
+                # Listing unchanged since it was last enriched
+                product.update(details)
+                write(position, product)
+                reused_count += 1
+                continue
+            if not product.get('url'):
+                yield position, product
+                continue
+            key = canonical(product['url'])
+            if key in waiting:
+                waiting[key].append((position, product))
+                continue
+            claimed, fetched_before, details = fetched.claim(key)
+            if fetched_before:
+                share(position, product, details)
+            elif claimed:
+                waiting[key] = []
+                yield position, product
+            else:
+                elsewhere.setdefault(key, []).append((position, product))
+
+    def share(position, product, details):
+        nonlocal shared_count
+        if details:
+            product.update(details)
+            if index is not None:
+                index.record(product, details)
+        write(position, product)
+        shared_count += 1
+
+    def handle(item, details):
+        nonlocal processed_count
+        position, product = item
+        print(f"\nProcessed product: {product.get('name')}")
+        print(f"URL: {product.get('url')}")
+        if details:
+            product.update(details)
+            if index is not None:
+                index.record(product, details)
+            print(f"  - Found {len(details.get('extra_images', []))} additional images")
+            if details.get('product_code'):
+                print(f"  - Product code: {details['product_code']}")
+
+        # Stored first, so a run stopping on this write does not fetch the page again on resume.
+        # Failed fetches are not retried for the other copies either
+        key = canonical(product['url']) if product.get('url') else None
+        if key:
+            fetched.store(key, details)
+        write(position, product)
+        for duplicate in waiting.pop(key, []):
+            share(*duplicate, details)
+
+        processed_count += 1
+        if processed_count % batch_size == 0:
+            print(f"\nProcessed {processed_count} products...")
+            if out_f is not None:
+                out_f.flush()
+                os.fsync(out_f.fileno())
+            if index is not None:
+                index.commit()
+            if store is not None:
+                store.commit()
+            if search is not None:
+                search.commit()
+
+    def fetched_elsewhere():
+        """Share the pages other parts fetched; take over those whose part died"""
+        while elsewhere:
+            time.sleep(POLL_INTERVAL)
+            taken = []
+            for key in list(elsewhere):
+                claimed, fetched_before, details = fetched.claim(key)
+                if fetched_before:
+                    for duplicate in elsewhere.pop(key):
+                        share(*duplicate, details)
+                elif claimed:
+                    first, *others = elsewhere.pop(key)
+                    waiting[key] = others
+                    taken.append(first)
+            if taken:
+                fetcher.crawl(taken, lambda item: item[1].get('url'), parse_details, handle, **crawl_options)
+
+    complete = False
+    try:
+        fetcher.crawl(pending_products(), lambda item: item[1].get('url'), parse_details, handle,
+                      **crawl_options)
+        fetched_elsewhere()
+
+        if segment_sink is not None:
+            segment_sink.close()
+            if part is not None:
+                print(f"\nCommitted {segment_sink.count} products of part {part[0]}/{part[1]} to {segments}")
+            else:
+                count = segment_sink.merge(output_file, pretty=pretty)
+                print(f"\nMerged {count} products from {segments} into {output_file}")
+        else:
             out_f.write('\n]')
-        
-        # Replace original file with the updated one
-        os.replace(temp_file, output_file)
-        print(f"\nProcessing complete! Updated {processed_count} products in {output_file}")
-        
+            out_f.close()
+            # Replace original file with the updated one
+            os.replace(temp_file, output_file)
+        complete = True
+        print(f"\nProcessing complete! Updated {processed_count} products"
+              + (f" in {output_file}" if part is None else ''))
+        if shared_count:
+            print(f"Shared fetched details with {shared_count} products listed under several categories")
+        if index is not None:
+            added, changed, removed = index.finish(delta_file)
+            print(f"Reused stored details for {reused_count} unchanged products")
+            print(f"Delta: {added} added, {changed} changed, {removed} removed"
+                  + (f" (saved to {delta_file})" if delta_file else ''))
+
     except Exception as e:
         print(f"Error during processing: {str(e)}")
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
+        if segment_sink is not None:
+            # Keep what is finished: the next run with the same directory resumes from it
+            segment_sink.close()
+            print(f"Kept {len(done) + segment_sink.count} processed products in {segments}; "
+                  f"run again with the same --segments to resume")
+        else:
+            out_f.close()
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
         raise
+    finally:
+        if offsets is not None:
+            offsets.close()
+        # A rerun over the segments resumes with the pages already fetched; the parts' starter removes theirs
+        if part is None and (complete or segment_sink is None):
+            fetched.remove()
+        else:
+            fetched.close()
+
+def start_workers(count, argv, directories):
+    """Run one --part process per range of the input, each into its directory; True when all succeed"""
+    args = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in ('--workers', '--segments'):
+            skip = True
+        elif not arg.startswith(('--workers=', '--segments=')):
+            args.append(arg)
+    workers = [subprocess.Popen([sys.executable, __file__, *args, '--part', f"{k}/{count}",
+                                 '--segments', directory])
+               for k, directory in enumerate(directories)]
+    failed = sum(1 for worker in workers if worker.wait() != 0)
+    if failed:
+        print(f"{failed} of {count} workers failed; run again with the same --workers to resume their parts")
+    return not failed
 
 def main():
-    input_file = 'products.json'
-    output_file = 'products_enhanced.json'
-    
+    parser = add_store_argument(fetcher.add_crawl_arguments(argparse.ArgumentParser()))
+    parser.add_argument('--input', default='products.json',
+                        help='Products from product_scraper.py, as a JSON array or NDJSON (default: %(default)s)')
+    parser.add_argument('--output', default='products_enhanced.json')
+    parser.add_argument('--index', metavar='DB',
+                        help='Fingerprint index; only new or changed products are re-enriched')
+    parser.add_argument('--max-age', type=float, default=fingerprints.DEFAULT_MAX_AGE / 86400,
+                        help='Days before unchanged products are re-enriched anyway (default: %(default)s)')
+    parser.add_argument('--delta', default='products_delta.json',
+                        help='Where --index writes the added/changed/removed product ids (default: %(default)s)')
+    parser.add_argument('--segments', metavar='DIR',
+                        help='Write atomically committed segment files into DIR and merge them at the end; '
+                             'a failed run resumes from them')
+    parser.add_argument('--segment-size', type=int, default=sinks.DEFAULT_SEGMENT_SIZE,
+                        help='Products per segment file (default: %(default)s)')
+    parser.add_argument('--pretty', action='store_true',
+                        help='Indent the output JSON instead of writing one product per line')
+    parser.add_argument('--search', metavar='DB',
+                        help='Also index the products in this search index (see search_index.py)')
+    parser.add_argument('--workers', type=int,
+                        help='Split the input into this many ranges of about equal size, enrich them in '
+                             'parallel processes sharing --rate and --burst, and merge the results; '
+                             'the parts are kept in --segments, by default OUTPUT.parts')
+    parser.add_argument('--part', type=parse_shard, metavar='K/N',
+                        help='Only enrich range K of N of the input into --segments, as each of --workers does')
+    args = parser.parse_args()
+    if (args.workers or args.part) and (args.index or args.search):
+        parser.error("--index and --search need the whole input in one process; "
+                     "index the output with search_index.py --build afterwards")
+    if args.part and not args.segments:
+        parser.error("--part writes its products to --segments")
+    if (args.workers or args.part) and args.input.endswith(('.gz', '.zst')):
+        parser.error("--workers/--part need an uncompressed products file")
+    crawl_options = fetcher.configure(args)
+
+    input_file = args.input
+    output_file = args.output
+
     if not os.path.exists(input_file):
         print(f"Error: {input_file} not found.")
         return
-    
+
+    if args.workers:
+        # Build the offset index once, before the workers read it
+        with OffsetIndex(input_file) as offsets:
+            print(f"Enriching {offsets.count()} products from {input_file} in {args.workers} parts")
+        base = args.segments or f"{output_file}.parts"
+        directories = [os.path.join(base, f"{k + 1}-of-{args.workers}") for k in range(args.workers)]
+        # The parts share the pages fetched; those an earlier run left claimed are fetched again
+        fetched = DetailsMap(f"{output_file}.details")
+        fetched.release()
+        argv = fetcher.worker_arguments(sys.argv[1:], args, args.workers)
+        if not start_workers(args.workers, argv, directories):
+            fetched.close()
+            return
+        count = sinks.merge_segments(directories, output_file, pretty=args.pretty)
+        fetched.remove()
+        try:
+            os.rmdir(base)
+        except OSError:
+            pass   # something else lives there too
+        print(f"\nMerged {count} products from {args.workers} parts into {output_file}")
+        return
+
+    index = fingerprints.FingerprintIndex(args.index, max_age=args.max_age * 86400) if args.index else None
+    store = open_store(args)
+    search = SearchIndex(args.search) if args.search else None
     print(f"Starting to process products from {input_file}")
-    process_products(input_file, output_file)
+    try:
+        process_products(input_file, output_file, index=index, delta_file=args.delta, store=store,
+                         segments=args.segments, segment_size=args.segment_size, pretty=args.pretty,
+                         search=search, part=args.part, **crawl_options)
+    finally:
+        if index is not None:
+            index.close()
+        if store is not None:
+            store.close()
+        if search is not None:
+            search.close()
+    print(fetcher.format_stats())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,197 @@
+"""Store each product once, with every (category, model, brand) it is listed under.
+
+    python product_index.py products.sqlite --export products.json
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+import sinks
+from fingerprints import product_key
+from frontier import DEFAULT_LEASE, default_worker
+
+# Fields product_scraper adds to say where a product was listed
+PLACEMENT_FIELDS = ('category_id', 'category_name', 'model_id', 'model_name', 'brand_id', 'brand_name')
+
+
+class ProductIndex:
+    """Distinct products and the many-to-many mapping to the categories listing them
+
+    The same part is listed under many models and categories; the index keeps
+    one copy of its listing fields, as first seen, and one placement row per
+    category.
+    """
+
+    def __init__(self, path, commit_every=sinks.DEFAULT_FSYNC_EVERY):
+        self.path = path
+        self.commit_every = commit_every
+        self.count = 0
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS products (
+                key TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS placements (
+                product_key TEXT NOT NULL,
+                category_id TEXT NOT NULL,
+                category_name TEXT,
+                model_id TEXT,
+                model_name TEXT,
+                brand_id TEXT,
+                brand_name TEXT,
+                PRIMARY KEY (product_key, category_id)
+            );
+            CREATE INDEX IF NOT EXISTS placements_category ON placements (category_id);
+        ''')
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def add(self, product):
+        """Record a listed product and the category it was listed under"""
+        key = product_key(product)
+        listing = {field: value for field, value in product.items() if field not in PLACEMENT_FIELDS}
+        # Latest listing wins, but the product keeps the position it was first seen at
+        self.db.execute('INSERT INTO products (key, data) VALUES (?, ?) '
+                        'ON CONFLICT (key) DO UPDATE SET data = excluded.data',
+                        (key, json.dumps(listing, ensure_ascii=False)))
+        if product.get('category_id') is not None:
+            self.db.execute(
+                'INSERT INTO placements VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (product_key, category_id) '
+                'DO UPDATE SET category_name = excluded.category_name, model_id = excluded.model_id, '
+                'model_name = excluded.model_name, brand_id = excluded.brand_id, brand_name = excluded.brand_name',
+                (key, *(product.get(field) for field in PLACEMENT_FIELDS)))
+
+    def write(self, product):
+        """Sink interface for product_scraper: add a product and commit every `commit_every`"""
+        self.add(product)
+        self.count += 1
+        if self.commit_every and self.count % self.commit_every == 0:
+            self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def counts(self):
+        """(distinct products, placements)"""
+        return (self.db.execute('SELECT COUNT(*) FROM products').fetchone()[0],
+                self.db.execute('SELECT COUNT(*) FROM placements').fetchone()[0])
+
+    def products(self):
+        """Each product once, in the order first seen, with a `placements` list
+
+        The hierarchy fields of its first placement are kept on the product so
+        it reads like a product_scraper record.
+        """
+        placements = self.db.cursor()
+        for key, data in self.db.execute('SELECT key, data FROM products ORDER BY rowid'):
+            product = json.loads(data)
+            rows = placements.execute(
+                f"SELECT {', '.join(PLACEMENT_FIELDS)} FROM placements WHERE product_key = ? ORDER BY rowid",
+                (key,)).fetchall()
+            product['placements'] = [dict(zip(PLACEMENT_FIELDS, row)) for row in rows]
+            if product['placements']:
+                product.update(product['placements'][0])
+            yield product
+
+    def export(self, path, fsync_every=sinks.DEFAULT_FSYNC_EVERY):
+        """Write the distinct products to a JSON array or NDJSON file; returns how many"""
+        with sinks.RecordSink(path, fsync_every=fsync_every) as sink:
+            for product in self.products():
+                sink.write(product)
+        return sink.count
+
+
+class DetailsMap:
+    """Details fetched during one enrichment run, by canonical detail URL
+
+    Lets process_products fetch each detail page once per run without
+    keeping every page's details in memory. The processes enriching parts of
+    one input share the file: a page is claimed before it is fetched, and the
+    other parts wait for its details instead of fetching it too. A claim
+    still unfinished after `lease` seconds, its process having died, can be
+    taken over. Failed fetches are stored too, with no details.
+    """
+
+    def __init__(self, path, lease=DEFAULT_LEASE, worker=None):
+        self.path = path
+        self.lease = lease
+        self.worker = worker or default_worker()
+        # Claims are committed one at a time so the other parts see them at once
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.executescript('''
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                claimed_at REAL NOT NULL,
+                done INTEGER NOT NULL DEFAULT 0,
+                details TEXT
+            );
+        ''')
+
+    def close(self):
+        self.db.close()
+
+    def remove(self):
+        """Close and delete the file, once the run it served is complete"""
+        self.close()
+        for path in (self.path, f"{self.path}-wal", f"{self.path}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def release(self):
+        """Drop the unfinished claims of a run that stopped, so their pages are fetched again"""
+        self.db.execute('DELETE FROM pages WHERE done = 0')
+
+    def claim(self, url):
+        """(claimed, done, details) of a page; claimed is True when this process is to fetch it"""
+        now = time.time()
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self.db.execute('INSERT OR IGNORE INTO pages (url, owner, claimed_at) VALUES (?, ?, ?)',
+                            (url, self.worker, now))
+            self.db.execute('UPDATE pages SET owner = ?, claimed_at = ? '
+                            'WHERE url = ? AND done = 0 AND owner != ? AND claimed_at < ?',
+                            (self.worker, now, url, self.worker, now - self.lease))
+            owner, done, details = self.db.execute('SELECT owner, done, details FROM pages WHERE url = ?',
+                                                   (url,)).fetchone()
+        finally:
+            self.db.execute('COMMIT')
+        return (owner == self.worker and not done, bool(done),
+                json.loads(details) if details is not None else None)
+
+    def store(self, url, details):
+        """Record the details fetched for a claimed page, None when the fetch failed"""
+        self.db.execute('UPDATE pages SET done = 1, details = ? WHERE url = ?',
+                        (json.dumps(details, ensure_ascii=False) if details is not None else None, url))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('db', help='Index written by product_scraper.py --dedup')
+    parser.add_argument('--export', metavar='FILE', help='Write the distinct products with their placements')
+    args = parser.parse_args()
+
+    index = ProductIndex(args.db)
+    try:
+        products, placements = index.counts()
+        print(f"{products} distinct products in {placements} category listings")
+        if args.export:
+            print(f"Saved {index.export(args.export)} products to {args.export}")
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    main()
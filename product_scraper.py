@@ -1,142 +1,170 @@
+import argparse
+import copy
 import json
-import re
-import time
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
-
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7",
-    "Accept-Language": "en-US,en;q=0.9"
-}
-
-def clean_price(price_str):
-    """Extract numeric price from string"""
-    if not price_str:
-        return None
-    # Remove non-numeric characters except comma and dot
-    clean = re.sub(r'[^\d,.]', '', price_str)
-    # Replace comma with dot and convert to float
-    return float(clean.replace(',', '.'))
-
-def scrape_products(category_url):
-    """Scrape products from a single category URL"""
+from collections import deque
+import fetcher
+import sinks
+from catalog_store import add_store_argument, open_store
+from hierarchy import with_category
+from product_index import ProductIndex
+from parsers import merge_pages, page_url, parse_listing, parse_products
+from urls import canonical
+
+def scrape_products(category_url, **crawl_options):
+    """Scrape products from a single category URL, following its pagination"""
     print(f"Scraping products from: {category_url}")
     try:
-        response = requests.get(category_url, headers=HEADERS, timeout=20)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        products = []
-        
-        # Find all product rows
-        rows = soup.find_all('tr', class_='viewItemList__row')
-        if not rows:
-            print(f"No product rows found in {category_url}")
-            return []
-            
-        for row in rows:
-            try:
-                # Get product cells
-                cells = row.find_all('td', class_=lambda x: x and 'oxcell' in x and 'oxfirstcol' not in x)
-                
-                for cell in cells:
-                    # Skip empty cells
-                    if not cell.get('data-pdt-id'):
-                        continue
-                        
-                    # Extract product ID and SKU
-                    product_id = cell.get('data-pdt-id')
-                    sku = cell.get('data-pdt-sku', '').strip()
-                    
-                    # Get product name
-                    name_tag = cell.find('h3', class_='PBMainTxt')
-                    name = name_tag.get_text(strip=True) if name_tag else 'Unnamed Product'
-                    
-                    # Get product URL
-                    link_tag = cell.find('a', class_='PBLink')
-                    product_url = urljoin(category_url, link_tag['href']) if link_tag and 'href' in link_tag.attrs else None
-                    
-                    # Get image URL
-                    img_tag = cell.find('img', class_='imgthumbnail')
-                    img_url = urljoin(category_url, img_tag['src']) if img_tag and 'src' in img_tag.attrs else None
-                    
-                    # Get price
-                    price_tag = cell.find('span', class_='PBSalesPrice')
-                    price = clean_price(price_tag.get_text(strip=True)) if price_tag else None
-                    
-                    # Get stock status
-                    stock_status = 'Out of Stock'
-                    stock_qty = 0
-                    stock_tag = cell.find('span', class_='PBMsgInStock')
-                    if stock_tag:
-                        stock_status = stock_tag.get_text(strip=True)
-                        # Try to extract quantity if available
-                        qty_match = re.search(r'\((\d+)', cell.text)
-                        if qty_match:
-                            stock_qty = int(qty_match.group(1))
-                    
-                    products.append({
-                        'id': product_id,
-                        'sku': sku,
-                        'name': name,
-                        'url': product_url,
-                        'image_url': img_url,
-                        'price': price,
-                        'stock_status': stock_status,
-                        'stock_quantity': stock_qty
-                    })
-                    
-            except Exception as e:
-                print(f"Error processing product: {str(e)}")
-                continue
-                
-        return products
-        
+        products, pages = parse_listing(fetcher.fetch(category_url, stage='listing'), category_url)
     except Exception as e:
         print(f"Error scraping {category_url}: {str(e)}")
         return []
+    if pages == 1:
+        return products
+
+    # Fetch the remaining pages concurrently and merge them in page order
+    results = {1: products}
+
+    def handle(item, page_products):
+        results[item[0]] = page_products or []
+
+    urls = [(page, page_url(category_url, page)) for page in range(2, pages + 1)]
+    fetcher.crawl(urls, lambda item: item[1], parse_products, handle, stage='listing', **crawl_options)
+    return merge_pages(results[page] for page in sorted(results))
+
+def listing_url(url, params):
+    """Category URL with the extra --listing-param query parameters appended"""
+    if not params:
+        return url
+    return f"{url}{'&' if '?' in url else '?'}{'&'.join(params)}"
+
+def scrape_listings(categories, finish, params=(), parse=parse_listing, **crawl_options):
+    """Scrape the listings of many categories concurrently, following their pagination
+
+    finish(index, products, pages, failed) is called as soon as every page of
+    categories[index] is in, with its products merged in page order; `failed`
+    counts the pages that could not be fetched or parsed and were taken as empty.
+    `parse` returns (products, page count) like parse_listing; parse_listing_stock
+    only reads price and stock.
+
+    Categories whose listing URLs are equivalent, such as one category linked
+    from several models, share one fetch; each gets its own copy of the products.
+    """
+    # Categories whose pages are still coming in: index -> (page count, {page: products}, failed pages)
+    listings = {}
+    # Later pages found on first pages; they are fetched ahead of the next categories
+    more_pages = deque()
+    groups = {}
+    for index, category in enumerate(categories):
+        groups.setdefault(canonical(listing_url(category['url'], params)), []).append(index)
+    # First category of a group -> the others sharing its listing
+    sharing = {group[0]: group[1:] for group in groups.values()}
+    first_pages = ((index, 1, listing_url(categories[index]['url'], params)) for index in sharing)
+
+    def pages_to_fetch():
+        for item in first_pages:
+            yield item
+            while more_pages:
+                yield more_pages.popleft()
+        while more_pages:
+            yield more_pages.popleft()
+
+    def handle(item, result):
+        index, page, url = item
+        # A page that failed counts as empty so its category still completes
+        products, pages = result or ([], 1)
+        if page == 1:
+            listings[index] = (pages, {}, [])
+            more_pages.extend((index, n, page_url(url, n)) for n in range(2, pages + 1))
+        pages, results, failed = listings[index]
+        results[page] = products
+        if result is None:
+            failed.append(page)
+        if len(results) == pages:
+            del listings[index]
+            products = merge_pages(results[page] for page in sorted(results))
+            # Copied before the first finish() adds its category to the products
+            copies = [copy.deepcopy(products) for _ in sharing[index]]
+            finish(index, products, pages, len(failed))
+            for other, products_copy in zip(sharing[index], copies):
+                finish(other, products_copy, pages, len(failed))
+
+    # Pages found after the last category was handed out need another round
+    while True:
+        fetcher.crawl(pages_to_fetch(), lambda item: item[2], parse, handle, **crawl_options)
+        if not more_pages:
+            break
 
 def main():
+    parser = add_store_argument(fetcher.add_crawl_arguments(argparse.ArgumentParser()))
+    parser.add_argument('--input', default='model_categories.json')
+    parser.add_argument('--output', default='products.json',
+                        help='.json for a JSON array, .ndjson[.gz|.zst] to stream one product per line '
+                             '(default: %(default)s)')
+    parser.add_argument('--fsync-every', type=int, default=sinks.DEFAULT_FSYNC_EVERY,
+                        help='Products written between fsyncs (default: %(default)s)')
+    parser.add_argument('--listing-param', action='append', default=[], metavar='KEY=VALUE',
+                        help='Extra query parameter for every category listing, e.g. a larger page size '
+                             '(repeatable)')
+    parser.add_argument('--dedup', metavar='DB',
+                        help='Store each product once in this index, with every category listing it, '
+                             'and write the distinct products to --output at the end')
+    args = parser.parse_args()
+    crawl_options = fetcher.configure(args)
+
     # Load categories from the existing JSON file
     try:
-        with open('model_categories.json', 'r', encoding='utf-8') as f:
+        with open(args.input, 'r', encoding='utf-8') as f:
             categories = json.load(f)
     except FileNotFoundError:
-        print("Error: model_categories.json not found. Please run category_scraper.py first.")
+        print(f"Error: {args.input} not found. Please run category_scraper.py first.")
         return
-    
-    all_products = []
+
     total_categories = len(categories)
-    
-    for i, category in enumerate(categories, 1):
-        print(f"\nProcessing category {i}/{total_categories}: {category['name']} (Model: {category['model_name']})")
-        products = scrape_products(category['url'])
-        
-        # Add category, model, and brand references to each product
-        for product in products:
-            product.update({
-                'category_id': category['id'],
-                'category_name': category['name'],
-                'model_id': category['model_id'],
-                'model_name': category['model_name'],
-                'brand_id': category['brand_id'],
-                'brand_name': category['brand_name']
-            })
-        
-        all_products.extend(products)
-        print(f"Found {len(products)} products in {category['name']}")
-        
-        # Be nice to the server
-        time.sleep(2)
-    
-    # Save all products to a new JSON file
-    output_file = 'products.json'
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(all_products, f, ensure_ascii=False, indent=2)
-    
-    print(f"\nScraping complete! Found {len(all_products)} products across {total_categories} categories.")
-    print(f"Results saved to {output_file}")
+    done = 0
+    store = open_store(args)
+
+    if args.dedup:
+        sink = ProductIndex(args.dedup, commit_every=args.fsync_every)
+    else:
+        sink = sinks.RecordSink(args.output, fsync_every=args.fsync_every)
+    # Products of categories finished ahead of an earlier one, by category index
+    ahead = {}
+    next_index = 0
+    with sink:
+        def finish(index, products, pages, failed):
+            nonlocal done, next_index
+            category = categories[index]
+            with_category(category, products)
+            # Categories finish out of order; products are written in the order of the input categories
+            ahead[index] = products
+            while next_index in ahead:
+                for product in ahead.pop(next_index):
+                    sink.write(product)
+                next_index += 1
+            if store:
+                store.upsert_products(products)
+                store.commit()
+
+            done += 1
+            over = f" over {pages} pages" if pages > 1 else ''
+            print(f"[{done}/{total_categories}] Found {len(products)} products{over} in {category['name']} (Model: {category['model_name']})")
+
+        scrape_listings(categories, finish, args.listing_param, **crawl_options)
+
+    print(f"\nScraping complete! Found {sink.count} products across {total_categories} categories.")
+    if args.dedup:
+        index = ProductIndex(args.dedup)
+        try:
+            products, placements = index.counts()
+            print(f"{products} distinct products in {placements} category listings")
+            index.export(args.output, fsync_every=args.fsync_every)
+        finally:
+            index.close()
+    print(f"Results saved to {args.output}")
+    if store:
+        store.close()
+        print(f"Results stored in {args.store}")
+    print(fetcher.format_stats())
 
 if __name__ == "__main__":
     main()
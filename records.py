@@ -0,0 +1,204 @@
+"""Compact in-memory catalogue: slotted records that reference their parents by index.
+
+The JSON files repeat every parent's id and name in each child: a product
+carries six hierarchy fields and two long URLs. A Catalog keeps one Brand,
+Model and Category record per distinct parent and has each child point at
+its parent by list index. Repeated strings are interned. A URL that contains
+the record's id or SKU is stored as the shared text around it. records()
+gives back the dicts of the JSON files, same keys in the same order.
+
+    catalog = Catalog.load(categories='model_categories.json', products='products.json')
+    catalog.counts()
+    for product in catalog.records('products'): ...
+"""
+import sys
+from catalog_store import LISTING_FIELDS
+import sinks
+
+BRAND_FIELDS = ('brand_id', 'brand_name')
+MODEL_FIELDS = ('model_id', 'model_name')
+CATEGORY_FIELDS = ('category_id', 'category_name')
+# Own fields holding URLs, and the fields whose value they often contain
+URL_FIELDS = ('url', 'image_url')
+URL_KEYS = ('id', 'sku')
+
+
+class Record:
+    """Own fields in slots, the parent as an index into the parent kind's list
+
+    `layout` is the shared tuple of the record's keys in their original order,
+    None for a parent that was only referenced by its children; `extra` holds
+    the keys that are neither own nor hierarchy fields, such as product details.
+    """
+    __slots__ = ('parent', 'layout', 'extra')
+    FIELDS = ()
+
+    def __init__(self, values, parent=-1, layout=None, extra=None):
+        for name, value in zip(self.FIELDS, values):
+            setattr(self, name, value)
+        self.parent = parent
+        self.layout = layout
+        self.extra = extra
+
+
+class Brand(Record):
+    __slots__ = ('id', 'name', 'url', 'image_url')
+    FIELDS = __slots__
+
+
+class Model(Record):
+    __slots__ = ('id', 'name', 'url', 'image_url')
+    FIELDS = __slots__
+
+
+class Category(Record):
+    __slots__ = ('id', 'name', 'url', 'image_url')
+    FIELDS = __slots__
+
+
+class Product(Record):
+    __slots__ = LISTING_FIELDS
+    FIELDS = __slots__
+
+
+# kind: (record class, kind of its parent, the fields its id and name are copied into in its children,
+#        hierarchy fields naming its parent and the parent's ancestors)
+KINDS = {
+    'brands': (Brand, None, BRAND_FIELDS, ()),
+    'models': (Model, 'brands', MODEL_FIELDS, BRAND_FIELDS),
+    'categories': (Category, 'models', CATEGORY_FIELDS, MODEL_FIELDS + BRAND_FIELDS),
+    'products': (Product, 'categories', (), CATEGORY_FIELDS + MODEL_FIELDS + BRAND_FIELDS),
+}
+
+
+def intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class Catalog:
+    """Brands, models, categories and products as lists of slotted records
+
+    Every record added is kept, duplicates included, so records() returns
+    the input unchanged. Parents are identified by their id and name plus
+    those of their own parents. A parent first seen through its children is
+    filled in when its own record is added later.
+    """
+
+    def __init__(self):
+        self.tables = {kind: [] for kind in KINDS}
+        # kind -> {(id, name, *hierarchy values): index}
+        self.keys = {kind: {} for kind in KINDS}
+        # Shared layouts and URL affixes: one tuple per distinct value
+        self.shared = {}
+
+    @classmethod
+    def load(cls, brands=None, models=None, categories=None, products=None):
+        """Catalog from the scrapers' JSON or NDJSON files, parents first"""
+        catalog = cls()
+        for kind, path in (('brands', brands), ('models', models), ('categories', categories),
+                           ('products', products)):
+            if path:
+                for record in sinks.iter_records(path, use_float=True):
+                    catalog.add(kind, record)
+        return catalog
+
+    def share(self, value):
+        return self.shared.setdefault(value, value)
+
+    def parent_index(self, kind, values):
+        """Index of the `kind` record identified by `values`, added as a placeholder when missing"""
+        keys = self.keys[kind]
+        index = keys.get(values)
+        if index is None:
+            record_class, parent_kind, _, _ = KINDS[kind]
+            parent = self.parent_index(parent_kind, values[2:]) if parent_kind else -1
+            table = self.tables[kind]
+            index = keys[values] = len(table)
+            table.append(record_class((intern(values[0]), intern(values[1])), parent))
+        return index
+
+    def add(self, kind, record):
+        """Store a record dict of `kind` and return its index"""
+        record_class, parent_kind, _, hierarchy = KINDS[kind]
+        fields = record_class.FIELDS
+        parent = -1
+        if hierarchy and all(field in record for field in hierarchy):
+            parent = self.parent_index(parent_kind, tuple(record[field] for field in hierarchy))
+        else:
+            hierarchy = ()
+        extra = {key: value for key, value in record.items() if key not in fields and key not in hierarchy}
+        values = [self.compact(record, record.get(field)) if field in URL_FIELDS else intern(record.get(field))
+                  for field in fields]
+        compact = record_class(values, parent, self.share(tuple(record)), extra or None)
+
+        table = self.tables[kind]
+        if kind == 'products':
+            table.append(compact)
+            return len(table) - 1
+        keys = self.keys[kind]
+        key = (record.get('id'), record.get('name')) + tuple(record[field] for field in hierarchy)
+        index = keys.get(key)
+        if index is not None and table[index].layout is None:
+            # Fill in the placeholder its children made
+            table[index] = compact
+            return index
+        table.append(compact)
+        keys.setdefault(key, len(table) - 1)
+        return len(table) - 1
+
+    def compact(self, record, url):
+        """A URL as a shared (prefix, key field, suffix) around the record's id or SKU when it has one"""
+        if type(url) is not str:
+            return url
+        for field in URL_KEYS:
+            value = record.get(field)
+            if type(value) is str and value and value in url:
+                before, _, after = url.partition(value)
+                return self.share((before, field, after))
+        return sys.intern(url)
+
+    def expand(self, compact, url):
+        if type(url) is tuple:
+            before, field, after = url
+            return before + getattr(compact, field) + after
+        return url
+
+    def hierarchy(self, kind, index):
+        """{hierarchy field: value} naming record `index` of `kind` and its ancestors"""
+        values = {}
+        while index >= 0:
+            record = self.tables[kind][index]
+            _, parent_kind, (id_field, name_field), _ = KINDS[kind]
+            values[id_field] = record.id
+            values[name_field] = record.name
+            kind = parent_kind
+            index = record.parent
+        return values
+
+    def record(self, kind, index):
+        """Record `index` of `kind` as the dict it was added from"""
+        compact = self.tables[kind][index]
+        parent_kind = KINDS[kind][1]
+        parents = self.hierarchy(parent_kind, compact.parent) if parent_kind and compact.parent >= 0 else {}
+        extra = compact.extra or {}
+        result = {}
+        for key in compact.layout or compact.FIELDS:
+            if key in URL_FIELDS:
+                result[key] = self.expand(compact, getattr(compact, key))
+            elif key in compact.FIELDS:
+                result[key] = getattr(compact, key)
+            elif key in extra:
+                result[key] = extra[key]
+            else:
+                result[key] = parents[key]
+        return result
+
+    def records(self, kind):
+        """The records of `kind` that were added, as dicts, in the order they were added"""
+        for index, compact in enumerate(self.tables[kind]):
+            if compact.layout is not None:
+                yield self.record(kind, index)
+
+    def counts(self):
+        """{kind: records} including parents only referenced by their children"""
+        return {kind: len(table) for kind, table in self.tables.items()}
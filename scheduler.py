@@ -0,0 +1,327 @@
+"""Keep prices and stock fresh by revisiting category listings on a priority schedule.
+
+    python scheduler.py --input model_categories.json --store catalog.sqlite   # run forever
+    python scheduler.py --once --fast --changes stock_changes.ndjson           # visit what is due, then exit
+    python scheduler.py --hot 4260412 --interval hot=300                       # watch a category closely
+    python scheduler.py --status
+"""
+import argparse
+import hashlib
+import json
+import sqlite3
+import time
+import fetcher
+import sinks
+from catalog_store import add_store_argument, open_store
+from fingerprints import product_key
+from hierarchy import with_category
+from parsers import parse_listing, parse_listing_stock
+from product_scraper import scrape_listings
+
+DEFAULT_DB = 'schedule.sqlite'
+BATCH_SIZE = 50
+
+# Priority tiers, most urgent first, and the seconds between two visits of a category in each
+TIERS = ('hot', 'active', 'static')
+DEFAULT_INTERVALS = {'hot': 15 * 60, 'active': 2 * 3600, 'static': 24 * 3600}
+# Unchanged visits before an active category drops back to static
+DEFAULT_COOL_AFTER = 3
+# Seconds before a category whose listing failed is tried again, at most its tier's interval
+RETRY_DELAY = 5 * 60
+# Longest sleep between two checks for due categories, so new hot marks are picked up
+MAX_IDLE = 60
+
+
+def stock_state(product):
+    """(price, stock status, stock quantity) of a listed product"""
+    price = product.get('price')
+    return (float(price) if price is not None else None, product.get('stock_status'),
+            product.get('stock_quantity'))
+
+
+def listing_hash(products):
+    """Hash of which products a category lists and their price and stock"""
+    state = sorted((product_key(product), *stock_state(product)) for product in products)
+    return hashlib.sha1(json.dumps(state, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class RefreshScheduler:
+    """SQLite-backed visit schedule of the category listings
+
+    Every category sits in a priority tier: `hot` when marked by hand,
+    `active` when a visit found a product added, removed, repriced or with
+    a different stock, `static` otherwise. A category is due again
+    `intervals[tier]` seconds after its last visit, and due categories are
+    handed out most urgent tier first, then longest overdue first. An active
+    category falls back to static after `cool_after` visits without change.
+
+    The price and stock last seen of every product are kept too, so a visit
+    can report exactly which products changed.
+    """
+
+    def __init__(self, path, intervals=None, cool_after=DEFAULT_COOL_AFTER):
+        self.intervals = dict(DEFAULT_INTERVALS, **(intervals or {}))
+        self.cool_after = cool_after
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS categories (
+                url TEXT PRIMARY KEY,
+                id TEXT,
+                data TEXT NOT NULL,
+                tier TEXT NOT NULL,
+                hot INTEGER NOT NULL DEFAULT 0,
+                next_due REAL NOT NULL,
+                last_visit REAL,
+                last_change REAL,
+                listing_hash TEXT,
+                unchanged INTEGER NOT NULL DEFAULT 0,
+                visits INTEGER NOT NULL DEFAULT 0,
+                changes INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS categories_due ON categories (next_due);
+            CREATE INDEX IF NOT EXISTS categories_id ON categories (id);
+            CREATE TABLE IF NOT EXISTS stock (
+                key TEXT PRIMARY KEY,
+                price REAL,
+                stock_status TEXT,
+                stock_quantity INTEGER,
+                updated_at REAL NOT NULL
+            );
+        ''')
+        # Shorter intervals than the previous run's apply at once
+        with self.db:
+            for tier, interval in self.intervals.items():
+                self.db.execute('UPDATE categories SET next_due = MIN(next_due, last_visit + ?) '
+                                'WHERE tier = ? AND last_visit IS NOT NULL', (interval, tier))
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def add(self, categories):
+        """Schedule new categories for a first visit now; returns how many were new"""
+        now = time.time()
+        cursor = self.db.executemany(
+            'INSERT OR IGNORE INTO categories (url, id, data, tier, next_due) VALUES (?, ?, ?, ?, ?)',
+            [(category['url'], category.get('id'), json.dumps(category, ensure_ascii=False), 'static', now)
+             for category in categories if category.get('url')])
+        self.db.commit()
+        return cursor.rowcount
+
+    def mark(self, category_ids, hot=True):
+        """Mark categories hot, due now, or put them back to a normal tier"""
+        now = time.time()
+        changed = 0
+        with self.db:
+            for category_id in category_ids:
+                if hot:
+                    changed += self.db.execute(
+                        'UPDATE categories SET hot = 1, tier = ?, next_due = MIN(next_due, ?) WHERE id = ?',
+                        ('hot', now, category_id)).rowcount
+                else:
+                    changed += self.db.execute(
+                        '''UPDATE categories SET hot = 0,
+                               tier = CASE WHEN unchanged < ? AND last_change IS NOT NULL THEN ? ELSE ? END
+                           WHERE id = ?''',
+                        (self.cool_after, 'active', 'static', category_id)).rowcount
+        return changed
+
+    def due(self, limit, now=None):
+        """Up to `limit` categories due for a visit, most urgent first"""
+        now = time.time() if now is None else now
+        rank = ' '.join(f"WHEN '{tier}' THEN {n}" for n, tier in enumerate(TIERS))
+        rows = self.db.execute(
+            f'''SELECT data, tier FROM categories WHERE next_due <= ?
+                ORDER BY CASE tier {rank} END, next_due LIMIT ?''', (now, limit)).fetchall()
+        return [dict(json.loads(data), tier=tier) for data, tier in rows]
+
+    def next_due(self):
+        """Time the next category falls due, or None when nothing is scheduled"""
+        return self.db.execute('SELECT MIN(next_due) FROM categories').fetchone()[0]
+
+    def visited(self, category, products):
+        """Record a successful visit; returns the products whose price or stock changed, new ones included"""
+        now = time.time()
+        changed = []
+        rows = []
+        for product in products:
+            key = product_key(product)
+            state = stock_state(product)
+            row = self.db.execute('SELECT price, stock_status, stock_quantity FROM stock WHERE key = ?',
+                                  (key,)).fetchone()
+            if row != state:
+                changed.append(product)
+                rows.append((key, *state, now))
+        self.db.executemany('INSERT OR REPLACE INTO stock VALUES (?, ?, ?, ?, ?)', rows)
+
+        current = listing_hash(products)
+        previous, hot, unchanged = self.db.execute(
+            'SELECT listing_hash, hot, unchanged FROM categories WHERE url = ?', (category['url'],)).fetchone()
+        # The first visit only sets the baseline
+        is_change = previous is not None and previous != current
+        unchanged = 0 if is_change else unchanged + 1
+        if hot:
+            tier = 'hot'
+        elif is_change or (unchanged < self.cool_after and category['tier'] == 'active'):
+            tier = 'active'
+        else:
+            tier = 'static'
+        self.db.execute(
+            '''UPDATE categories SET tier = ?, next_due = ?, last_visit = ?, listing_hash = ?, unchanged = ?,
+                   visits = visits + 1, changes = changes + ?,
+                   last_change = CASE WHEN ? THEN ? ELSE last_change END
+               WHERE url = ?''',
+            (tier, now + self.intervals[tier], now, current, unchanged, int(is_change),
+             is_change, now, category['url']))
+        self.db.commit()
+        return changed
+
+    def failed(self, category):
+        """Try a category whose listing could not be read again soon, keeping its tier"""
+        now = time.time()
+        self.db.execute('UPDATE categories SET next_due = ? WHERE url = ?',
+                        (now + min(RETRY_DELAY, self.intervals[category['tier']]), category['url']))
+        self.db.commit()
+
+    def counts(self):
+        """{tier: (categories, due now)}"""
+        now = time.time()
+        return {tier: (n, due) for tier, n, due in self.db.execute(
+            'SELECT tier, COUNT(*), SUM(next_due <= ?) FROM categories GROUP BY tier', (now,))}
+
+
+def refresh(schedule, categories, listing_params, crawl_options, store=None, changes=None, fast=False):
+    """Visit due categories, record what changed; returns (products seen, products changed)
+
+    With `fast`, listings are read by parse_listing_stock: products carry only
+    their id, SKU, price and stock, and only the price and stock of products
+    already in the store are updated.
+    """
+    seen = 0
+    changed_total = 0
+
+    def finish(index, products, pages, failed):
+        nonlocal seen, changed_total
+        category = categories[index]
+        if failed:
+            schedule.failed(category)
+            print(f"[{category['tier']}] {category['name']}: {failed} of {pages} pages failed, retrying later")
+            return
+        with_category(category, products)
+        changed = schedule.visited(category, products)
+        if store:
+            if fast:
+                store.update_stock(products)
+            else:
+                store.upsert_products(products)
+            store.commit()
+        if changes and changed:
+            stamp = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+            for product in changed:
+                changes.write(sinks.dumps(dict(product, seen_at=stamp)))
+                changes.write('\n')
+            changes.flush()
+        seen += len(products)
+        changed_total += len(changed)
+        print(f"[{category['tier']}] {category['name']} (Model: {category['model_name']}): "
+              f"{len(products)} products, {len(changed)} with new price or stock")
+
+    scrape_listings(categories, finish, listing_params, parse_listing_stock if fast else parse_listing,
+                    **crawl_options)
+    return seen, changed_total
+
+
+def parse_intervals(values):
+    """{tier: seconds} from TIER=SECONDS arguments"""
+    intervals = {}
+    for value in values:
+        tier, _, seconds = value.partition('=')
+        if tier not in TIERS:
+            raise SystemExit(f"Unknown tier {tier!r} in --interval, expected one of {', '.join(TIERS)}")
+        intervals[tier] = float(seconds)
+    return intervals
+
+
+def main():
+    parser = add_store_argument(fetcher.add_crawl_arguments(argparse.ArgumentParser(
+        description=__doc__.splitlines()[0])))
+    parser.add_argument('--db', default=DEFAULT_DB, help='Schedule database (default: %(default)s)')
+    parser.add_argument('--input', default='model_categories.json',
+                        help='Categories to schedule; new ones are added on every start (default: %(default)s)')
+    parser.add_argument('--changes', metavar='FILE',
+                        help='Append the products whose price or stock changed to this NDJSON file')
+    parser.add_argument('--interval', action='append', default=[], metavar='TIER=SECONDS',
+                        help='Seconds between visits of a tier: '
+                             + ', '.join(f"{tier}={seconds:g}" for tier, seconds in DEFAULT_INTERVALS.items())
+                             + ' by default (repeatable)')
+    parser.add_argument('--cool-after', type=int, default=DEFAULT_COOL_AFTER,
+                        help='Unchanged visits before an active category becomes static (default: %(default)s)')
+    parser.add_argument('--hot', action='append', default=[], metavar='CATEGORY_ID',
+                        help='Mark a category hot (repeatable)')
+    parser.add_argument('--cold', action='append', default=[], metavar='CATEGORY_ID',
+                        help='Remove the hot mark of a category (repeatable)')
+    parser.add_argument('--listing-param', action='append', default=[], metavar='KEY=VALUE',
+                        help='Extra query parameter for every category listing (repeatable)')
+    parser.add_argument('--fast', action='store_true',
+                        help='Only read price and stock from the listings, without parsing the rest of the page')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='Categories visited per round (default: %(default)s)')
+    parser.add_argument('--once', action='store_true', help='Visit the categories due now, then exit')
+    parser.add_argument('--status', action='store_true', help='Print the categories per tier and exit')
+    args = parser.parse_args()
+
+    schedule = RefreshScheduler(args.db, parse_intervals(args.interval), args.cool_after)
+    store = None
+    changes = None
+    try:
+        try:
+            with open(args.input, 'r', encoding='utf-8') as f:
+                added = schedule.add(json.load(f))
+            if added:
+                print(f"Scheduled {added} new categories from {args.input}")
+        except FileNotFoundError:
+            if not schedule.next_due():
+                print(f"Error: {args.input} not found. Please run category_scraper.py first.")
+                return
+        if args.hot:
+            print(f"Marked {schedule.mark(args.hot)} categories hot")
+        if args.cold:
+            print(f"Removed the hot mark of {schedule.mark(args.cold, hot=False)} categories")
+        if args.status:
+            for tier, (count, due) in schedule.counts().items():
+                print(f"{tier}: {count} categories, {due} due, every {schedule.intervals[tier]:g}s")
+            return
+        if schedule.next_due() is None:
+            print(f"Error: no categories to schedule; {args.input} lists none.")
+            return
+
+        crawl_options = fetcher.configure(args)
+        store = open_store(args)
+        changes = open(args.changes, 'a', encoding='utf-8') if args.changes else None
+        # With --once, categories that fall due again during the run wait for the next one
+        started = time.time() if args.once else None
+        while True:
+            due = schedule.due(args.batch_size, started)
+            if due:
+                seen, changed = refresh(schedule, due, args.listing_param, crawl_options, store, changes,
+                                        args.fast)
+                print(f"Visited {len(due)} categories: {seen} products, {changed} changed. "
+                      f"Tiers: {json.dumps(schedule.counts())}")
+                continue
+            if args.once:
+                break
+            wait = min(MAX_IDLE, max(0, schedule.next_due() - time.time()))
+            time.sleep(wait)
+    except KeyboardInterrupt:
+        print("\nStopped")
+    finally:
+        schedule.close()
+        if store:
+            store.close()
+        if changes:
+            changes.close()
+    print(fetcher.format_stats())
+
+if __name__ == "__main__":
+    main()
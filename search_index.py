@@ -0,0 +1,244 @@
+"""Full-text part search over the enriched products, persisted in SQLite FTS5.
+
+    python search_index.py parts.sqlite --build products_enhanced.json
+    python search_index.py parts.sqlite "rétroviseur gauche" --brand ADLY
+    python search_index.py parts.sqlite 940-9779
+"""
+import argparse
+import hashlib
+import json
+import re
+import sqlite3
+import time
+import unicodedata
+from fingerprints import product_key
+import sinks
+
+DEFAULT_LIMIT = 20
+# Column weights for bm25(): a hit in the name or a code counts most
+WEIGHTS = (10.0, 8.0, 2.0, 1.0)
+WORD = re.compile(r'\w+')
+# Words too common in part names to narrow a search down
+STOP_WORDS = {'a', 'au', 'aux', 'avec', 'd', 'de', 'des', 'du', 'en', 'et', 'l', 'la', 'le', 'les', 'pour',
+              'sur', 'un', 'une'}
+
+SCHEMA = '''
+    PRAGMA journal_mode = WAL;
+    CREATE TABLE IF NOT EXISTS parts (
+        id INTEGER PRIMARY KEY,
+        key TEXT UNIQUE NOT NULL,
+        digest TEXT NOT NULL,
+        data TEXT NOT NULL
+    );
+    -- Brands and models a part is listed under, for the filters
+    CREATE TABLE IF NOT EXISTS placements (
+        part INTEGER NOT NULL,
+        brand_id TEXT NOT NULL,
+        brand_key TEXT NOT NULL,
+        model_id TEXT NOT NULL,
+        model_key TEXT NOT NULL,
+        PRIMARY KEY (part, brand_id, model_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS placements_brand ON placements (brand_id);
+    CREATE INDEX IF NOT EXISTS placements_brand_key ON placements (brand_key);
+    CREATE INDEX IF NOT EXISTS placements_model ON placements (model_id);
+    CREATE INDEX IF NOT EXISTS placements_model_key ON placements (model_key);
+    -- Folded words, with prefix indexes for search-as-you-type
+    CREATE VIRTUAL TABLE IF NOT EXISTS words USING fts5(
+        name, code, specifications, description, tokenize = 'unicode61', prefix = '2 3 4');
+    -- Trigrams of the same text: partial codes and misspelled words
+    CREATE VIRTUAL TABLE IF NOT EXISTS grams USING fts5(text, tokenize = 'trigram');
+'''
+
+
+def fold(text):
+    """Lowercase text without accents: "Boîte à Vitesse" -> "boite a vitesse" """
+    if not text:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def query_words(query):
+    """Folded words of a query, without stop words and single letters"""
+    return [word for word in WORD.findall(fold(query))
+            if word not in STOP_WORDS and (len(word) > 1 or word.isdigit())]
+
+
+def trigrams(words):
+    grams = []
+    for word in words:
+        for start in range(len(word) - 2):
+            gram = word[start:start + 3]
+            if gram not in grams:
+                grams.append(gram)
+    return grams
+
+
+def document(product):
+    """Folded (name, codes, specifications, description) of a product"""
+    codes = ' '.join(str(product[field]) for field in ('product_code', 'sku', 'id') if product.get(field))
+    specifications = product.get('specifications') or {}
+    specs = ' '.join(f"{key} {value}" for key, value in specifications.items())
+    return (fold(product.get('name')), fold(codes), fold(specs), fold(product.get('description')))
+
+
+class SearchIndex:
+    """Inverted index of the parts in products_enhanced.json, ranked with bm25
+
+    Each distinct product is indexed once, with a placement row for every
+    brand and model listing it. Adding a product again only re-indexes it
+    when its text changed, so the index can be fed every product the
+    enrichment writes. Queries match codes and whole words first, then word
+    prefixes, then shared trigrams, which find partial codes and misspelled
+    names.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, product):
+        """Index a product, or add its placement; True when its text was (re)indexed"""
+        key = product_key(product)
+        if not key:
+            return False
+        text = document(product)
+        digest = hashlib.sha1('\0'.join(text).encode('utf-8')).hexdigest()
+        data = sinks.dumps(product)
+        row = self.db.execute('SELECT id, digest FROM parts WHERE key = ?', (key,)).fetchone()
+        indexed = False
+        if row is None:
+            part = self.db.execute('INSERT INTO parts (key, digest, data) VALUES (?, ?, ?)',
+                                   (key, digest, data)).lastrowid
+            indexed = True
+        else:
+            part, previous = row
+            self.db.execute('UPDATE parts SET digest = ?, data = ? WHERE id = ?', (digest, data, part))
+            if previous != digest:
+                self.db.execute('DELETE FROM words WHERE rowid = ?', (part,))
+                self.db.execute('DELETE FROM grams WHERE rowid = ?', (part,))
+                indexed = True
+        if indexed:
+            self.db.execute('INSERT INTO words (rowid, name, code, specifications, description) '
+                            'VALUES (?, ?, ?, ?, ?)', (part, *text))
+            self.db.execute('INSERT INTO grams (rowid, text) VALUES (?, ?)', (part, ' '.join(text)))
+        if product.get('brand_id') or product.get('model_id'):
+            self.db.execute(
+                'INSERT OR IGNORE INTO placements (part, brand_id, brand_key, model_id, model_key) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (part, str(product.get('brand_id') or ''), fold(product.get('brand_name')),
+                 str(product.get('model_id') or ''), fold(product.get('model_name'))))
+        return indexed
+
+    def build(self, path, commit_every=sinks.DEFAULT_FSYNC_EVERY):
+        """Index every product of a JSON or NDJSON file; returns (products read, parts indexed)"""
+        count = indexed = 0
+        for product in sinks.iter_records(path, use_float=True):
+            count += 1
+            indexed += self.add(product)
+            if count % commit_every == 0:
+                self.commit()
+        self.optimize()
+        return count, indexed
+
+    def optimize(self):
+        """Merge the FTS segments after a bulk load, which keeps queries fast"""
+        with self.db:
+            self.db.execute("INSERT INTO words (words) VALUES ('optimize')")
+            self.db.execute("INSERT INTO grams (grams) VALUES ('optimize')")
+
+    def search(self, query, limit=DEFAULT_LIMIT, brand=None, model=None):
+        """Best matching products, as dicts, for a query; `brand` and `model` are ids or names
+
+        Matches come in rounds until `limit` is reached: the query as a
+        product code when it has digits, every word exactly, every word as a
+        prefix, then shared trigrams. Each round is ranked with bm25.
+        """
+        words = query_words(query)
+        if not words:
+            return []
+        filters = ''
+        params = []
+        for column, value in (('brand', brand), ('model', model)):
+            if value:
+                filters += f' AND +rowid IN (SELECT part FROM placements WHERE {column}_id = ? OR {column}_key = ?)'
+                params += [str(value), fold(value)]
+        weights = ', ' + ', '.join(str(weight) for weight in WEIGHTS)
+        rounds = []
+        if any(char.isdigit() for char in query):
+            # Stop words stay in: the "A" of "4-A" is part of the code
+            code = ' '.join(WORD.findall(fold(query)))
+            rounds.append(('words', weights, f'code : "{code}"'))
+        rounds.append(('words', weights, ' '.join(f'"{word}"' for word in words)))
+        rounds.append(('words', weights, ' '.join(f'"{word}"*' for word in words)))
+        grams = trigrams(words)
+        if grams:
+            rounds.append(('grams', '', ' OR '.join(f'"{gram}"' for gram in grams)))
+
+        found = []
+        for table, table_weights, expression in rounds:
+            if len(found) >= limit:
+                break
+            exclude = f" AND +rowid NOT IN ({', '.join('?' * len(found))})" if found else ''
+            # Rank inside the FTS table; only the best rows are read from parts
+            found += [part for (part,) in self.db.execute(
+                f'SELECT rowid FROM {table} WHERE {table} MATCH ?{filters}{exclude} '
+                f'ORDER BY bm25({table}{table_weights}) LIMIT ?',
+                [expression, *params, *found, limit - len(found)])]
+        data = dict(self.db.execute(f"SELECT id, data FROM parts WHERE id IN ({', '.join('?' * len(found))})",
+                                    found))
+        return [sinks.loads(data[part]) for part in found]
+
+    def counts(self):
+        parts = self.db.execute('SELECT COUNT(*) FROM parts').fetchone()[0]
+        placements = self.db.execute('SELECT COUNT(*) FROM placements').fetchone()[0]
+        return {'parts': parts, 'placements': placements}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('db', help='Search index file')
+    parser.add_argument('query', nargs='?', help='Part name, description words or product code')
+    parser.add_argument('--build', metavar='FILE',
+                        help='Index the products of FILE, e.g. products_enhanced.json; '
+                             'products already indexed are only updated')
+    parser.add_argument('--brand', help='Only parts listed under this brand, by id or name')
+    parser.add_argument('--model', help='Only parts listed under this model, by id or name')
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT, help='Results (default: %(default)s)')
+    args = parser.parse_args()
+
+    with SearchIndex(args.db) as index:
+        if args.build:
+            start = time.perf_counter()
+            count, indexed = index.build(args.build)
+            print(f"Indexed {indexed} of {count} products from {args.build} "
+                  f"in {time.perf_counter() - start:.1f} s: {json.dumps(index.counts())}")
+        if args.query:
+            start = time.perf_counter()
+            results = index.search(args.query, args.limit, args.brand, args.model)
+            elapsed = (time.perf_counter() - start) * 1000
+            for product in results:
+                code = product.get('product_code') or product.get('sku') or ''
+                print(f"{product.get('id')}\t{code}\t{product.get('brand_name', '')}\t"
+                      f"{product.get('model_name', '')}\t{product.get('name')}")
+            print(f"{len(results)} results in {elapsed:.1f} ms")
+        elif not args.build:
+            print(json.dumps(index.counts()))
+
+if __name__ == "__main__":
+    main()
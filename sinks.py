@@ -0,0 +1,303 @@
+import gzip
+import heapq
+import io
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import ijson
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for .zst files
+    zstandard = None
+
+try:
+    import orjson
+except ImportError:  # optional, a faster JSON encoder and decoder
+    orjson = None
+
+DEFAULT_FSYNC_EVERY = 100
+DEFAULT_SEGMENT_SIZE = 500
+DEFAULT_SEGMENT_WRITERS = 2
+SEGMENT_NAME = 'segment-{:06d}.ndjson'
+SEGMENT_PATTERN = re.compile(r'segment-(\d+)\.ndjson$')
+MANIFEST_NAME = 'manifest.json'
+
+
+def _open_binary(path, mode, name=None):
+    """Open path for binary reading or writing, compressed according to the extension of name or path"""
+    name = name or path
+    if name.endswith('.gz'):
+        return gzip.open(path, mode)
+    if name.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f"{path}: install the 'zstandard' package to read or write .zst files")
+        raw = open(path, mode)
+        if 'w' in mode:
+            return zstandard.ZstdCompressor().stream_writer(raw)
+        return zstandard.ZstdDecompressor().stream_reader(raw)
+    return open(path, mode)
+
+
+def _json_default(obj):
+    # ijson hands back numbers as Decimal unless asked for floats
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(record, pretty=False):
+    """Encode a record as JSON text, on one line or indented by two spaces with `pretty`
+
+    orjson does the encoding when it is installed; the text is the same
+    either way except for exponents, written 1e16 rather than 1e+16.
+    """
+    if orjson is not None:
+        return orjson.dumps(record, default=_json_default,
+                            option=orjson.OPT_INDENT_2 if pretty else 0).decode('utf-8')
+    if pretty:
+        return json.dumps(record, ensure_ascii=False, indent=2, default=_json_default)
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+
+def loads(text):
+    """Decode JSON text, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def is_ndjson(path):
+    """True for .ndjson / .jsonl files, compressed or not"""
+    base = path[:-3] if path.endswith('.gz') else path[:-4] if path.endswith('.zst') else path
+    return base.endswith(('.ndjson', '.jsonl'))
+
+
+class RecordSink:
+    """Write records to a file as they arrive, fsyncing every `fsync_every` records
+
+    NDJSON (.ndjson/.jsonl, optionally .gz or .zst) gets one compact record per
+    line, so a partial file is still readable up to the last complete line.
+    Any other path is written as a JSON array, indented as the scrapers have
+    always produced it or with one compact record per line when `pretty` is
+    false; that is only valid once complete, so it goes to a .tmp file that
+    replaces `path` on close.
+    """
+
+    def __init__(self, path, fsync_every=DEFAULT_FSYNC_EVERY, pretty=True):
+        self.path = path
+        self.ndjson = is_ndjson(path)
+        self.pretty = pretty and not self.ndjson
+        self.fsync_every = fsync_every
+        self.count = 0
+        self.target = path if self.ndjson else f"{path}.tmp"
+        self.raw = _open_binary(self.target, 'wb', name=path)
+        self.out = io.TextIOWrapper(self.raw, encoding='utf-8')
+        if not self.ndjson:
+            self.out.write('[\n')
+
+    def write(self, record):
+        if self.ndjson:
+            self.out.write(dumps(record))
+            self.out.write('\n')
+        else:
+            if self.count:
+                self.out.write(',\n')
+            self.out.write(dumps(record, self.pretty))
+        self.count += 1
+        if self.fsync_every and self.count % self.fsync_every == 0:
+            self.flush()
+
+    def flush(self):
+        """Push everything written so far down to the disk"""
+        self.out.flush()
+        if zstandard is not None and isinstance(self.raw, zstandard.ZstdCompressionWriter):
+            self.raw.flush(zstandard.FLUSH_BLOCK)
+        elif isinstance(self.raw, gzip.GzipFile):
+            self.raw.flush()
+        fileobj = getattr(self.raw, 'fileobj', None) or self.raw
+        fileobj.flush()
+        os.fsync(fileobj.fileno())
+
+    def close(self, complete=True):
+        """Finish the file; an incomplete JSON array is left in its .tmp file"""
+        if complete and not self.ndjson:
+            self.out.write('\n]' if self.count else ']')
+        self.flush()
+        self.out.close()
+        if complete and self.target != self.path:
+            os.replace(self.target, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(complete=exc_type is None)
+
+
+def iter_records(path, use_float=False):
+    """Yield the records of a JSON array or NDJSON file one at a time"""
+    with _open_binary(path, 'rb') as f:
+        if is_ndjson(path):
+            for line in io.TextIOWrapper(f, encoding='utf-8'):
+                if line.strip():
+                    yield loads(line)
+        else:
+            yield from ijson.items(f, 'item', use_float=use_float)
+
+
+def _write_segment(path, entries):
+    """Write (position, record) entries to path through a fsynced temporary file"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        for position, record in entries:
+            f.write(dumps({'position': position, 'record': record}))
+            f.write('\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return path
+
+
+def segment_paths(directory):
+    """Committed segment files of a directory, in the order they were written"""
+    if not os.path.isdir(directory):
+        return []
+    names = sorted((int(match.group(1)), name) for name in os.listdir(directory)
+                   for match in [SEGMENT_PATTERN.match(name)] if match)
+    return [os.path.join(directory, name) for _, name in names]
+
+
+def iter_segment(path):
+    """Yield the (position, record) pairs of a segment, by increasing position"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = loads(line)
+                yield entry['position'], entry['record']
+
+
+class SegmentSink:
+    """Write records to numbered NDJSON segments, each one committed atomically
+
+    Records are buffered with their position in the input; every
+    `segment_size` of them are sorted and handed to a pool of `writers`
+    threads that write, fsync and rename a new segment into place, so the
+    fsyncs never hold up the caller. A segment exists complete or not at
+    all, and close() commits what is buffered even after an error: a rerun
+    over the same directory skips the positions already committed, and
+    merge() assembles the output in input order once everything is in.
+
+    `source` identifies the input (see file_identity()); it is kept in the
+    directory's manifest so segments of another input are never resumed.
+    """
+
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE, writers=DEFAULT_SEGMENT_WRITERS,
+                 source=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.count = 0
+        self.buffer = []
+        self.futures = []
+        self._check_manifest(source)
+        existing = segment_paths(directory)
+        self.resumed = len(existing)
+        self.number = int(SEGMENT_PATTERN.search(existing[-1]).group(1)) + 1 if existing else 1
+        self.executor = ThreadPoolExecutor(max_workers=writers, thread_name_prefix='segment')
+
+    def _check_manifest(self, source):
+        path = os.path.join(self.directory, MANIFEST_NAME)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            if source is not None and manifest.get('source') != source:
+                raise ValueError(f"{self.directory} holds segments of another input "
+                                 f"({manifest.get('source')}); remove it or use another directory")
+            return
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump({'source': source, 'segment_size': self.segment_size}, f, indent=2)
+        os.replace(f"{path}.tmp", path)
+
+    def committed(self):
+        """Yield the (position, record) pairs of the segments committed so far"""
+        for path in segment_paths(self.directory):
+            yield from iter_segment(path)
+
+    def write(self, record, position):
+        """Buffer a record; it must not be modified afterwards"""
+        self.buffer.append((position, record))
+        self.count += 1
+        if len(self.buffer) >= self.segment_size:
+            self.commit()
+
+    def commit(self):
+        """Hand the buffered records to a writer as a new segment"""
+        # Re-raise the error of a write that already failed rather than piling up more segments
+        for future in [future for future in self.futures if future.done()]:
+            future.result()
+            self.futures.remove(future)
+        if not self.buffer:
+            return
+        entries = sorted(self.buffer, key=lambda entry: entry[0])
+        self.buffer = []
+        path = os.path.join(self.directory, SEGMENT_NAME.format(self.number))
+        self.number += 1
+        self.futures.append(self.executor.submit(_write_segment, path, entries))
+
+    def close(self):
+        """Commit the buffered records and wait for every segment to be on disk"""
+        try:
+            self.commit()
+        finally:
+            self.executor.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
+        self.futures = []
+
+    def merge(self, path, fsync_every=DEFAULT_FSYNC_EVERY, remove=True, pretty=True):
+        """Stream every committed record into path, in input order; returns the record count
+
+        With `remove`, the directory is emptied once path is complete.
+        """
+        return merge_segments([self.directory], path, fsync_every, remove, pretty)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def merge_segments(directories, path, fsync_every=DEFAULT_FSYNC_EVERY, remove=True, pretty=True):
+    """Stream the records committed in SegmentSink directories into path, in input order
+
+    Segments are each sorted, so a heap merge reads them side by side
+    without loading them; directories written by workers over disjoint
+    ranges of the same input merge into one file. With `remove`, the
+    directories are emptied once path is complete. Returns the record count.
+    """
+    paths = [segment for directory in directories for segment in segment_paths(directory)]
+    with RecordSink(path, fsync_every=fsync_every, pretty=pretty) as sink:
+        for _, record in heapq.merge(*(iter_segment(p) for p in paths), key=lambda entry: entry[0]):
+            sink.write(record)
+    if remove:
+        for segment in paths:
+            os.remove(segment)
+        for directory in directories:
+            manifest = os.path.join(directory, MANIFEST_NAME)
+            if os.path.exists(manifest):
+                os.remove(manifest)
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass   # something else lives there too
+    return sink.count
+
+
+def file_identity(path):
+    """Path, size and modification time of a file, to recognise it again"""
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
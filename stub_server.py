@@ -0,0 +1,95 @@
+import hashlib
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PAGE = b"""<html><body><table>
+<tr class="viewItemList__row"><td class="oxcell" data-pdt-id="1" data-pdt-sku="SKU1">
+<h3 class="PBMainTxt">Stub product</h3><span class="PBSalesPrice">12,50 &euro;</span>
+</td></tr>
+</table></body></html>"""
+
+
+class StubServer:
+    """Local HTTP server answering every GET or HEAD with a canned page after a fixed latency
+
+    `pages` maps request paths (including the query string) to page bytes;
+    any other path gets `default_page`, or a 404 when that is None. Pages carry
+    an ETag and a matching If-None-Match gets a 304. A fraction `error_rate`
+    of requests is answered with `error_status` instead, to simulate an
+    overloaded server; both can be changed while the server runs.
+    """
+
+    def __init__(self, pages=None, default_page=DEFAULT_PAGE, latency=0.05, port=0, error_rate=0.0,
+                 error_status=503):
+        self.pages = pages or {}
+        self.default_page = default_page
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.not_modified = 0
+        self.errors = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes; without this keep-alive
+            # responses stall on delayed ACKs and the stub becomes the bottleneck
+            disable_nagle_algorithm = True
+
+            def do_HEAD(self):
+                self.do_GET(head=True)
+
+            def do_GET(self, head=False):
+                stub.requests += 1
+                time.sleep(stub.latency)
+                body = stub.pages.get(self.path, stub.default_page)
+                if stub.error_rate and random.random() < stub.error_rate:
+                    stub.errors += 1
+                    self.send_response(stub.error_status)
+                    self.send_header('Retry-After', '0')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if body is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()
+                if self.headers.get('If-None-Match') == etag:
+                    stub.not_modified += 1
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if not head:
+                    self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,140 @@
+import threading
+import time
+from urllib import robotparser
+from urllib.parse import urlparse
+import requests
+import http_client
+
+DEFAULT_MAX_RATE_FACTOR = 4       # --max-rate defaults to this times --rate
+DEFAULT_LATENCY_TARGET = 2.0      # seconds to first byte above which the server counts as struggling
+DEFAULT_DECREASE = 0.5            # multiplicative decrease on trouble
+DEFAULT_COOLDOWN = 5.0            # seconds between two decreases, so one burst of errors counts once
+MIN_RATE = 0.05
+
+
+def crawl_delay(text, agent):
+    """Crawl-delay for agent, read directly because robotparser ignores fractional values like 0.5"""
+    agent = agent.split('/')[0].lower()
+    delays = {}
+    group = []
+    in_rules = False
+    for line in text.splitlines():
+        field, _, value = line.split('#')[0].partition(':')
+        field, value = field.strip().lower(), value.strip()
+        if field == 'user-agent':
+            if in_rules:
+                group = []
+                in_rules = False
+            group.append(value.lower())
+        elif field:
+            in_rules = True
+            if field == 'crawl-delay':
+                try:
+                    delay = float(value)
+                except ValueError:
+                    continue
+                for name in group:
+                    delays.setdefault(name, delay)
+    for name, delay in delays.items():
+        if name != '*' and name in agent:
+            return delay
+    return delays.get('*')
+
+
+class AdaptiveThrottle:
+    """AIMD control of the request rate and of the requests in flight per host
+
+    Every page reports how its request went. A 429, a 5xx or a connection
+    error on any attempt, or a time to first byte above `latency_target`,
+    halves the rate and the concurrency (at most once per `cooldown`). Each
+    window of healthy responses, as many as the current concurrency, adds
+    `increase` requests per second and one request in flight, up to
+    `max_rate` and `max_concurrency`. The rate never exceeds what a host's
+    robots.txt allows through Crawl-delay or Request-rate.
+    """
+
+    def __init__(self, rate, concurrency, max_rate=None, max_concurrency=None, min_rate=MIN_RATE,
+                 latency_target=DEFAULT_LATENCY_TARGET, increase=None, decrease=DEFAULT_DECREASE,
+                 cooldown=DEFAULT_COOLDOWN, robots=True):
+        self.max_rate = max_rate or rate * DEFAULT_MAX_RATE_FACTOR
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.concurrency = concurrency
+        self.max_concurrency = max(concurrency, max_concurrency or concurrency)
+        self.latency_target = latency_target
+        self.increase = increase or max(rate / 10, MIN_RATE)
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.robots = robots
+        self.delays = {}          # host -> Crawl-delay in seconds, or None
+        self.healthy = 0
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+        self.bucket = None
+
+    def attach(self, bucket):
+        """Drive the rate of a fetcher.TokenBucket"""
+        self.bucket = bucket
+        bucket.set_rate(self.rate)
+
+    def check_robots(self, url):
+        """Load the Crawl-delay of url's host once and cap the rate by it; blocking"""
+        parts = urlparse(url)
+        host = parts.netloc
+        if not self.robots or host in self.delays:
+            return
+        delay = None
+        try:
+            response = http_client.get(f"{parts.scheme}://{host}/robots.txt", retries=1)
+            parser = robotparser.RobotFileParser()
+            parser.parse(response.text.splitlines())
+            agent = http_client.HEADERS['User-Agent']
+            delay = crawl_delay(response.text, agent)
+            request_rate = parser.request_rate(agent)
+            if request_rate and request_rate.requests:
+                delay = max(delay or 0, request_rate.seconds / request_rate.requests)
+        except requests.RequestException:
+            pass   # no robots.txt: nothing to honour
+        with self.lock:
+            self.delays[host] = float(delay) if delay else None
+            if delay:
+                self.max_rate = min(self.max_rate, 1 / float(delay))
+                self.min_rate = min(self.min_rate, self.max_rate)
+                print(f"robots.txt for {host}: Crawl-delay {delay}s, rate capped at {self.max_rate:.2f}/s")
+                self._set(min(self.rate, self.max_rate), self.concurrency)
+
+    def observe(self, timings, error=None):
+        """Adjust to the outcome of one request, given the timings from http_client.last_request()"""
+        statuses = list(timings.get('retry_statuses') or [])
+        if timings.get('status') is not None:
+            statuses.append(timings['status'])
+        trouble = [status for status in statuses if status == 429 or isinstance(status, str) or status >= 500]
+        if error and not statuses:
+            trouble = [type(error).__name__]   # failed before any response
+        slow = timings.get('ttfb') is not None and timings['ttfb'] > self.latency_target
+        with self.lock:
+            if trouble or slow:
+                self.healthy = 0
+                now = time.monotonic()
+                if now - self.last_decrease < self.cooldown:
+                    return
+                self.last_decrease = now
+                self._set(max(self.min_rate, self.rate * self.decrease),
+                          max(1, int(self.concurrency * self.decrease)))
+                reason = f"{trouble[-1]}" if trouble else f"a {timings['ttfb']:.1f}s response"
+                print(f"Throttle: backing off after {reason}, {self.rate:.2f} req/s, {self.concurrency} in flight")
+                return
+            self.healthy += 1
+            if self.healthy >= self.concurrency:
+                self.healthy = 0
+                self._set(min(self.max_rate, self.rate + self.increase),
+                          min(self.max_concurrency, self.concurrency + 1))
+
+    def _set(self, rate, concurrency):
+        self.rate = rate
+        self.concurrency = concurrency
+        if self.bucket is not None:
+            self.bucket.set_rate(rate)
+
+    def format_stats(self):
+        return f"Throttle: ended at {self.rate:.2f} req/s with {self.concurrency} requests in flight per host"
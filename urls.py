@@ -0,0 +1,50 @@
+"""Canonical catalogue URLs, so equivalent links are fetched, queued and cached once.
+
+The site's links carry a volatile ActionID, the display name of the category
+in PBCATName, often with unencoded accents and spaces, and the shop's AccID.
+Two links to the same page differ in those. canonical() keeps what
+identifies the page, such as PBCATID, ItmID, CatID and the page number,
+and any other parameter, since --listing-param options change the page.
+"""
+import re
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
+
+# Listing pagination parameter
+PAGE_PARAM = 'PBCurrentPage'
+# Parameters that never change which page is served, compared case-insensitively
+IGNORED_PARAMS = {'actionid', 'pbcatname', 'accid'}
+# Characters left as they are when re-encoding a URL: reserved ones and existing escapes
+SAFE = "!#$%&'()*+,/:;=?@[]~"
+UNSAFE = re.compile(r"[^A-Za-z0-9\-._~!#$%&'()*+,/:;=?@\[\]]")
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def requote(url):
+    """URL with unencoded characters, such as accents and spaces, percent-encoded"""
+    # Most links are already clean; quote() only for the ones that are not
+    return quote(url, safe=SAFE) if url and UNSAFE.search(url) else url
+
+
+def query_param(url, name):
+    """Decoded value of a query parameter, or None"""
+    for key, value in parse_qsl(urlsplit(url).query, keep_blank_values=True):
+        if key == name:
+            return value
+    return None
+
+
+def canonical(url):
+    """Key shared by every URL of the same page
+
+    The scheme and host are lowercased, default ports and fragments dropped,
+    the ignored parameters and page 1 removed, and the remaining parameters
+    decoded, sorted and encoded one way.
+    """
+    parts = urlsplit(requote(url.strip()))
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    params = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                    if key.lower() not in IGNORED_PARAMS and not (key == PAGE_PARAM and value == '1'))
+    return urlunsplit((scheme, host, parts.path or '/', urlencode(params, quote_via=quote), ''))